@@ -1,10 +1,85 @@
 from django.contrib import admin
-from django.utils.crypto import get_random_string
+from django.contrib.admin.views.main import PAGE_VAR
 from django.contrib.auth.admin import UserAdmin
 from django.urls import path, reverse
 from django.shortcuts import render, redirect
 from django.contrib import messages
+from django.http import HttpResponse
+from django.utils import timezone
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
 from .models import *
+from .catalog import get_catalog
+from .search import contact_term_q, guest_term_q
+from .invitations import INVITATION_MAX_COUNT, generate_invitation_codes, invitation_csv
+
+
+class EstimatedCountPaginator(Paginator):
+    """件数を上限つきで数えるページネーター
+
+    大きな表で COUNT(*) が全件を走査しないよう、count_limit 件まで数えたところで打ち切る。
+    上限を超える表でも、表示中のページの次のページまでは数えるので「次へ」で先に進める。
+    """
+    count_limit = 10000
+
+    def __init__(self, *args, page_number=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.page_number = page_number
+
+    @cached_property
+    def count(self):
+        # 上限未満なら実件数。上限に達した場合は次ページに1件以上あることだけ分かればよい
+        limit = max(self.count_limit, (self.page_number + 1) * self.per_page + 1)
+        return self.object_list.order_by()[:limit].count()
+
+
+class EstimatedCountAdminMixin:
+    """一覧の件数を EstimatedCountPaginator で数える"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        try:
+            page_number = max(int(request.GET.get(PAGE_VAR, 1)), 1)
+        except ValueError:
+            page_number = 1
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, page_number=page_number)
+
+
+class OfficeListFilter(admin.SimpleListFilter):
+    title = '管理所'
+    parameter_name = 'office'
+
+    def lookups(self, request, model_admin):
+        return [(office.id, office.name) for office in get_catalog().offices]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(facilityItem__facility__office_id=self.value())
+        return queryset
+
+
+class FacilityItemListFilter(admin.SimpleListFilter):
+    """設備の絞り込み（全設備を並べないよう、管理所を選んだときだけその管理所の設備を表示）"""
+    title = '設備'
+    parameter_name = 'item'
+
+    def lookups(self, request, model_admin):
+        catalog = get_catalog()
+        office = catalog.office(request.GET.get(OfficeListFilter.parameter_name))
+        if office is None:
+            return []
+        return [
+            (item.id, f"{facility.name} - {item.item_name}")
+            for facility in catalog.facilities_of(office.id)
+            for item in catalog.items_of(facility.id)
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(facilityItem_id=self.value())
+        return queryset
+
 
 @admin.register(CustomUser)
 class CustomUserAdmin(UserAdmin):
@@ -37,6 +112,15 @@ class FacilityTimeSlotInline(admin.TabularInline):
 @admin.register(Facility)
 class FacilityAdmin(admin.ModelAdmin):
     inlines = [FacilityTimeSlotInline]
+    search_fields = ('name',)
+
+# 予約の設備欄のオートコンプリート用
+@admin.register(FacilityItem)
+class FacilityItemAdmin(admin.ModelAdmin):
+    list_display = ('item_name', 'facility')
+    list_select_related = ('facility',)
+    search_fields = ('item_name', 'facility__name')
+    ordering = ('facility_id', 'item_name')
 
 @admin.register(ManagerProfile)
 class ManagerProfileAdmin(admin.ModelAdmin):
@@ -44,19 +128,41 @@ class ManagerProfileAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'office__name')
 
 @admin.register(TemporaryReservationUser)
-class TemporaryReservationUserAdmin(admin.ModelAdmin):
+class TemporaryReservationUserAdmin(EstimatedCountAdminMixin, admin.ModelAdmin):
     list_display = ('full_name', 'phone', 'email')
-    search_fields = ('full_name', 'phone', 'email')
+    # 検索は get_search_results で前方一致（インデックスの範囲検索）に置き換える
+    search_fields = ('full_name',)
+    search_help_text = '氏名・電話番号・メールアドレスの前方一致'
+    ordering = ('-id',)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(guest_term_q(search_term)), False
 
 @admin.register(Reservation)
-class ReservationAdmin(admin.ModelAdmin):
+class ReservationAdmin(EstimatedCountAdminMixin, admin.ModelAdmin):
     list_display = ('facilityItem', 'date', 'start_time', 'end_time', 'user', 'guest', 'created_at')
-    list_filter = ('facilityItem', 'date')
-    search_fields = ('user__username', 'guest__full_name')
+    list_select_related = ('facilityItem__facility', 'user', 'guest')
+    list_filter = (OfficeListFilter, FacilityItemListFilter)
+    date_hierarchy = 'date'
+    autocomplete_fields = ('facilityItem', 'user', 'guest')
+    # 検索は get_search_results で連絡先（ReservationContact）の前方一致に置き換える
+    search_fields = ('contact__name',)
+    search_help_text = '予約者の氏名・電話番号・メールアドレスの前方一致'
+    # reservation_order_idx の並びと一致させ、並べ替えをインデックスで済ませる
+    ordering = ('-date', 'start_time', 'id')
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(contact_term_q(search_term)), False
 
 @admin.register(InvitationCode)
-class InvitationCodeAdmin(admin.ModelAdmin):
+class InvitationCodeAdmin(EstimatedCountAdminMixin, admin.ModelAdmin):
     list_display = ('code', 'community', 'is_used', 'created_at')
+    list_select_related = ('community',)
+    search_fields = ('code',)
 
     def get_urls(self):
         urls = super().get_urls()
@@ -76,18 +182,32 @@ class InvitationCodeAdmin(admin.ModelAdmin):
             community_id = request.POST.get('community')
             try:
                 community = ManagementOffice.objects.get(pk=community_id)
-            except ManagementOffice.DoesNotExist:
+            except (ManagementOffice.DoesNotExist, ValueError):
                 messages.error(request, "管理所が見つかりません。")
                 return redirect('admin:reservations_invitationcode_generate')
+            try:
+                count = int(request.POST.get('count') or 1)
+            except ValueError:
+                count = 0
+            if not 1 <= count <= INVITATION_MAX_COUNT:
+                messages.error(request, f"生成する件数は1〜{INVITATION_MAX_COUNT}件で指定してください。")
+                return redirect('admin:reservations_invitationcode_generate')
+
+            codes = generate_invitation_codes(community, count)
+            if count == 1:
+                messages.success(request, f"{community.name}の招待コード「{codes[0]}」を生成しました。")
+                return redirect('admin:reservations_invitationcode_changelist')
 
-            code = get_random_string(length=8).upper()
-            InvitationCode.objects.create(code=code, community=community)
-            messages.success(request, f"{community.name}の招待コード「{code}」を生成しました。")
-            return redirect('admin:reservations_invitationcode_changelist')
+            # 複数件はその場で CSV としてダウンロードさせる
+            response = HttpResponse(invitation_csv(community, codes), content_type='text/csv; charset=utf-8')
+            filename = f"invitation_codes_{community.id}_{timezone.localtime():%Y%m%d%H%M%S}.csv"
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+            return response
 
         communities = ManagementOffice.objects.all()
         context = dict(
             self.admin_site.each_context(request),
             communities=communities,
+            max_count=INVITATION_MAX_COUNT,
         )
         return render(request, 'admin/invitationcode_generate.html', context)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ReservationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'reservations'
+
+    def ready(self):
+        # シグナルハンドラ（空き状況インデックスの更新）を登録
+        from . import signals  # noqa: F401
@@ -0,0 +1,61 @@
+import datetime
+from django.conf import settings
+from django.db import transaction
+from .models import Reservation, ReservationArchive, FacilityItemAvailability
+from .signals import signals_muted
+
+
+def archive_horizon(days=None):
+    """この日付より前の予約を保管の対象にする（既定は settings.RESERVATION_ARCHIVE_DAYS 日前）"""
+    if days is None:
+        days = settings.RESERVATION_ARCHIVE_DAYS
+    return datetime.date.today() - datetime.timedelta(days=days)
+
+
+def archive_batch(cutoff, batch_size):
+    """cutoff より前の予約を古い順に最大 batch_size 件、1つの短いトランザクションで保管先へ移す
+
+    移した件数を返す（0 なら対象なし）。
+    """
+    with transaction.atomic(), signals_muted():
+        batch = list(
+            Reservation.objects.filter(date__lt=cutoff)
+            .select_related('contact')
+            .order_by('date', 'start_time', 'id')[:batch_size]
+        )
+        if not batch:
+            return 0
+
+        rows = []
+        for reservation in batch:
+            contact = getattr(reservation, 'contact', None)
+            rows.append(ReservationArchive(
+                id=reservation.id,
+                facilityItem_id=reservation.facilityItem_id,
+                date=reservation.date,
+                start_time=reservation.start_time,
+                end_time=reservation.end_time,
+                user_id=reservation.user_id,
+                guest_id=reservation.guest_id,
+                created_at=reservation.created_at,
+                contact_name=contact.name if contact else '',
+                contact_phone=contact.phone if contact else '',
+                contact_email=contact.email if contact else '',
+            ))
+        # 途中で中断して再実行しても重複しないよう、保管済みのIDは無視する
+        ReservationArchive.objects.bulk_create(rows, ignore_conflicts=True)
+        # 過去日の空き状況インデックスは参照されないため、行単位の再計算は止めて削除する
+        Reservation.objects.filter(id__in=[reservation.id for reservation in batch]).delete()
+    return len(batch)
+
+
+def purge_past_availability(cutoff):
+    # 保管した期間の空き状況インデックスをまとめて削除する
+    deleted, _ = FacilityItemAvailability.objects.filter(date__lt=cutoff).delete()
+    return deleted
+
+
+def archive_reaches(date_from):
+    """予約検索の期間指定が保管済みの期間にかかるか（開始日の指定がなければ保管があれば常にかかる）"""
+    newest = ReservationArchive.objects.order_by('-date').values_list('date', flat=True).first()
+    return newest is not None and (date_from is None or date_from <= newest)
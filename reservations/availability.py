@@ -0,0 +1,271 @@
+import datetime
+from collections import defaultdict
+from django.db.models import Count, F, FilteredRelation, Q
+from .models import FacilityItem, FacilityItemAvailability, FacilityTimeSlot, Reservation
+from .holds import held_start_times
+from .intervals import IntervalSet
+from .occupancy import occupancy_row, save_occupancy, refresh_future_occupancy
+
+
+def as_date(value):
+    # セッション由来の 'YYYY-MM-DD' 文字列と date を同じキーとして扱う
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value))
+
+
+def facility_slots(facility_id):
+    # ビットマップの並び順と一致させるため (start_time, id) 順で取得
+    return list(FacilityTimeSlot.objects.filter(facility_id=facility_id).order_by('start_time', 'id'))
+
+
+def encode_bitmap(bitmap, slot_count):
+    return bitmap.to_bytes((slot_count + 7) // 8 or 1, 'little')
+
+
+def decode_bitmap(raw):
+    return int.from_bytes(bytes(raw), 'little')
+
+
+def build_bitmap(slots, reserved):
+    # 予約区間（IntervalSet）と重なる時間帯のビットを立てる
+    bitmap = 0
+    for i, slot in enumerate(slots):
+        if reserved.overlaps(slot.start_time, slot.end_time):
+            bitmap |= 1 << i
+    return bitmap
+
+
+def reserved_intervals(item_id, day, exclude_reservation_id=None):
+    """設備・日付の予約区間を IntervalSet で返す"""
+    qs = Reservation.objects.filter(facilityItem_id=item_id, date=as_date(day))
+    if exclude_reservation_id:
+        qs = qs.exclude(id=exclude_reservation_id)
+    return IntervalSet(qs.values_list('start_time', 'end_time'))
+
+
+def refresh_availability(item_id, day, slots=None, record_occupancy=False):
+    """（設備, 日付）1件分のビットマップを予約から再計算して保存する
+
+    予約の変更時は record_occupancy=True で稼働状況の日次集計も同じ値で更新する。
+    """
+    day = as_date(day)
+    if slots is None:
+        facility_id = FacilityItem.objects.filter(id=item_id).values_list('facility_id', flat=True).first()
+        if facility_id is None:
+            # 設備が削除済みならインデックスも CASCADE で消えている
+            return 0
+        slots = facility_slots(facility_id)
+
+    bitmap = build_bitmap(slots, reserved_intervals(item_id, day))
+
+    FacilityItemAvailability.objects.bulk_create(
+        [FacilityItemAvailability(
+            facilityItem_id=item_id,
+            date=day,
+            bitmap=encode_bitmap(bitmap, len(slots)),
+            slot_count=len(slots),
+        )],
+        update_conflicts=True,
+        unique_fields=['facilityItem', 'date'],
+        update_fields=['bitmap', 'slot_count'],
+    )
+    if record_occupancy:
+        save_occupancy([occupancy_row(item_id, day, bitmap, len(slots))])
+    return bitmap
+
+
+def refresh_availability_many(keys):
+    """複数の（設備, 日付）のビットマップと稼働状況の日次集計をまとめて再計算する（一括予約用）"""
+    keys = {(item_id, as_date(day)) for item_id, day in keys if item_id}
+    if not keys:
+        return
+    item_ids = {item_id for item_id, _ in keys}
+    days = {day for _, day in keys}
+
+    facility_of = dict(FacilityItem.objects.filter(id__in=item_ids).values_list('id', 'facility_id'))
+    slots_by_facility = defaultdict(list)
+    for slot in FacilityTimeSlot.objects.filter(facility_id__in=set(facility_of.values())).order_by('start_time', 'id'):
+        slots_by_facility[slot.facility_id].append(slot)
+
+    reserved = defaultdict(list)
+    for item_id, day, start_time, end_time in Reservation.objects.filter(
+        facilityItem_id__in=item_ids, date__in=days
+    ).values_list('facilityItem_id', 'date', 'start_time', 'end_time'):
+        reserved[(item_id, day)].append((start_time, end_time))
+
+    rows = []
+    occupancy = []
+    for item_id, day in keys:
+        if item_id not in facility_of:
+            continue
+        slots = slots_by_facility[facility_of[item_id]]
+        bitmap = build_bitmap(slots, IntervalSet(reserved[(item_id, day)]))
+        rows.append(FacilityItemAvailability(
+            facilityItem_id=item_id,
+            date=day,
+            bitmap=encode_bitmap(bitmap, len(slots)),
+            slot_count=len(slots),
+        ))
+        occupancy.append(occupancy_row(item_id, day, bitmap, len(slots)))
+    FacilityItemAvailability.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['facilityItem', 'date'],
+        update_fields=['bitmap', 'slot_count'],
+    )
+    save_occupancy(occupancy)
+
+
+def get_booked_bitmap(item_id, day, slots):
+    """インデックスを1回引いて予約済みビットマップを返す（未作成・不整合なら再計算）"""
+    row = FacilityItemAvailability.objects.filter(
+        facilityItem_id=item_id, date=as_date(day)
+    ).values_list('bitmap', 'slot_count').first()
+
+    if row is not None and row[1] == len(slots):
+        return decode_bitmap(row[0])
+    return refresh_availability(item_id, day, slots=slots)
+
+
+def invalidate_facility(facility_id):
+    # 時間帯の追加・変更・削除でビット位置がずれるため、施設単位で破棄して次回参照時に再構築する
+    invalidate_facilities([facility_id])
+
+
+def invalidate_facilities(facility_ids):
+    FacilityItemAvailability.objects.filter(facilityItem__facility_id__in=facility_ids).delete()
+    refresh_future_occupancy(facility_ids)
+
+
+def available_time_slots(item, day, exclude_reservation_id=None, holder=None, slots=None):
+    """設備・日付の (全時間帯, 空き時間帯) を返す（他の利用者の仮押さえ中の時間帯も除く）"""
+    if slots is None:
+        slots = facility_slots(item.facility_id)
+    if exclude_reservation_id:
+        # 編集中の予約を除いた区間で判定する（インデックスは使わない）
+        bitmap = build_bitmap(slots, reserved_intervals(item.id, day, exclude_reservation_id))
+    else:
+        bitmap = get_booked_bitmap(item.id, day, slots)
+
+    held = held_start_times(item.id, as_date(day), holder=holder)
+    available = [
+        slot for i, slot in enumerate(slots)
+        if not bitmap >> i & 1 and slot.start_time not in held
+    ]
+    return slots, available
+
+
+def availability_grid(items, facility_id, start, days):
+    """設備×日付の空き時間帯数を、時間帯取得と集計クエリ1回ずつで求める"""
+    slots = facility_slots(facility_id)
+    dates = [start + datetime.timedelta(days=n) for n in range(days)]
+
+    booked = {}
+    if items and slots:
+        # 予約区間と重なる時間帯を JOIN で数える（設備×日付で集計）
+        rows = Reservation.objects.filter(
+            facilityItem_id__in=[item.id for item in items],
+            date__range=(dates[0], dates[-1]),
+        ).annotate(
+            overlapping_slot=FilteredRelation(
+                'facilityItem__facility__facilitytimeslot',
+                condition=Q(
+                    facilityItem__facility__facilitytimeslot__start_time__lt=F('end_time'),
+                    facilityItem__facility__facilitytimeslot__end_time__gt=F('start_time'),
+                ),
+            ),
+        ).values('facilityItem_id', 'date').annotate(
+            booked=Count('overlapping_slot', distinct=True)
+        ).order_by()
+        booked = {(row['facilityItem_id'], row['date']): row['booked'] for row in rows}
+
+    rows = []
+    for item in items:
+        cells = [
+            {'date': day, 'free': len(slots) - booked.get((item.id, day), 0), 'total': len(slots)}
+            for day in dates
+        ]
+        rows.append({'item': item, 'cells': cells})
+
+    free_totals = [sum(row['cells'][n]['free'] for row in rows) for n in range(days)]
+    return {
+        'dates': dates,
+        'slots': slots,
+        'rows': rows,
+        'free_totals': free_totals,
+    }
+
+
+def _booker_name(reservation):
+    if reservation.user:
+        return reservation.user.full_name
+    if reservation.guest:
+        return f"{reservation.guest.full_name}（ゲスト）"
+    return '不明'
+
+
+def day_timeline(facility_id, day, office_id):
+    """施設の1日分の予約表（設備×時間帯、セルに予約者）を3回のクエリで作る
+
+    設備（施設名も JOIN）、時間帯、その日の予約（利用者・ゲストも JOIN）の順に取得する。
+    管理所の施設でなければ設備が空になる。
+    """
+    items = list(
+        FacilityItem.objects.filter(facility_id=facility_id, facility__office_id=office_id)
+        .select_related('facility').order_by('id')
+    )
+    slots = facility_slots(facility_id)
+    reservations = defaultdict(list)
+    if items:
+        for reservation in Reservation.objects.filter(
+            facilityItem_id__in=[item.id for item in items], date=day
+        ).select_related('user', 'guest').order_by('start_time'):
+            reservations[reservation.facilityItem_id].append(reservation)
+
+    rows = []
+    for item in items:
+        cells = []
+        for slot in slots:
+            # 時間帯と重なる予約（重複予約はできないため最大1件）
+            reservation = next((
+                r for r in reservations[item.id]
+                if r.start_time < slot.end_time and slot.start_time < r.end_time
+            ), None)
+            cells.append({
+                'slot': slot,
+                'reservation': reservation,
+                'booker': _booker_name(reservation) if reservation else '',
+            })
+        rows.append({'item': item, 'cells': cells})
+    return {'facility': items[0].facility if items else None, 'slots': slots, 'rows': rows}
+
+
+def grid_items(facility_id=None, item_id=None):
+    # 設備指定ならその1件、施設指定なら施設内の全設備（施設名も同じクエリで取得）
+    items = FacilityItem.objects.select_related('facility').order_by('id')
+    if item_id:
+        items = items.filter(id=item_id)
+        if facility_id:
+            items = items.filter(facility_id=facility_id)
+    else:
+        items = items.filter(facility_id=facility_id)
+    return list(items)
+
+
+def grid_as_json(grid, start, days):
+    return {
+        'start': start.isoformat(),
+        'days': days,
+        'slot_count': len(grid['slots']),
+        'dates': [day.isoformat() for day in grid['dates']],
+        'items': [
+            {
+                'id': row['item'].id,
+                'name': row['item'].item_name,
+                'free': [cell['free'] for cell in row['cells']],
+            }
+            for row in grid['rows']
+        ],
+        'free_totals': grid['free_totals'],
+    }
@@ -0,0 +1,141 @@
+from collections import defaultdict
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.utils import timezone
+from .models import Reservation, SlotHold
+from .signals import reservations_bulk_changed
+from .intervals import IntervalSet, overlap_q
+from .holds import is_held_by_other
+
+
+class SlotAlreadyReserved(Exception):
+    """選択された時間帯が既に予約されている"""
+
+
+def _overlaps_existing(item, day, time_slot, exclude_reservation_id=None):
+    # 開始時間が異なっても区間が重なる予約（時間帯の変更前の予約など）
+    qs = Reservation.objects.filter(facilityItem_id=item.id, date=day).filter(
+        overlap_q(time_slot.start_time, time_slot.end_time)
+    )
+    if exclude_reservation_id:
+        qs = qs.exclude(id=exclude_reservation_id)
+    return qs.exists()
+
+
+def _conflicts(item, day, time_slot, reservation_id, holder):
+    # 書き込み後（書き込みロック取得済み）に、重なる予約と他の利用者の有効な仮押さえを確認する
+    if _overlaps_existing(item, day, time_slot, exclude_reservation_id=reservation_id):
+        return True
+    # 仮押さえが期限切れになり、他の利用者が押さえ直している場合は確定しない
+    return holder is not None and is_held_by_other(item.id, day, time_slot.start_time, holder)
+
+
+def book_slot(item, day, time_slot, user=None, guest=None, holder=None):
+    """予約を1回の INSERT で確定する（同じ開始時間の競合は一意制約違反として検出）
+
+    holder を渡すと、他の利用者がその時間帯を仮押さえ中の場合も確定しない。
+    """
+    try:
+        with transaction.atomic():
+            # 先に書き込んで書き込みロックを取り、重なる予約があればロールバックする
+            reservation = Reservation.objects.create(
+                facilityItem_id=item.id,
+                date=day,
+                start_time=time_slot.start_time,
+                end_time=time_slot.end_time,
+                user=user,
+                guest=guest,
+            )
+            if _conflicts(item, day, time_slot, reservation.id, holder):
+                raise SlotAlreadyReserved()
+            return reservation
+    except IntegrityError:
+        raise SlotAlreadyReserved()
+
+
+def move_reservation(reservation, item, day, time_slot, user=None, holder=None):
+    """既存予約を別の設備・日時に変更する（移動先の競合は一意制約で検出）"""
+    reservation.facilityItem_id = item.id
+    reservation.date = day
+    reservation.start_time = time_slot.start_time
+    reservation.end_time = time_slot.end_time
+    if user is not None:
+        reservation.user = user
+    try:
+        with transaction.atomic():
+            reservation.save()
+            if _conflicts(item, day, time_slot, reservation.id, holder):
+                raise SlotAlreadyReserved()
+    except IntegrityError:
+        raise SlotAlreadyReserved()
+    return reservation
+
+
+def bulk_book(requests, user=None, attempts=3):
+    """複数の（設備, 日付, 時間帯）を1トランザクションで予約し、日付ごとの結果を返す
+
+    既存の予約・有効な仮押さえとの競合は1回のクエリでまとめて判定し、
+    空いているものだけを bulk_create で登録する。
+    """
+    requests = list(requests)
+    if not requests:
+        return []
+
+    item_ids = {item.id for item, _, _ in requests}
+    days = {day for _, day, _ in requests}
+    start_times = {slot.start_time for _, _, slot in requests}
+
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                # 予約（区間）と仮押さえ（開始時間）を1回のクエリで取得
+                reserved = Reservation.objects.filter(
+                    facilityItem_id__in=item_ids, date__in=days
+                ).annotate(kind=Value('reservation')).values_list(
+                    'facilityItem_id', 'date', 'start_time', 'end_time', 'kind'
+                ).order_by()
+                held = SlotHold.objects.filter(
+                    facilityItem_id__in=item_ids, date__in=days, start_time__in=start_times,
+                    expires_at__gt=timezone.now(),
+                ).annotate(end_time=F('start_time'), kind=Value('hold')).values_list(
+                    'facilityItem_id', 'date', 'start_time', 'end_time', 'kind'
+                )
+                reserved_by_day = defaultdict(list)
+                held_keys = set()
+                for item_id, day, start_time, end_time, kind in reserved.union(held, all=True):
+                    if kind == 'hold':
+                        held_keys.add((item_id, day, start_time))
+                    else:
+                        reserved_by_day[(item_id, day)].append((start_time, end_time))
+                intervals = defaultdict(IntervalSet)
+                intervals.update((key, IntervalSet(ranges)) for key, ranges in reserved_by_day.items())
+
+                results = []
+                new_reservations = []
+                for item, day, slot in requests:
+                    reserved_day = intervals[(item.id, day)]
+                    booked = (
+                        (item.id, day, slot.start_time) not in held_keys
+                        and reserved_day.is_free(slot.start_time, slot.end_time)
+                    )
+                    if booked:
+                        reserved_day.add(slot.start_time, slot.end_time)
+                        new_reservations.append(Reservation(
+                            facilityItem=item,
+                            date=day,
+                            start_time=slot.start_time,
+                            end_time=slot.end_time,
+                            user=user,
+                        ))
+                    results.append({'item': item, 'date': day, 'time_slot': slot, 'booked': booked})
+
+                Reservation.objects.bulk_create(new_reservations)
+                reservations_bulk_changed.send(
+                    sender=Reservation,
+                    keys={(r.facilityItem_id, r.date) for r in new_reservations},
+                )
+            return results
+        except IntegrityError:
+            # 判定から登録までの間に他の予約が入った場合は、判定からやり直す
+            if attempt == attempts - 1:
+                raise SlotAlreadyReserved()
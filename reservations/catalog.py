@@ -0,0 +1,137 @@
+import threading
+from collections import defaultdict, namedtuple
+from django.db.models import F
+from yoyakumate.db_router import PRIMARY
+from .models import CatalogVersion, ManagementOffice, Facility, FacilityItem, FacilityTimeSlot
+
+# カタログの各要素（テンプレートからはモデルと同じ属性名で参照できる）
+OfficeEntry = namedtuple('OfficeEntry', 'id name address')
+FacilityEntry = namedtuple('FacilityEntry', 'id office_id name description')
+ItemEntry = namedtuple('ItemEntry', 'id facility_id item_name description')
+SlotEntry = namedtuple('SlotEntry', 'id facility_id start_time end_time')
+
+_lock = threading.Lock()
+_snapshot = None
+
+
+def _as_id(value):
+    # セッション・POST 由来の文字列IDを int にそろえる（不正な値は None）
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class CatalogSnapshot:
+    """管理所〜時間帯の階層を読み込んだ不変のスナップショット"""
+
+    def __init__(self, version, offices, facilities, items, slots):
+        self.version = version
+        self.offices = tuple(offices)
+        self._offices = {office.id: office for office in self.offices}
+        self._facilities = {facility.id: facility for facility in facilities}
+        self._items = {item.id: item for item in items}
+        self._slots = {slot.id: slot for slot in slots}
+
+        facilities_by_office = defaultdict(list)
+        for facility in facilities:
+            facilities_by_office[facility.office_id].append(facility)
+        items_by_facility = defaultdict(list)
+        for item in items:
+            items_by_facility[item.facility_id].append(item)
+        slots_by_facility = defaultdict(list)
+        for slot in slots:
+            slots_by_facility[slot.facility_id].append(slot)
+
+        self._facilities_by_office = {key: tuple(value) for key, value in facilities_by_office.items()}
+        self._items_by_facility = {key: tuple(value) for key, value in items_by_facility.items()}
+        self._slots_by_facility = {key: tuple(value) for key, value in slots_by_facility.items()}
+
+    def single_office(self):
+        # 管理所が1件だけならその管理所
+        return self.offices[0] if len(self.offices) == 1 else None
+
+    def office(self, office_id):
+        return self._offices.get(_as_id(office_id))
+
+    def facility(self, facility_id, office_id=None):
+        facility = self._facilities.get(_as_id(facility_id))
+        if facility and office_id is not None and facility.office_id != _as_id(office_id):
+            return None
+        return facility
+
+    def item(self, item_id, facility_id=None):
+        item = self._items.get(_as_id(item_id))
+        if item and facility_id is not None and item.facility_id != _as_id(facility_id):
+            return None
+        return item
+
+    def slot(self, slot_id, facility_id=None):
+        slot = self._slots.get(_as_id(slot_id))
+        if slot and facility_id is not None and slot.facility_id != _as_id(facility_id):
+            return None
+        return slot
+
+    def facilities_of(self, office_id):
+        return self._facilities_by_office.get(_as_id(office_id), ())
+
+    def items_of(self, facility_id):
+        return self._items_by_facility.get(_as_id(facility_id), ())
+
+    def slots_of(self, facility_id):
+        # 空き状況ビットマップと同じ (start_time, id) 順
+        return self._slots_by_facility.get(_as_id(facility_id), ())
+
+
+def current_version():
+    # レプリカは遅れるため、バージョンとカタログ本体は @read_replica のビューからでも書き込み先から読む
+    return CatalogVersion.objects.using(PRIMARY).filter(pk=1).values_list('version', flat=True).first() or 0
+
+
+def bump_catalog_version():
+    """カタログのバージョンを進め、このプロセスのスナップショットを破棄する"""
+    global _snapshot
+    if not CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1):
+        version, created = CatalogVersion.objects.get_or_create(pk=1, defaults={'version': 1})
+        if not created:
+            CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1)
+    # ロールバックで同じ番号が再利用されても古いスナップショットを使わないよう、自プロセス分は即時破棄
+    _snapshot = None
+
+
+def _load(version):
+    offices = [
+        OfficeEntry(*row)
+        for row in ManagementOffice.objects.using(PRIMARY).order_by('id').values_list('id', 'name', 'address')
+    ]
+    facilities = [
+        FacilityEntry(*row)
+        for row in Facility.objects.using(PRIMARY).order_by('id').values_list('id', 'office_id', 'name', 'description')
+    ]
+    items = [
+        ItemEntry(*row)
+        for row in FacilityItem.objects.using(PRIMARY).order_by('id').values_list(
+            'id', 'facility_id', 'item_name', 'description'
+        )
+    ]
+    slots = [
+        SlotEntry(*row)
+        for row in FacilityTimeSlot.objects.using(PRIMARY).order_by('start_time', 'id').values_list(
+            'id', 'facility_id', 'start_time', 'end_time'
+        )
+    ]
+    return CatalogSnapshot(version, offices, facilities, items, slots)
+
+
+def get_catalog():
+    """現在のカタログを返す（バージョン確認のクエリ1回、変更があった場合のみ再読み込み）"""
+    global _snapshot
+    # バージョンを先に読むため、読み込み中の変更は次回のバージョン確認で拾われる
+    version = current_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    with _lock:
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = _load(version)
+        return _snapshot
@@ -0,0 +1,63 @@
+import datetime
+from django.db.models import Count, Q
+from .catalog import get_catalog
+from .models import Reservation
+
+
+def _rate(booked, capacity):
+    # 予約できる枠に対する予約の割合（％、枠がなければ None）
+    if not capacity:
+        return None
+    return min(100, round(booked * 100 / capacity))
+
+
+def office_dashboard(office_id, today=None):
+    """管理所の施設ごとの設備数・今日と今週の予約数・稼働率
+
+    施設・設備・時間帯はカタログから、予約数は施設ごとの集計クエリ1回で求めるため、
+    施設の数によらずクエリ数は一定になる。稼働率は「予約数 ÷（設備数 × 時間帯数 × 日数）」。
+    """
+    today = today or datetime.date.today()
+    week_start = today - datetime.timedelta(days=today.weekday())
+    week_end = week_start + datetime.timedelta(days=6)
+
+    counts = {
+        row['facilityItem__facility_id']: row
+        for row in Reservation.objects.filter(
+            facilityItem__facility__office_id=office_id,
+            date__range=(week_start, week_end),
+        ).order_by().values('facilityItem__facility_id').annotate(
+            today_count=Count('id', filter=Q(date=today)),
+            week_count=Count('id'),
+        )
+    }
+
+    catalog = get_catalog()
+    rows = []
+    totals = {'item_count': 0, 'today_count': 0, 'week_count': 0, 'today_capacity': 0, 'week_capacity': 0}
+    for facility in sorted(catalog.facilities_of(office_id), key=lambda facility: facility.name):
+        item_count = len(catalog.items_of(facility.id))
+        daily_capacity = item_count * len(catalog.slots_of(facility.id))
+        count = counts.get(facility.id, {})
+        row = {
+            'facility': facility,
+            'item_count': item_count,
+            'today_count': count.get('today_count', 0),
+            'week_count': count.get('week_count', 0),
+            'today_capacity': daily_capacity,
+            'week_capacity': daily_capacity * 7,
+        }
+        for key in totals:
+            totals[key] += row[key]
+        rows.append(row)
+
+    for row in rows + [totals]:
+        row['today_rate'] = _rate(row['today_count'], row['today_capacity'])
+        row['week_rate'] = _rate(row['week_count'], row['week_capacity'])
+    return {
+        'today': today,
+        'week_start': week_start,
+        'week_end': week_end,
+        'facilities': rows,
+        'totals': totals,
+    }
@@ -0,0 +1,91 @@
+import csv
+from django.db.models import Value
+from .models import Reservation, ReservationArchive
+from .archive import archive_reaches
+
+# Excel で文字化けしないよう先頭に付ける BOM
+UTF8_BOM = '\ufeff'
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_HEADER = [
+    '予約ID', '予約日', '開始時間', '終了時間', '施設', '設備', '区分', '氏名', '電話番号', 'メールアドレス',
+]
+
+
+class Echo:
+    """csv.writer の書き込み先（バッファせず、書いた行をそのまま返す）"""
+
+    def write(self, value):
+        return value
+
+
+# 表計算ソフトで数式として解釈される先頭文字（CSV インジェクション対策）
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+_COLUMNS = (
+    'id', 'date', 'start_time', 'end_time',
+    'facilityItem__facility__name', 'facilityItem__item_name',
+    'user_id', 'user__full_name', 'user__phone', 'user__email',
+    'guest__full_name', 'guest__phone', 'guest__email',
+)
+
+
+def export_querysets(office, date_from, date_to):
+    """出力する予約のクエリセットを古い順に返す（期間が保管済みの期間にかかれば保管分を先に続ける）
+
+    関連する施設・設備・利用者は JOIN で取得し、モデルを作らずにタプルで読む。
+    """
+    querysets = []
+    if archive_reaches(date_from):
+        # 利用者・ゲストが削除された保管分は、保管時の検索用連絡先を氏名などの代わりに使う
+        querysets.append(ReservationArchive.objects.filter(
+            facilityItem__facility__office=office,
+            date__range=(date_from, date_to),
+        ).order_by('date', 'start_time', 'id').values_list(
+            *_COLUMNS, 'contact_name', 'contact_phone', 'contact_email',
+        ))
+    querysets.append(Reservation.objects.filter(
+        facilityItem__facility__office=office,
+        date__range=(date_from, date_to),
+    ).order_by('date', 'start_time', 'id').annotate(
+        no_contact=Value(''),
+    ).values_list(*_COLUMNS, 'no_contact', 'no_contact', 'no_contact'))
+    return querysets
+
+
+def _escape(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _row(values):
+    (reservation_id, day, start_time, end_time, facility_name, item_name,
+     user_id, user_name, user_phone, user_email, guest_name, guest_phone, guest_email,
+     contact_name, contact_phone, contact_email) = values
+    if user_id:
+        kind, name, phone, email = '登録ユーザー', user_name, user_phone, user_email
+    elif guest_name is not None:
+        kind, name, phone, email = 'ゲスト', guest_name, guest_phone, guest_email
+    else:
+        kind, name, phone, email = '不明', contact_name, contact_phone, contact_email
+    return [
+        reservation_id, day.isoformat(), start_time.strftime('%H:%M'), end_time.strftime('%H:%M'),
+        *map(_escape, (facility_name, item_name, kind, name, phone, email)),
+    ]
+
+
+def iter_csv(querysets, chunk_size=EXPORT_CHUNK_SIZE):
+    """予約を CSV の行ごとに返す（先頭は BOM 付きのヘッダー、querysets は export_querysets の戻り値）
+
+    サーバー側カーソルで chunk_size 件ずつ読むため、件数によらずメモリ使用量は一定になる。
+    """
+    writer = csv.writer(Echo())
+    yield UTF8_BOM + writer.writerow(EXPORT_HEADER)
+    for queryset in querysets:
+        for values in queryset.iterator(chunk_size=chunk_size):
+            yield writer.writerow(_row(values))
+
+
+def export_filename(office, date_from, date_to):
+    return f"reservations_{office.id}_{date_from:%Y%m%d}_{date_to:%Y%m%d}.csv"
@@ -3,7 +3,14 @@ from django.forms.models import BaseInlineFormSet
 from django.contrib.auth.forms import UserCreationForm
 from django.core.exceptions import ValidationError
 from datetime import date, timedelta
-from .models import CustomUser, ManagementOffice, InvitationCode, Facility, FacilityTimeSlot, ManagerProfile, FacilityItem,Reservation
+from .intervals import IntervalSet, IntervalOverlapError
+from .timeslots import parse_breaks
+from .models import CustomUser, ManagementOffice, InvitationCode, Facility, FacilityTimeSlot, ManagerProfile, FacilityItem,Reservation, TimeSlotTemplate
+
+# 登録ユーザーが予約できる期間（今日から何日先まで）
+MEMBER_BOOKING_DAYS = 7
+# 定期予約の最終回に指定できる期間（今日から何日先まで）
+RECURRING_BOOKING_HORIZON_DAYS = 84
 
 # 一般用户登録フォーム
 class UserRegisterForm(UserCreationForm):
@@ -110,18 +117,74 @@ class FacilityTimeSlotForm(forms.ModelForm):
 class FacilityTimeSlotFormSet(BaseInlineFormSet):
     def clean(self):
         super().clean()
-        time_ranges = []
+        time_ranges = IntervalSet()
         for form in self.forms:
             if form.cleaned_data.get('DELETE', False):
                 continue
             start = form.cleaned_data.get('start_time')
             end = form.cleaned_data.get('end_time')
-            if not start or not end:
+            if not start or not end or start >= end:
                 continue
-            for s, e in time_ranges:
-                if (start < e and end > s):
-                    raise ValidationError('時間帯が重複しています。')
-            time_ranges.append((start, end))
+            try:
+                time_ranges.add(start, end)
+            except IntervalOverlapError:
+                raise ValidationError('時間帯が重複しています。')
+
+
+class TimeSlotTemplateForm(forms.ModelForm):
+    open_time = forms.TimeField(
+        widget=forms.TimeInput(format='%H:%M', attrs={'type': 'time', 'step': 3600}),
+        label='開始時間'
+    )
+    close_time = forms.TimeField(
+        widget=forms.TimeInput(format='%H:%M', attrs={'type': 'time', 'step': 3600}),
+        label='終了時間'
+    )
+
+    class Meta:
+        model = TimeSlotTemplate
+        fields = ['name', 'open_time', 'close_time', 'slot_minutes', 'breaks']
+
+    def clean_breaks(self):
+        breaks = self.cleaned_data.get('breaks')
+        try:
+            parsed = parse_breaks(breaks)
+        except ValueError:
+            raise ValidationError('休憩時間は「12:00-13:00,17:00-18:00」の形式で入力してください。')
+        # 時間帯フォームと同様、休憩も00分単位とする
+        for start, end in parsed:
+            if start.minute or end.minute:
+                raise ValidationError('休憩時間の分は00分でなければなりません。')
+        return breaks
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start = cleaned_data.get('open_time')
+        end = cleaned_data.get('close_time')
+        if start and end:
+            if start.minute or end.minute:
+                raise ValidationError('開始・終了時間の分は00分でなければなりません。')
+            if start >= end:
+                raise ValidationError('終了時間は開始時間より後でなければなりません。')
+        return cleaned_data
+
+
+class TimeSlotTemplateApplyForm(forms.Form):
+    MODE_CHOICES = [
+        ('diff', '差分のみ適用（変更のある時間帯だけ追加・削除）'),
+        ('replace', 'すべて置き換え'),
+    ]
+
+    facilities = forms.ModelMultipleChoiceField(
+        queryset=Facility.objects.none(),
+        label='適用する施設タイプ',
+        widget=forms.CheckboxSelectMultiple,
+    )
+    mode = forms.ChoiceField(choices=MODE_CHOICES, initial='diff', label='適用方法', widget=forms.RadioSelect)
+
+    def __init__(self, *args, office=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['facilities'].queryset = Facility.objects.filter(office=office).order_by('name')
 
 
 class FacilityItemForm(forms.ModelForm):
@@ -156,12 +219,25 @@ class SelectDateForm(forms.Form):
     def clean_date(self):
         selected_date = self.cleaned_data['date']
         today = date.today()
-        max_date = today + timedelta(days=6)
+        max_date = today + timedelta(days=MEMBER_BOOKING_DAYS - 1)
 
         if not (today <= selected_date <= max_date):
             raise ValidationError('選択できる日付は今日から1週間以内です。')
         return selected_date
 
+# 1画面予約フォーム（設備・日付・時間帯を1回の POST で送信）
+class QuickReserveForm(SelectDateForm):
+    item = forms.ModelChoiceField(queryset=FacilityItem.objects.all(), label="設備")
+    time_slot = forms.ModelChoiceField(queryset=FacilityTimeSlot.objects.all(), label="時間帯")
+
+    def clean(self):
+        cleaned_data = super().clean()
+        item = cleaned_data.get('item')
+        time_slot = cleaned_data.get('time_slot')
+        if item and time_slot and item.facility_id != time_slot.facility_id:
+            raise ValidationError('選択した設備では利用できない時間帯です。')
+        return cleaned_data
+
 class SelectTimeSlotForm(forms.Form):
     time_slot = forms.ChoiceField(
         choices=[],
@@ -198,6 +274,32 @@ class ReservationSearchForm(forms.Form):
         widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'})
     )
 
+class ReservationExportForm(forms.Form):
+    date_from = forms.DateField(
+        label='予約日（から）',
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'})
+    )
+    date_to = forms.DateField(
+        label='予約日（まで）',
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'})
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from = cleaned_data.get('date_from')
+        date_to = cleaned_data.get('date_to')
+        if date_from and date_to and date_from > date_to:
+            raise ValidationError('終了日は開始日以降を選択してください。')
+        return cleaned_data
+
+class OccupancyReportForm(forms.Form):
+    month = forms.DateField(
+        label='対象月',
+        required=False,
+        input_formats=['%Y-%m'],
+        widget=forms.DateInput(attrs={'type': 'month', 'class': 'form-control'}, format='%Y-%m')
+    )
+
 class UserSearchForm(forms.Form):
     full_name = forms.CharField(
         label='氏名',
@@ -282,3 +384,124 @@ class GuestUserForm(forms.Form):
 
 
 
+
+
+class FacilityItemChoiceField(forms.ModelChoiceField):
+    def label_from_instance(self, obj):
+        return f"{obj.facility.name} - {obj.item_name}"
+
+
+class FacilityItemMultipleChoiceField(forms.ModelMultipleChoiceField):
+    def label_from_instance(self, obj):
+        return f"{obj.facility.name} - {obj.item_name}"
+
+
+class TimeSlotChoiceField(forms.ModelChoiceField):
+    def label_from_instance(self, obj):
+        return f"{obj.facility.name} {obj}"
+
+
+class TimeSlotMultipleChoiceField(forms.ModelMultipleChoiceField):
+    def label_from_instance(self, obj):
+        return f"{obj.facility.name} {obj}"
+
+
+# 定期予約（毎週・隔週）フォーム
+class RecurringReservationForm(forms.Form):
+    FREQUENCY_CHOICES = [
+        ('7', '毎週'),
+        ('14', '隔週'),
+    ]
+
+    item = FacilityItemChoiceField(queryset=FacilityItem.objects.none(), label='設備')
+    time_slot = TimeSlotChoiceField(queryset=FacilityTimeSlot.objects.none(), label='時間帯')
+    start_date = forms.DateField(label='初回の予約日', widget=forms.DateInput(attrs={'type': 'date'}))
+    frequency = forms.ChoiceField(choices=FREQUENCY_CHOICES, label='繰り返し')
+    occurrences = forms.IntegerField(label='回数', min_value=1, max_value=12, initial=4)
+
+    def __init__(self, *args, facility_id=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 選択した施設の設備・時間帯だけを選べるようにする
+        self.fields['item'].queryset = FacilityItem.objects.filter(
+            facility_id=facility_id
+        ).select_related('facility').order_by('item_name')
+        self.fields['time_slot'].queryset = FacilityTimeSlot.objects.filter(
+            facility_id=facility_id
+        ).select_related('facility').order_by('start_time')
+
+    def clean_start_date(self):
+        # 初回は通常の予約と同じ期間内
+        start_date = self.cleaned_data['start_date']
+        today = date.today()
+        if not (today <= start_date <= today + timedelta(days=MEMBER_BOOKING_DAYS - 1)):
+            raise ValidationError(f'初回の予約日は今日から{MEMBER_BOOKING_DAYS}日以内で選択してください。')
+        return start_date
+
+    def clean(self):
+        cleaned_data = super().clean()
+        item = cleaned_data.get('item')
+        time_slot = cleaned_data.get('time_slot')
+        if item and time_slot and item.facility_id != time_slot.facility_id:
+            raise ValidationError('選択した設備では利用できない時間帯です。')
+        if all(cleaned_data.get(key) for key in ('start_date', 'frequency', 'occurrences')):
+            # 最終回も定期予約の期間内に収める
+            if self.dates()[-1] > date.today() + timedelta(days=RECURRING_BOOKING_HORIZON_DAYS):
+                raise ValidationError(
+                    f'最終回の予約日が今日から{RECURRING_BOOKING_HORIZON_DAYS}日を超えます。回数を減らしてください。'
+                )
+        return cleaned_data
+
+    def dates(self):
+        step = timedelta(days=int(self.cleaned_data['frequency']))
+        start_date = self.cleaned_data['start_date']
+        return [start_date + step * n for n in range(self.cleaned_data['occurrences'])]
+
+
+# 管理者用一括予約（イベント等の貸切）フォーム
+class BlockBookingForm(forms.Form):
+    items = FacilityItemMultipleChoiceField(
+        queryset=FacilityItem.objects.none(),
+        label='設備',
+        widget=forms.CheckboxSelectMultiple,
+    )
+    time_slots = TimeSlotMultipleChoiceField(
+        queryset=FacilityTimeSlot.objects.none(),
+        label='時間帯',
+        widget=forms.CheckboxSelectMultiple,
+    )
+    date_from = forms.DateField(label='開始日', widget=forms.DateInput(attrs={'type': 'date'}))
+    date_to = forms.DateField(label='終了日', widget=forms.DateInput(attrs={'type': 'date'}))
+
+    def __init__(self, *args, office=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['items'].queryset = FacilityItem.objects.filter(
+            facility__office=office
+        ).select_related('facility').order_by('facility__name', 'item_name')
+        self.fields['time_slots'].queryset = FacilityTimeSlot.objects.filter(
+            facility__office=office
+        ).select_related('facility').order_by('facility__name', 'start_time')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from = cleaned_data.get('date_from')
+        date_to = cleaned_data.get('date_to')
+        if date_from and date_to:
+            if date_from < date.today():
+                raise ValidationError('過去の日付は選択できません。')
+            if date_from > date_to:
+                raise ValidationError('終了日は開始日以降を選択してください。')
+            if (date_to - date_from).days > 92:
+                raise ValidationError('一括予約できる期間は3か月以内です。')
+        return cleaned_data
+
+    def requests(self):
+        # 設備と同じ施設タイプの時間帯だけを組み合わせる
+        date_from = self.cleaned_data['date_from']
+        days = [date_from + timedelta(days=n) for n in range((self.cleaned_data['date_to'] - date_from).days + 1)]
+        return [
+            (item, day, slot)
+            for day in days
+            for item in self.cleaned_data['items']
+            for slot in self.cleaned_data['time_slots']
+            if slot.facility_id == item.facility_id
+        ]
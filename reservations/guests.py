@@ -0,0 +1,54 @@
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from .models import Reservation, ReservationArchive, TemporaryReservationUser
+from .search import guest_identity, sync_contacts_for_person
+from .signals import signals_muted
+
+
+def upsert_guest(full_name, phone, email):
+    """ゲストを1回の INSERT ... ON CONFLICT で作成・更新して返す
+
+    同じメールアドレスと電話番号で以前に予約したゲストは同じ行を使い、氏名などは今回の入力で更新する。
+    そのゲストの予約の検索用連絡先も今回の入力に合わせる。
+    """
+    email_key, phone_key = guest_identity(phone, email)
+    guest = TemporaryReservationUser(
+        full_name=full_name, phone=phone, email=email, email_key=email_key, phone_key=phone_key,
+    )
+    TemporaryReservationUser.objects.bulk_create(
+        [guest],
+        update_conflicts=True,
+        unique_fields=['email_key', 'phone_key'],
+        update_fields=['full_name', 'phone', 'email'],
+    )
+    # bulk_create では post_save が送られないため、既存の予約（保管分を含む）の検索用連絡先をここでそろえる
+    sync_contacts_for_person(guest, 'guest')
+    return guest
+
+
+def orphan_guests(include_archived=False):
+    """予約が残っていないゲスト（include_archived=True なら保管済みの予約だけのゲストも含む）"""
+    guests = TemporaryReservationUser.objects.filter(
+        ~Exists(Reservation.objects.filter(guest_id=OuterRef('pk')))
+    )
+    if not include_archived:
+        # 保管済みの予約は一覧でゲストの氏名を表示するため残す
+        guests = guests.filter(~Exists(ReservationArchive.objects.filter(guest_id=OuterRef('pk'))))
+    return guests
+
+
+def purge_guest_batch(after_id, batch_size, include_archived=False):
+    """ID が after_id より後の予約のないゲストを最大 batch_size 件削除する: (削除件数, 次の after_id)
+
+    確認と削除を同じトランザクションで行うため、その間に予約されたゲストは削除しない。
+    """
+    with transaction.atomic(), signals_muted():
+        ids = list(
+            orphan_guests(include_archived).filter(id__gt=after_id)
+            .order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return 0, None
+        # 保管済みの予約の検索用連絡先はそのまま残す（行単位の連絡先の消去は止める）
+        TemporaryReservationUser.objects.filter(id__in=ids).delete()
+    return len(ids), ids[-1]
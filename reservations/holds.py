@@ -0,0 +1,67 @@
+import datetime
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from .models import SlotHold
+
+HOLD_TOKEN_KEY = 'slot_hold_token'
+
+
+def hold_token(store):
+    # 仮押さえの保持者を識別するトークン（未発行なら発行してセッションに保存）
+    token = store.get(HOLD_TOKEN_KEY)
+    if not token:
+        token = get_random_string(32)
+        store[HOLD_TOKEN_KEY] = token
+    return token
+
+
+def take_hold(item_id, day, start_time, holder):
+    """時間帯を仮押さえする。他の利用者が有効な仮押さえを持っていれば False を返す"""
+    now = timezone.now()
+    expires_at = now + datetime.timedelta(minutes=settings.SLOT_HOLD_MINUTES)
+
+    with transaction.atomic():
+        # 自分の以前の仮押さえと、この時間帯の期限切れの仮押さえを解放
+        SlotHold.objects.filter(
+            Q(holder=holder) |
+            Q(facilityItem_id=item_id, date=day, start_time=start_time, expires_at__lte=now)
+        ).delete()
+        try:
+            with transaction.atomic():
+                SlotHold.objects.create(
+                    facilityItem_id=item_id,
+                    date=day,
+                    start_time=start_time,
+                    holder=holder,
+                    expires_at=expires_at,
+                )
+        except IntegrityError:
+            return False
+    return True
+
+
+def held_start_times(item_id, day, holder=None):
+    # 他の利用者が仮押さえ中の開始時間
+    qs = SlotHold.objects.filter(facilityItem_id=item_id, date=day, expires_at__gt=timezone.now())
+    if holder:
+        qs = qs.exclude(holder=holder)
+    return set(qs.values_list('start_time', flat=True))
+
+
+def is_held_by_other(item_id, day, start_time, holder):
+    return SlotHold.objects.filter(
+        facilityItem_id=item_id, date=day, start_time=start_time, expires_at__gt=timezone.now()
+    ).exclude(holder=holder).exists()
+
+
+def release_holds(holder):
+    SlotHold.objects.filter(holder=holder).delete()
+
+
+def sweep_expired_holds():
+    """期限切れの仮押さえを一括削除し、削除件数を返す"""
+    deleted, _ = SlotHold.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
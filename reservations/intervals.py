@@ -0,0 +1,67 @@
+from bisect import bisect_left, bisect_right
+from django.db.models import Q
+
+
+class IntervalOverlapError(ValueError):
+    """追加しようとした区間が既存の区間と重なっている"""
+
+
+class IntervalSet:
+    """重ならない半開区間 [start, end) を開始順に保持する
+
+    区間同士が重ならないため終了時刻も開始順に並び、
+    空き判定は二分探索で O(log n) になる。
+    """
+
+    def __init__(self, intervals=()):
+        self._starts = []
+        self._ends = []
+        # 既存データに重なりがあってもまとめて1区間として扱う
+        for start, end in sorted(intervals):
+            if self._ends and start < self._ends[-1]:
+                self._ends[-1] = max(self._ends[-1], end)
+            else:
+                self._starts.append(start)
+                self._ends.append(end)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __iter__(self):
+        return iter(zip(self._starts, self._ends))
+
+    def overlaps(self, start, end):
+        # start < end を満たす区間のうち最後のものが、最も遅く終わる
+        i = bisect_left(self._starts, end)
+        return i > 0 and self._ends[i - 1] > start
+
+    def is_free(self, start, end):
+        return not self.overlaps(start, end)
+
+    def add(self, start, end):
+        if start >= end:
+            raise ValueError('終了時刻は開始時刻より後でなければなりません。')
+        if self.overlaps(start, end):
+            raise IntervalOverlapError((start, end))
+        i = bisect_left(self._starts, start)
+        self._starts.insert(i, start)
+        self._ends.insert(i, end)
+
+    def gaps(self, lower, upper):
+        """[lower, upper) の中の空き区間を返す"""
+        result = []
+        cursor = lower
+        i = bisect_right(self._ends, lower)
+        while i < len(self._starts) and self._starts[i] < upper:
+            if self._starts[i] > cursor:
+                result.append((cursor, self._starts[i]))
+            cursor = max(cursor, self._ends[i])
+            i += 1
+        if cursor < upper:
+            result.append((cursor, upper))
+        return result
+
+
+def overlap_q(start, end):
+    # [start_time, end_time) が [start, end) と重なる行の条件
+    return Q(start_time__lt=end, end_time__gt=start)
@@ -0,0 +1,57 @@
+import csv
+import io
+import secrets
+from django.db import transaction
+from django.db.models import Max
+from .exports import UTF8_BOM
+from .models import InvitationCode
+
+INVITATION_CODE_LENGTH = 8
+# 読み間違えやすい 0・O・1・I を除いた32文字（1バイトの乱数をそのまま割り当てても偏らない）
+INVITATION_CODE_CHARS = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+_BYTE_TO_CHAR = bytes(ord(INVITATION_CODE_CHARS[b % len(INVITATION_CODE_CHARS)]) for b in range(256))
+# 一度に生成できる上限
+INVITATION_MAX_COUNT = 100000
+# 1回の INSERT で書き込む件数（SQLite のパラメータ数の上限より小さくする）
+INVITATION_BATCH_SIZE = 900
+
+
+def random_codes(count):
+    # 乱数のバイト列をまとめて作り、文字に置き換えてから INVITATION_CODE_LENGTH 文字ずつ切り出す
+    raw = secrets.token_bytes(count * INVITATION_CODE_LENGTH).translate(_BYTE_TO_CHAR).decode('ascii')
+    return {raw[i:i + INVITATION_CODE_LENGTH] for i in range(0, len(raw), INVITATION_CODE_LENGTH)}
+
+
+def generate_invitation_codes(office, count):
+    """管理所の招待コードを count 件、1つのトランザクションでまとめて作成し、コードのリストを返す
+
+    候補を ignore_conflicts でそのまま書き込み、既存のコードと重なって入らなかった分だけ作り直す。
+    """
+    with transaction.atomic():
+        # このトランザクションで書き込んだ行は、書き込み前の最大 ID より後になる
+        last_id = InvitationCode.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        codes = set()
+        while len(codes) < count:
+            pending = random_codes(count - len(codes)) - codes
+            InvitationCode.objects.bulk_create(
+                [InvitationCode(code=code, community_id=office.id) for code in pending],
+                batch_size=INVITATION_BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+            created = InvitationCode.objects.filter(id__gt=last_id)
+            if created.count() == len(codes) + len(pending):
+                codes |= pending
+            else:
+                # 既存のコードと重なったものは入っていないため、書き込めた分を読み直して不足分を作り直す
+                codes = set(created.values_list('code', flat=True))
+    return sorted(codes)
+
+
+def invitation_csv(office, codes):
+    # Excel で開けるよう BOM 付きで、1行に1コード
+    buffer = io.StringIO()
+    buffer.write(UTF8_BOM)
+    writer = csv.writer(buffer)
+    writer.writerow(['招待コード', '管理所'])
+    writer.writerows([code, office.name] for code in codes)
+    return buffer.getvalue()
@@ -0,0 +1,37 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from reservations.archive import archive_horizon, archive_batch, purge_past_availability
+
+
+class Command(BaseCommand):
+    help = '保管期限より前の予約を、短いトランザクションのバッチに分けて ReservationArchive へ移します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.RESERVATION_ARCHIVE_DAYS,
+            help='この日数より前の予約を移す（既定は settings.RESERVATION_ARCHIVE_DAYS）',
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help='1トランザクションで移す件数')
+        parser.add_argument('--sleep', type=float, default=0.05, help='バッチ間の待ち時間（秒）。予約の書き込みに割り込ませる')
+        parser.add_argument('--max-batches', type=int, default=0, help='この回数で打ち切る（0 なら無制限）')
+
+    def handle(self, *args, **options):
+        cutoff = archive_horizon(options['days'])
+        total = 0
+        batches = 0
+        while True:
+            moved = archive_batch(cutoff, options['batch_size'])
+            if not moved:
+                break
+            total += moved
+            batches += 1
+            self.stdout.write(f'{total}件移動しました')
+            if options['max_batches'] and batches >= options['max_batches']:
+                break
+            time.sleep(options['sleep'])
+
+        purged = purge_past_availability(cutoff)
+        self.stdout.write(self.style.SUCCESS(
+            f'{cutoff} より前の予約を{total}件保管しました（空き状況インデックス {purged}件を削除）。'
+        ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from reservations.models import Reservation
+from reservations.search import sync_contacts
+
+
+class Command(BaseCommand):
+    help = '予約検索用の連絡先（ReservationContact）を、既存の予約からID順にバッチで作成・更新します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='1回に処理する予約の件数')
+        parser.add_argument('--missing-only', action='store_true', help='連絡先がまだない予約だけを処理する')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        reservations = Reservation.objects.select_related('user', 'guest').order_by('id')
+        if options['missing_only']:
+            reservations = reservations.filter(contact__isnull=True)
+
+        total = 0
+        last_id = 0
+        while True:
+            # ID のキーセットで進めるため、件数が多くても OFFSET で遅くならない
+            batch = list(reservations.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            total += sync_contacts(batch)
+            last_id = batch[-1].id
+            self.stdout.write(f'{total}件処理しました（予約ID {last_id} まで）')
+
+        self.stdout.write(self.style.SUCCESS(f'検索用連絡先を{total}件作成・更新しました。'))
@@ -0,0 +1,143 @@
+import datetime
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection, connections
+from reservations.availability import available_time_slots
+from reservations.booking import book_slot
+from reservations.models import CustomUser, ManagementOffice, Facility, FacilityItem, FacilityTimeSlot
+
+# 1日24枠（1時間刻み）。書き込みスレッドごとに1設備を受け持ち、枠が埋まったら翌日に進む
+SLOTS_PER_DAY = 24
+
+# 変更前の DATABASES（ENGINE と NAME のみ）：PRAGMA・タイムアウトは SQLite / Django の既定、
+# リクエストごとに接続を閉じ、トランザクションは DEFERRED
+DEFAULT_OVERRIDES = {
+    'OPTIONS': {},
+    'CONN_MAX_AGE': 0,
+    'CONN_HEALTH_CHECKS': False,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        '変更前の DATABASES 設定と現在の設定（WAL などの PRAGMA・永続接続・IMMEDIATE）で、'
+        'book_slot による並行予約のスループットとロックエラー件数を比較します（一時ファイルを使用）。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help='予約を書き込むスレッド数')
+        parser.add_argument('--readers', type=int, default=4, help='空き状況を読み取るスレッド数')
+        parser.add_argument('--bookings', type=int, default=200, help='書き込みスレッドごとの予約件数（最大1440）')
+
+    def handle(self, *args, **options):
+        options['bookings'] = min(options['bookings'], 1440)
+        # default 接続の設定を差し替えて計測し、最後に元へ戻す（テスト用 DB の作成と同じ方法）
+        settings_dict = connection.settings_dict
+        original = dict(settings_dict)
+        try:
+            for label, overrides in (('既定', DEFAULT_OVERRIDES), ('調整後', {})):
+                with tempfile.TemporaryDirectory() as directory:
+                    connection.close()
+                    settings_dict.clear()
+                    settings_dict.update(original, NAME=os.path.join(directory, 'bench.sqlite3'), **overrides)
+                    call_command('migrate', verbosity=0, interactive=False)
+                    items = self.seed(options['writers'])
+                    connection.close()
+                    result = self.run(items, options['readers'], options['bookings'])
+
+                self.stdout.write(
+                    f"{label}: {result['booked'] / result['elapsed']:.0f} 件/秒"
+                    f"（予約 {result['booked']} 件、ロックエラー {result['locked']} 件、"
+                    f"読み取り {result['reads']} 回、{result['elapsed']:.2f} 秒）"
+                )
+        finally:
+            connection.close()
+            settings_dict.clear()
+            settings_dict.update(original)
+
+    def seed(self, writers):
+        office = ManagementOffice.objects.create(name='計測用管理所')
+        facility = Facility.objects.create(office=office, name='計測用施設')
+        slots = [
+            FacilityTimeSlot.objects.create(
+                facility=facility, start_time=datetime.time(hour), end_time=datetime.time(hour, 59)
+            )
+            for hour in range(SLOTS_PER_DAY)
+        ]
+        items = []
+        for n in range(writers):
+            user = CustomUser.objects.create_user(
+                username=f'bench{n}', password='x', email=f'bench{n}@example.com',
+                full_name=f'計測 {n}', phone=f'090{n:08d}',
+            )
+            item = FacilityItem.objects.create(facility=facility, item_name=f'計測用設備{n}')
+            items.append((item, user, slots))
+        return items
+
+    def run(self, items, readers, bookings):
+        # gunicorn の同期ワーカーと同じく、ワーカーごとに別プロセス・別接続で書き込む
+        # （差し替えた接続設定を引き継ぐため fork で起動する）
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        stop = context.Event()
+        first_day = datetime.date.today() + datetime.timedelta(days=1)
+        last_day = first_day + datetime.timedelta(days=(bookings - 1) // SLOTS_PER_DAY)
+
+        def finish_request():
+            # リクエスト終了時と同じく、CONN_MAX_AGE を過ぎた接続（既定では毎回）を閉じる
+            close_old_connections()
+
+        def writer(item, user, slots):
+            counts = Counter()
+            for n in range(bookings):
+                day = first_day + datetime.timedelta(days=n // SLOTS_PER_DAY)
+                try:
+                    book_slot(item, day, slots[n % SLOTS_PER_DAY], user=user)
+                    counts['booked'] += 1
+                except OperationalError:
+                    counts['locked'] += 1
+                finally:
+                    finish_request()
+            connections.close_all()
+            results.put(counts)
+
+        def reader():
+            counts = Counter()
+            while not stop.is_set():
+                item, _, slots = random.choice(items)
+                day = first_day + datetime.timedelta(days=random.randint(0, (last_day - first_day).days))
+                try:
+                    available_time_slots(item, day, slots=slots)
+                    counts['reads'] += 1
+                except OperationalError:
+                    counts['locked'] += 1
+                finally:
+                    finish_request()
+            connections.close_all()
+            results.put(counts)
+
+        connections.close_all()
+        writer_processes = [context.Process(target=writer, args=entry) for entry in items]
+        reader_processes = [context.Process(target=reader) for _ in range(readers)]
+        started = time.perf_counter()
+        for process in reader_processes + writer_processes:
+            process.start()
+        counts = Counter()
+        for _ in writer_processes:
+            counts.update(results.get())
+        elapsed = time.perf_counter() - started
+        stop.set()
+        for _ in reader_processes:
+            counts.update(results.get())
+        for process in reader_processes + writer_processes:
+            process.join()
+
+        return {
+            'booked': counts['booked'], 'locked': counts['locked'], 'reads': counts['reads'], 'elapsed': elapsed,
+        }
@@ -0,0 +1,100 @@
+import datetime
+import re
+from collections import Counter
+from contextlib import contextmanager
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from reservations.forms import MEMBER_BOOKING_DAYS
+from reservations.models import CustomUser, ManagementOffice, Facility, FacilityItem, FacilityTimeSlot, Reservation
+
+# 1日あたりの時間帯（9:00〜21:00 の1時間枠）。足りない分は翌日以降に回す
+FIRST_HOUR = 9
+SLOTS_PER_DAY = 12
+# 明日から予約可能期間の最終日まで
+MAX_BOOKINGS = SLOTS_PER_DAY * (MEMBER_BOOKING_DAYS - 1)
+
+WRITE_RE = re.compile(r'^\s*(INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+"?(\w+)"?', re.IGNORECASE)
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def count_writes(counter):
+    # 書き込み系 SQL をテーブルごとに数える
+    def wrapper(execute, sql, params, many, context):
+        match = WRITE_RE.match(sql)
+        if match:
+            counter[match.group(2)] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        yield
+
+
+class Command(BaseCommand):
+    help = '予約ウィザード1件あたりの書き込み回数を、選択状態の保存先（cookie / session）ごとに計測します（データは残しません）。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookings', type=int, default=10, help='各モードで行う予約の件数')
+
+    def handle(self, *args, **options):
+        bookings = options['bookings']
+        if not 1 <= bookings <= MAX_BOOKINGS:
+            raise CommandError(f'--bookings は 1〜{MAX_BOOKINGS} の範囲で指定してください。')
+        for backend in ('session', 'cookie'):
+            counter = Counter()
+            try:
+                with transaction.atomic():
+                    self.run_bookings(backend, bookings, counter)
+                    raise Rollback()
+            except Rollback:
+                pass
+
+            total = sum(counter.values())
+            sessions = counter['django_session']
+            self.stdout.write(
+                f'{backend:>7}: 書き込み {total / bookings:.1f} 回/予約'
+                f'（うち django_session {sessions / bookings:.1f} 回）'
+            )
+            for table, count in counter.most_common():
+                self.stdout.write(f'         {table}: {count}')
+
+    def run_bookings(self, backend, bookings, counter):
+        office = ManagementOffice.objects.create(name='ベンチマーク管理所')
+        facility = Facility.objects.create(office=office, name='ベンチマーク施設')
+        item = FacilityItem.objects.create(facility=facility, item_name='1号台')
+        slots = [
+            FacilityTimeSlot.objects.create(
+                facility=facility, start_time=datetime.time(hour), end_time=datetime.time(hour + 1)
+            )
+            for hour in range(FIRST_HOUR, FIRST_HOUR + min(bookings, SLOTS_PER_DAY))
+        ]
+        user = CustomUser.objects.create_user(
+            username=f'bench-{backend}', password='bench', email=f'bench-{backend}@example.com', full_name='ベンチ'
+        )
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+
+        client = Client(SERVER_NAME='localhost')
+        with override_settings(WIZARD_STATE_BACKEND=backend):
+            client.force_login(user)
+            # ログイン時のセッション作成は計測に含めない
+            with count_writes(counter):
+                for n in range(bookings):
+                    slot = slots[n % len(slots)]
+                    day = tomorrow + datetime.timedelta(days=n // len(slots))
+                    # 他の管理所があると自動選択されないため、管理所も明示して送る
+                    client.post(reverse('reservations:select_office'), {'office_id': office.id})
+                    client.post(reverse('reservations:select_facility'), {'facility_id': facility.id})
+                    client.post(reverse('reservations:select_item'), {'item_id': item.id})
+                    client.post(reverse('reservations:select_date'), {'date': str(day)})
+                    client.post(reverse('reservations:select_time_slot'), {'time_slot': str(slot.id)})
+                    client.post(reverse('reservations:reserve_confirm'))
+
+        booked = Reservation.objects.filter(user=user).count()
+        if booked != bookings:
+            # 途中で予約できていなければ、1件あたりの回数が正しく出ない
+            raise CommandError(f'{backend}: {bookings} 件中 {booked} 件しか予約できませんでした。')
@@ -0,0 +1,39 @@
+import datetime
+from django.core.management.base import BaseCommand, CommandError
+from reservations.models import ManagementOffice
+from reservations.exports import export_querysets, iter_csv, EXPORT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = '管理所・期間を指定して予約を CSV（UTF-8 BOM 付き）で出力します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('office_id', type=int, help='管理所ID')
+        parser.add_argument('date_from', type=datetime.date.fromisoformat, help='開始日（YYYY-MM-DD）')
+        parser.add_argument('date_to', type=datetime.date.fromisoformat, help='終了日（YYYY-MM-DD）')
+        parser.add_argument('--output', '-o', help='出力先ファイル（省略時は標準出力）')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE, help='1回に読み込む件数')
+
+    def handle(self, *args, **options):
+        try:
+            office = ManagementOffice.objects.get(id=options['office_id'])
+        except ManagementOffice.DoesNotExist:
+            raise CommandError('指定された管理所が見つかりません。')
+        if options['date_from'] > options['date_to']:
+            raise CommandError('終了日は開始日以降を指定してください。')
+
+        rows = iter_csv(
+            export_querysets(office, options['date_from'], options['date_to']),
+            chunk_size=options['chunk_size'],
+        )
+        output = options['output']
+        if output:
+            count = -1  # ヘッダー行を除いた件数
+            with open(output, 'w', encoding='utf-8', newline='') as f:
+                for line in rows:
+                    f.write(line)
+                    count += 1
+            self.stderr.write(self.style.SUCCESS(f'{count}件の予約を {output} に出力しました。'))
+        else:
+            for line in rows:
+                self.stdout.write(line, ending='')
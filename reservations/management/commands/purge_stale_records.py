@@ -0,0 +1,68 @@
+import time
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from reservations.guests import purge_guest_batch
+
+# django_session テーブルを使うセッションエンジン
+DB_SESSION_ENGINES = ('django.contrib.sessions.backends.db', 'django.contrib.sessions.backends.cached_db')
+
+
+class Command(BaseCommand):
+    help = '予約のないゲストと期限切れのセッションを、短いトランザクションのバッチに分けて削除します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='1トランザクションで削除する件数')
+        parser.add_argument('--sleep', type=float, default=0.05, help='バッチ間の待ち時間（秒）。予約の書き込みに割り込ませる')
+        parser.add_argument(
+            '--include-archived', action='store_true',
+            help='保管済みの予約だけが残っているゲストも削除する（保管先の一覧では氏名が表示されなくなる）',
+        )
+        parser.add_argument('--skip-sessions', action='store_true', help='期限切れセッションは削除しない')
+
+    def handle(self, *args, **options):
+        self.run(
+            'ゲスト',
+            self.guest_batches(options['batch_size'], options['include_archived']),
+            options['sleep'],
+        )
+        if options['skip_sessions'] or settings.SESSION_ENGINE not in DB_SESSION_ENGINES:
+            return
+        self.run('期限切れセッション', self.session_batches(options['batch_size']), options['sleep'])
+
+    def guest_batches(self, batch_size, include_archived):
+        after_id = 0
+        while True:
+            deleted, after_id = purge_guest_batch(after_id, batch_size, include_archived)
+            if not deleted:
+                return
+            yield deleted
+
+    def session_batches(self, batch_size):
+        now = timezone.now()
+        while True:
+            # expire_date のインデックスで古い順に取り出し、主キーで削除する
+            with transaction.atomic():
+                keys = list(
+                    Session.objects.filter(expire_date__lt=now)
+                    .order_by('expire_date').values_list('session_key', flat=True)[:batch_size]
+                )
+                if not keys:
+                    return
+                Session.objects.filter(session_key__in=keys).delete()
+            yield len(keys)
+
+    def run(self, label, batches, sleep):
+        started = time.perf_counter()
+        total = 0
+        for deleted in batches:
+            total += deleted
+            self.stdout.write(f'{label}: {total}件削除しました')
+            time.sleep(sleep)
+        elapsed = time.perf_counter() - started
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'{label}を{total}件削除しました（{elapsed:.2f} 秒、{rate:.0f} 件/秒）'
+        ))
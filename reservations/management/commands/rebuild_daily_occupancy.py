@@ -0,0 +1,39 @@
+import datetime
+import time
+from django.core.management.base import BaseCommand, CommandError
+from reservations.occupancy import rebuild_occupancy, reservation_date_range
+
+
+class Command(BaseCommand):
+    help = '稼働状況の日次集計（DailyOccupancy）を、予約と保管済みの予約から期間ごとのバッチに分けて作り直します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=datetime.date.fromisoformat, help='開始日（既定は最初の予約の日）')
+        parser.add_argument('--to', dest='date_to', type=datetime.date.fromisoformat, help='終了日（既定は最後の予約の日）')
+        parser.add_argument('--batch-days', type=int, default=31, help='1回の集計で扱う日数')
+        parser.add_argument('--sleep', type=float, default=0.05, help='バッチ間の待ち時間（秒）。予約の書き込みに割り込ませる')
+
+    def handle(self, *args, **options):
+        bounds = reservation_date_range()
+        if bounds is None and not (options['date_from'] and options['date_to']):
+            self.stdout.write('予約がありません。')
+            return
+        date_from = options['date_from'] or bounds[0]
+        date_to = options['date_to'] or bounds[1]
+        if date_from > date_to:
+            raise CommandError('開始日は終了日以前の日付を指定してください。')
+
+        started = time.perf_counter()
+        total = 0
+        start = date_from
+        while start <= date_to:
+            end = min(start + datetime.timedelta(days=options['batch_days'] - 1), date_to)
+            total += rebuild_occupancy(start, end)
+            self.stdout.write(f'{start} 〜 {end}: 累計{total}行')
+            start = end + datetime.timedelta(days=1)
+            if start <= date_to:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{date_from} 〜 {date_to} の稼働状況を{total}行作り直しました（{time.perf_counter() - started:.2f} 秒）。'
+        ))
@@ -0,0 +1,36 @@
+import sqlite3
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'default の SQLite データベースを読み取り用レプリカ（SQLITE_REPLICA_PATH）にオンラインバックアップでコピーします。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0, help='指定した秒数ごとに繰り返す（0 なら1回だけ）')
+        parser.add_argument('--pages', type=int, default=1024, help='1ステップでコピーするページ数（書き込みを長く止めないため）')
+
+    def handle(self, *args, **options):
+        replica = settings.DATABASES.get('replica')
+        if not replica:
+            raise CommandError('レプリカが設定されていません（環境変数 SQLITE_REPLICA_PATH を指定してください）。')
+
+        while True:
+            started = time.perf_counter()
+            self.copy(settings.DATABASES['default']['NAME'], replica['NAME'], options['pages'])
+            self.stdout.write(f'レプリカを更新しました（{time.perf_counter() - started:.2f} 秒）')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def copy(self, source_path, replica_path, pages):
+        # バックアップ API はページ単位でコピーし、途中で default が更新されたらやり直すため一貫したスナップショットになる
+        timeout = settings.SQLITE_PRAGMAS['busy_timeout'] / 1000
+        source = sqlite3.connect(source_path, timeout=timeout)
+        target = sqlite3.connect(replica_path, timeout=timeout)
+        try:
+            source.backup(target, pages=pages)
+        finally:
+            target.close()
+            source.close()
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from reservations.holds import sweep_expired_holds
+
+
+class Command(BaseCommand):
+    help = '期限切れの仮押さえ（SlotHold）を一括削除します。'
+
+    def handle(self, *args, **options):
+        deleted = sweep_expired_holds()
+        self.stdout.write(self.style.SUCCESS(f'期限切れの仮押さえを{deleted}件削除しました。'))
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-17 20:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0005_remove_reservation_facility_reservation_facilityitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacilityItemAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='予約日')),
+                ('bitmap', models.BinaryField(verbose_name='予約済みビットマップ')),
+                ('slot_count', models.PositiveSmallIntegerField(verbose_name='時間帯数')),
+                ('facilityItem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='reservations.facilityitem', verbose_name='施設')),
+            ],
+            options={
+                'verbose_name': '空き状況インデックス',
+                'verbose_name_plural': '空き状況インデックス',
+                'constraints': [models.UniqueConstraint(fields=('facilityItem', 'date'), name='uniq_availability_item_date')],
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:00
+
+from django.db import migrations, models
+from django.db.models import Count
+
+# エラーメッセージに列挙する重複予約の上限
+REPORT_LIMIT = 200
+
+
+def check_duplicate_reservations(apps, schema_editor):
+    # 制約追加前に、同じ設備・日付・開始時間の重複予約があれば一覧を示して中止する
+    # （お客様の予約のため自動では削除せず、運用担当者が手作業で解消する）
+    Reservation = apps.get_model('reservations', 'Reservation')
+    duplicates = (
+        Reservation.objects.values('facilityItem', 'date', 'start_time')
+        .annotate(n=Count('id'))
+        .filter(n__gt=1)
+        .order_by()
+    )
+    keys = [(dup['facilityItem'], dup['date'], dup['start_time']) for dup in duplicates]
+    if not keys:
+        return
+
+    lines = []
+    for item_id, day, start_time in keys:
+        for reservation_id, user_id, guest_id, created_at in Reservation.objects.filter(
+            facilityItem=item_id, date=day, start_time=start_time
+        ).order_by('id').values_list('id', 'user_id', 'guest_id', 'created_at'):
+            lines.append(
+                f"  予約ID={reservation_id} 設備ID={item_id} 日付={day} 開始={start_time} "
+                f"ユーザーID={user_id} ゲストID={guest_id} 作成={created_at}"
+            )
+    shown = '\n'.join(lines[:REPORT_LIMIT])
+    rest = f"\n  ほか{len(lines) - REPORT_LIMIT}件" if len(lines) > REPORT_LIMIT else ''
+    raise RuntimeError(
+        f"同じ設備・日付・開始時間の重複予約が{len(keys)}組あります。"
+        f"各組で残す予約を決めて他を削除・変更してから、もう一度 migrate を実行してください。\n{shown}{rest}"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0006_facilityitemavailability'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_reservations, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='reservation',
+            constraint=models.UniqueConstraint(fields=('facilityItem', 'date', 'start_time'), name='uniq_reservation_item_slot'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0007_reservation_unique_slot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlotHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='予約日')),
+                ('start_time', models.TimeField(verbose_name='開始時間')),
+                ('holder', models.CharField(max_length=64, verbose_name='保持者トークン')),
+                ('expires_at', models.DateTimeField(verbose_name='有効期限')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('facilityItem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='reservations.facilityitem', verbose_name='施設')),
+            ],
+            options={
+                'verbose_name': '仮押さえ',
+                'verbose_name_plural': '仮押さえ',
+                'indexes': [models.Index(fields=['expires_at'], name='slothold_expires_idx'), models.Index(fields=['holder'], name='slothold_holder_idx')],
+                'constraints': [models.UniqueConstraint(fields=('facilityItem', 'date', 'start_time'), name='uniq_slothold_item_slot')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0008_slothold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimeSlotTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='テンプレート名')),
+                ('open_time', models.TimeField(verbose_name='開始時間')),
+                ('close_time', models.TimeField(verbose_name='終了時間')),
+                ('slot_minutes', models.PositiveSmallIntegerField(choices=[(60, '1時間'), (120, '2時間'), (180, '3時間')], default=60, verbose_name='1枠の長さ')),
+                ('breaks', models.CharField(blank=True, help_text='例：12:00-13:00,17:00-18:00', max_length=200, verbose_name='休憩時間')),
+                ('office', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='reservations.managementoffice', verbose_name='管理所')),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0009_timeslottemplate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='バージョン')),
+            ],
+            options={
+                'verbose_name': 'カタログバージョン',
+                'verbose_name_plural': 'カタログバージョン',
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:12
+
+import re
+import unicodedata
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+# reservations.search の正規化をこのマイグレーション時点の内容で固定したもの
+def contact_values(person):
+    if person is None:
+        return {'name': '', 'phone': '', 'email': ''}
+    name = re.sub(r'\s+', '', unicodedata.normalize('NFKC', person.full_name or '')).casefold()
+    phone = re.sub(r'\D', '', unicodedata.normalize('NFKC', person.phone or ''))
+    email = (person.email or '').strip().lower()
+    return {'name': name[:100], 'phone': phone[:20], 'email': email[:254]}
+
+
+def backfill_contacts(apps, schema_editor):
+    # 既存の予約の検索用連絡先を ID 順のバッチで作る（作らないと予約検索で既存の予約が見つからない）
+    Reservation = apps.get_model('reservations', 'Reservation')
+    ReservationContact = apps.get_model('reservations', 'ReservationContact')
+    reservations = Reservation.objects.select_related('user', 'guest').order_by('id')
+    last_id = 0
+    while True:
+        batch = list(reservations.filter(id__gt=last_id)[:BATCH_SIZE])
+        if not batch:
+            break
+        ReservationContact.objects.bulk_create([
+            ReservationContact(reservation_id=reservation.id, **contact_values(reservation.user or reservation.guest))
+            for reservation in batch
+        ])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0010_catalogversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservationContact',
+            fields=[
+                ('reservation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='contact', serialize=False, to='reservations.reservation', verbose_name='予約')),
+                ('name', models.CharField(blank=True, max_length=100, verbose_name='氏名（正規化）')),
+                ('phone', models.CharField(blank=True, max_length=20, verbose_name='電話番号（数字のみ）')),
+                ('email', models.CharField(blank=True, max_length=254, verbose_name='メールアドレス（小文字）')),
+            ],
+            options={
+                'verbose_name': '予約検索用連絡先',
+                'verbose_name_plural': '予約検索用連絡先',
+                'indexes': [models.Index(fields=['name'], name='contact_name_idx'), models.Index(fields=['phone'], name='contact_phone_idx'), models.Index(fields=['email'], name='contact_email_idx')],
+            },
+        ),
+        # テーブルごと削除されるため、逆方向では何もしない
+        migrations.RunPython(backfill_contacts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+from django.db import migrations
+
+# 登録ユーザー検索用の FTS5 仮想テーブルとトリガー（SQLite のみ）
+# reservations.search の定義をこのマイグレーション時点の内容で固定したもの。
+# 以降の変更は search.ensure_user_fts（migrate 後に毎回確認）で反映する。
+FTS_TABLE = 'reservations_customuser_fts'
+# trigram トークナイザは SQLite 3.34 以降でのみ使える
+MIN_SQLITE_VERSION = (3, 34, 0)
+
+TRIGGERS = {
+    f'{FTS_TABLE}_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON reservations_customuser BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, full_name, phone, email)
+            VALUES (new.id, new.full_name, new.phone, new.email);
+        END
+    """,
+    f'{FTS_TABLE}_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON reservations_customuser BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, full_name, phone, email)
+            VALUES ('delete', old.id, old.full_name, old.phone, old.email);
+        END
+    """,
+    f'{FTS_TABLE}_au': f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+        AFTER UPDATE OF full_name, phone, email ON reservations_customuser BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, full_name, phone, email)
+            VALUES ('delete', old.id, old.full_name, old.phone, old.email);
+            INSERT INTO {FTS_TABLE}(rowid, full_name, phone, email)
+            VALUES (new.id, new.full_name, new.phone, new.email);
+        END
+    """,
+}
+
+
+def _fts_supported(conn):
+    return conn.vendor == 'sqlite' and conn.Database.sqlite_version_info >= MIN_SQLITE_VERSION
+
+
+def create_fts(apps, schema_editor):
+    # SQLite 以外、または trigram のない古い SQLite では何もしない（検索は icontains で行う）
+    conn = schema_editor.connection
+    if not _fts_supported(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+                full_name, phone, email,
+                content='reservations_customuser', content_rowid='id', tokenize='trigram'
+            )
+        """)
+        for sql in TRIGGERS.values():
+            cursor.execute(sql)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_fts(apps, schema_editor):
+    conn = schema_editor.connection
+    if conn.vendor != 'sqlite':
+        return
+    with conn.cursor() as cursor:
+        for name in TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0011_reservationcontact'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
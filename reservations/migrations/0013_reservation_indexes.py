@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0012_customuser_fts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['user', 'date', 'end_time'], name='reservation_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['-date', 'start_time', 'id'], name='reservation_order_idx'),
+        ),
+    ]
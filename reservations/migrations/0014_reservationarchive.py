@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0013_reservation_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservationArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='予約ID')),
+                ('date', models.DateField(verbose_name='予約日')),
+                ('start_time', models.TimeField(verbose_name='開始時間')),
+                ('end_time', models.TimeField(verbose_name='終了時間')),
+                ('created_at', models.DateTimeField(verbose_name='作成日時')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='移動日時')),
+                ('contact_name', models.CharField(blank=True, max_length=100, verbose_name='氏名（正規化）')),
+                ('contact_phone', models.CharField(blank=True, max_length=20, verbose_name='電話番号（数字のみ）')),
+                ('contact_email', models.CharField(blank=True, max_length=254, verbose_name='メールアドレス（小文字）')),
+                ('facilityItem', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='reservations.facilityitem', verbose_name='施設')),
+                ('guest', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='reservations.temporaryreservationuser', verbose_name='非登録ユーザー')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='登録ユーザー')),
+            ],
+            options={
+                'verbose_name': '予約（保管）',
+                'verbose_name_plural': '予約（保管）',
+                'ordering': ['-date', 'start_time'],
+                'indexes': [models.Index(fields=['-date', 'start_time', 'id'], name='archive_order_idx'), models.Index(fields=['contact_name'], name='archive_contact_name_idx'), models.Index(fields=['contact_phone'], name='archive_contact_phone_idx'), models.Index(fields=['contact_email'], name='archive_contact_email_idx')],
+            },
+        ),
+    ]
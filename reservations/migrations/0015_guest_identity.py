@@ -0,0 +1,89 @@
+import re
+import unicodedata
+from django.db import migrations, models
+from django.db.models import Case, When, Value
+
+BATCH_SIZE = 500
+
+
+# reservations.search の正規化をこのマイグレーション時点の内容で固定したもの
+def guest_identity(phone, email):
+    email_key = (email or '').strip().lower()
+    phone_key = re.sub(r'\D', '', unicodedata.normalize('NFKC', phone or ''))
+    return email_key[:254], phone_key[:20]
+
+
+def contact_values(guest):
+    email, phone = guest_identity(guest.phone, guest.email)
+    name = re.sub(r'\s+', '', unicodedata.normalize('NFKC', guest.full_name or '')).casefold()
+    return {'name': name[:100], 'phone': phone, 'email': email}
+
+
+def merge_duplicate_guests(apps, schema_editor):
+    Guest = apps.get_model('reservations', 'TemporaryReservationUser')
+    Reservation = apps.get_model('reservations', 'Reservation')
+    ReservationArchive = apps.get_model('reservations', 'ReservationArchive')
+    ReservationContact = apps.get_model('reservations', 'ReservationContact')
+
+    # 正規化したメールアドレス・電話番号を ID 順にまとめて埋める
+    last_id = 0
+    while True:
+        batch = list(Guest.objects.filter(id__gt=last_id).order_by('id')[:BATCH_SIZE])
+        if not batch:
+            break
+        for guest in batch:
+            guest.email_key, guest.phone_key = guest_identity(guest.phone, guest.email)
+        Guest.objects.bulk_update(batch, ['email_key', 'phone_key'])
+        last_id = batch[-1].id
+
+    # 同じ組のゲストは最新の行（最も大きい ID）に寄せる: {重複ID: 残すID}
+    merge_into = {}
+    previous_key, keep_id = None, None
+    rows = Guest.objects.order_by('email_key', 'phone_key', '-id').values_list('email_key', 'phone_key', 'id')
+    for email_key, phone_key, guest_id in rows.iterator(chunk_size=BATCH_SIZE):
+        if (email_key, phone_key) == previous_key:
+            merge_into[guest_id] = keep_id
+        else:
+            previous_key, keep_id = (email_key, phone_key), guest_id
+
+    duplicate_ids = list(merge_into)
+    for start in range(0, len(duplicate_ids), BATCH_SIZE):
+        chunk = duplicate_ids[start:start + BATCH_SIZE]
+        repoint = Case(*[When(guest_id=old_id, then=Value(merge_into[old_id])) for old_id in chunk])
+        Reservation.objects.filter(guest_id__in=chunk).update(guest_id=repoint)
+        ReservationArchive.objects.filter(guest_id__in=chunk).update(guest_id=repoint)
+        Guest.objects.filter(id__in=chunk).delete()
+
+        # update() ではシグナルが送られないため、付け替えた予約の検索用連絡先を残すゲストの値にそろえる
+        for guest in Guest.objects.filter(id__in={merge_into[old_id] for old_id in chunk}):
+            values = contact_values(guest)
+            ReservationContact.objects.filter(reservation__guest_id=guest.id).update(**values)
+            ReservationArchive.objects.filter(guest_id=guest.id).update(
+                **{f'contact_{field}': value for field, value in values.items()}
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0014_reservationarchive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='temporaryreservationuser',
+            name='email_key',
+            field=models.CharField(default='', editable=False, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='temporaryreservationuser',
+            name='phone_key',
+            field=models.CharField(default='', editable=False, max_length=20),
+        ),
+        # 統合した行は元に戻せないため、逆方向では何もしない
+        migrations.RunPython(merge_duplicate_guests, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='temporaryreservationuser',
+            constraint=models.UniqueConstraint(fields=('email_key', 'phone_key'), name='unique_guest_identity'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0015_guest_identity'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='temporaryreservationuser',
+            index=models.Index(fields=['full_name'], name='guest_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='temporaryreservationuser',
+            index=models.Index(fields=['phone_key'], name='guest_phone_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservations', '0016_guest_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='日付')),
+                ('booked_slots', models.PositiveSmallIntegerField(verbose_name='予約済み時間帯数')),
+                ('slot_count', models.PositiveSmallIntegerField(verbose_name='時間帯数')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('facilityItem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='reservations.facilityitem', verbose_name='施設')),
+            ],
+            options={
+                'verbose_name': '稼働状況',
+                'verbose_name_plural': '稼働状況',
+                'constraints': [models.UniqueConstraint(fields=('facilityItem', 'date'), name='uniq_occupancy_item_date')],
+            },
+        ),
+    ]
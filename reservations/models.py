@@ -52,6 +52,37 @@ class FacilityTimeSlot(models.Model):
         return f"{self.start_time.strftime('%H:%M')} - {self.end_time.strftime('%H:%M')}"
 
 
+# 時間帯テンプレート（営業時間・1枠の長さ・休憩から FacilityTimeSlot を一括生成）
+class TimeSlotTemplate(models.Model):
+    SLOT_MINUTES_CHOICES = [
+        (60, '1時間'),
+        (120, '2時間'),
+        (180, '3時間'),
+    ]
+
+    office = models.ForeignKey(ManagementOffice, on_delete=models.CASCADE, verbose_name="管理所")
+    name = models.CharField(max_length=100, verbose_name="テンプレート名")
+    open_time = models.TimeField(verbose_name="開始時間")
+    close_time = models.TimeField(verbose_name="終了時間")
+    slot_minutes = models.PositiveSmallIntegerField(choices=SLOT_MINUTES_CHOICES, default=60, verbose_name="1枠の長さ")
+    breaks = models.CharField(max_length=200, blank=True, verbose_name="休憩時間", help_text="例：12:00-13:00,17:00-18:00")
+
+    def __str__(self):
+        return f"{self.name}（{self.open_time.strftime('%H:%M')} - {self.close_time.strftime('%H:%M')}）"
+
+
+# カタログ（管理所・施設・設備・時間帯）のバージョン（変更のたびに加算、1行のみ）
+class CatalogVersion(models.Model):
+    version = models.PositiveBigIntegerField(default=0, verbose_name="バージョン")
+
+    class Meta:
+        verbose_name = "カタログバージョン"
+        verbose_name_plural = "カタログバージョン"
+
+    def __str__(self):
+        return str(self.version)
+
+
 # 管理者プロフィール（管理所に紐づく）
 class ManagerProfile(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -66,6 +97,19 @@ class TemporaryReservationUser(models.Model):
     full_name = models.CharField(max_length=100, verbose_name="氏名")
     phone = models.CharField(max_length=20, verbose_name="電話番号")
     email = models.EmailField(verbose_name="メールアドレス")
+    # 同じゲストを1行にまとめるための正規化済みの値（search.normalize_email / normalize_phone）
+    email_key = models.CharField(max_length=254, default='', editable=False)
+    phone_key = models.CharField(max_length=20, default='', editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['email_key', 'phone_key'], name='unique_guest_identity'),
+        ]
+        indexes = [
+            # 管理画面の前方一致検索用（メールアドレスは unique_guest_identity の先頭列で引ける）
+            models.Index(fields=['full_name'], name='guest_name_idx'),
+            models.Index(fields=['phone_key'], name='guest_phone_idx'),
+        ]
 
     def __str__(self):
         return self.full_name
@@ -87,11 +131,152 @@ class Reservation(models.Model):
         verbose_name = "予約"
         verbose_name_plural = "予約"
         ordering = ['-date', 'start_time']
+        constraints = [
+            # 同じ設備・日付・開始時間の二重予約をDBで防ぐ
+            models.UniqueConstraint(fields=['facilityItem', 'date', 'start_time'], name='uniq_reservation_item_slot'),
+        ]
+        indexes = [
+            # 利用者ホーム：自分の予約のうち終了していないもの
+            models.Index(fields=['user', 'date', 'end_time'], name='reservation_user_date_idx'),
+            # 既定の並び順・予約検索のキーセット（日付の範囲指定にも使う）
+            models.Index(fields=['-date', 'start_time', 'id'], name='reservation_order_idx'),
+        ]
 
     def __str__(self):
         facility_name = self.facilityItem.facility.name if self.facilityItem and self.facilityItem.facility else "未設定"
         return f"{self.date} {facility_name} {self.start_time.strftime('%H:%M')} - {self.end_time.strftime('%H:%M')}"
-    
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 読み込み時の（設備, 日付）を保持し、編集時に旧キーの空き状況も更新できるようにする
+        loaded = dict(zip(field_names, values))
+        instance._loaded_slot_key = (loaded.get('facilityItem_id'), loaded.get('date'))
+        # 予約者が変わったときだけ検索用の連絡先を更新する
+        instance._loaded_contact_key = (loaded.get('user_id'), loaded.get('guest_id'))
+        return instance
+
+
+# 過去の予約の保管先（archive_reservations コマンドで Reservation から移動、IDは元の予約のまま）
+class ReservationArchive(models.Model):
+    id = models.BigIntegerField(primary_key=True, verbose_name="予約ID")
+    # 設備・利用者が削除されても履歴は残す
+    facilityItem = models.ForeignKey(FacilityItem, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="施設")
+    date = models.DateField(verbose_name="予約日")
+    start_time = models.TimeField(verbose_name="開始時間")
+    end_time = models.TimeField(verbose_name="終了時間")
+    user = models.ForeignKey('CustomUser', null=True, blank=True, on_delete=models.SET_NULL, verbose_name="登録ユーザー")
+    guest = models.ForeignKey('TemporaryReservationUser', null=True, blank=True, on_delete=models.SET_NULL, verbose_name="非登録ユーザー")
+    created_at = models.DateTimeField(verbose_name="作成日時")
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name="移動日時")
+    # 予約検索用の連絡先（ReservationContact と同じ正規化）
+    contact_name = models.CharField(max_length=100, blank=True, verbose_name="氏名（正規化）")
+    contact_phone = models.CharField(max_length=20, blank=True, verbose_name="電話番号（数字のみ）")
+    contact_email = models.CharField(max_length=254, blank=True, verbose_name="メールアドレス（小文字）")
+
+    class Meta:
+        verbose_name = "予約（保管）"
+        verbose_name_plural = "予約（保管）"
+        ordering = ['-date', 'start_time']
+        indexes = [
+            models.Index(fields=['-date', 'start_time', 'id'], name='archive_order_idx'),
+            models.Index(fields=['contact_name'], name='archive_contact_name_idx'),
+            models.Index(fields=['contact_phone'], name='archive_contact_phone_idx'),
+            models.Index(fields=['contact_email'], name='archive_contact_email_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.start_time.strftime('%H:%M')} - {self.end_time.strftime('%H:%M')}"
+
+
+# 予約検索用の連絡先（予約1件につき1行、登録ユーザー・ゲストの氏名等を正規化して保持）
+class ReservationContact(models.Model):
+    reservation = models.OneToOneField(
+        Reservation, on_delete=models.CASCADE, primary_key=True, related_name='contact', verbose_name="予約"
+    )
+    name = models.CharField(max_length=100, blank=True, verbose_name="氏名（正規化）")
+    phone = models.CharField(max_length=20, blank=True, verbose_name="電話番号（数字のみ）")
+    email = models.CharField(max_length=254, blank=True, verbose_name="メールアドレス（小文字）")
+
+    class Meta:
+        verbose_name = "予約検索用連絡先"
+        verbose_name_plural = "予約検索用連絡先"
+        indexes = [
+            models.Index(fields=['name'], name='contact_name_idx'),
+            models.Index(fields=['phone'], name='contact_phone_idx'),
+            models.Index(fields=['email'], name='contact_email_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.reservation_id} {self.name}"
+
+
+# 空き状況インデックス（設備×日付ごとの予約済み時間帯ビットマップ）
+# bitmap の i ビット目は、施設の FacilityTimeSlot を (start_time, id) 順に並べた i 番目の時間帯に対応する
+class FacilityItemAvailability(models.Model):
+    facilityItem = models.ForeignKey(FacilityItem, on_delete=models.CASCADE, verbose_name="施設")
+    date = models.DateField(verbose_name="予約日")
+    bitmap = models.BinaryField(verbose_name="予約済みビットマップ")
+    slot_count = models.PositiveSmallIntegerField(verbose_name="時間帯数")
+
+    class Meta:
+        verbose_name = "空き状況インデックス"
+        verbose_name_plural = "空き状況インデックス"
+        constraints = [
+            models.UniqueConstraint(fields=['facilityItem', 'date'], name='uniq_availability_item_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.facilityItem_id} {self.date}"
+
+
+# 稼働状況の日次集計（設備×日付ごとの予約済み時間帯数）
+# 予約の変更時に空き状況インデックスと同時に更新し、保管（ReservationArchive）へ移した後も残す
+class DailyOccupancy(models.Model):
+    facilityItem = models.ForeignKey(FacilityItem, on_delete=models.CASCADE, verbose_name="施設")
+    date = models.DateField(verbose_name="日付")
+    booked_slots = models.PositiveSmallIntegerField(verbose_name="予約済み時間帯数")
+    slot_count = models.PositiveSmallIntegerField(verbose_name="時間帯数")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
+
+    class Meta:
+        verbose_name = "稼働状況"
+        verbose_name_plural = "稼働状況"
+        constraints = [
+            models.UniqueConstraint(fields=['facilityItem', 'date'], name='uniq_occupancy_item_date'),
+        ]
+
+    @property
+    def available_slots(self):
+        return self.slot_count - self.booked_slots
+
+    def __str__(self):
+        return f"{self.facilityItem_id} {self.date} {self.booked_slots}/{self.slot_count}"
+
+
+# 時間帯の仮押さえ（時間帯選択から予約確定までの一時的な確保）
+class SlotHold(models.Model):
+    facilityItem = models.ForeignKey(FacilityItem, on_delete=models.CASCADE, verbose_name="施設")
+    date = models.DateField(verbose_name="予約日")
+    start_time = models.TimeField(verbose_name="開始時間")
+    holder = models.CharField(max_length=64, verbose_name="保持者トークン")
+    expires_at = models.DateTimeField(verbose_name="有効期限")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
+
+    class Meta:
+        verbose_name = "仮押さえ"
+        verbose_name_plural = "仮押さえ"
+        constraints = [
+            models.UniqueConstraint(fields=['facilityItem', 'date', 'start_time'], name='uniq_slothold_item_slot'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='slothold_expires_idx'),
+            models.Index(fields=['holder'], name='slothold_holder_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.start_time.strftime('%H:%M')} ({self.expires_at})"
+
     
 class InvitationCode(models.Model):
     code = models.CharField(max_length=20, unique=True, verbose_name="招待コード")
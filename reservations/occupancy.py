@@ -0,0 +1,165 @@
+import datetime
+from collections import defaultdict
+from django.db.models import Count, Exists, F, FilteredRelation, Min, Max, OuterRef, Q, Sum
+from django.utils import timezone
+from .catalog import get_catalog, current_version
+from .models import DailyOccupancy, FacilityItem, FacilityTimeSlot, Reservation, ReservationArchive
+
+
+def occupancy_row(item_id, day, bitmap, slot_count):
+    # 予約済みビットマップの立っているビット数がその日の予約済み時間帯数
+    return DailyOccupancy(facilityItem_id=item_id, date=day, booked_slots=bitmap.bit_count(), slot_count=slot_count)
+
+
+def save_occupancy(rows):
+    DailyOccupancy.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['facilityItem', 'date'],
+        update_fields=['booked_slots', 'slot_count', 'updated_at'],
+    )
+
+
+def touch_occupancy_for_person(person, field):
+    """ユーザー・ゲストの予約がある日の日次集計の更新日時を進める（field: 'user' / 'guest'）
+
+    予約表に表示する予約者名が変わったことを day_etag に反映させる。
+    """
+    return DailyOccupancy.objects.filter(Exists(Reservation.objects.filter(
+        facilityItem_id=OuterRef('facilityItem_id'), date=OuterRef('date'), **{field: person},
+    ))).update(updated_at=timezone.now())
+
+
+def _booked_slot_counts(model, item_ids, date_from, date_to):
+    # 予約区間と重なる時間帯を JOIN で数える（availability_grid と同じ集計を保管先にも使う）
+    rows = model.objects.filter(
+        facilityItem_id__in=item_ids,
+        date__range=(date_from, date_to),
+    ).annotate(
+        overlapping_slot=FilteredRelation(
+            'facilityItem__facility__facilitytimeslot',
+            condition=Q(
+                facilityItem__facility__facilitytimeslot__start_time__lt=F('end_time'),
+                facilityItem__facility__facilitytimeslot__end_time__gt=F('start_time'),
+            ),
+        ),
+    ).values('facilityItem_id', 'date').annotate(
+        booked=Count('overlapping_slot', distinct=True)
+    ).order_by()
+    return {(row['facilityItem_id'], row['date']): row['booked'] for row in rows}
+
+
+def reservation_date_range():
+    """予約（保管済みを含む）のある最初と最後の日付（予約がなければ None）"""
+    bounds = [
+        model.objects.aggregate(first=Min('date'), last=Max('date'))
+        for model in (Reservation, ReservationArchive)
+    ]
+    firsts = [bound['first'] for bound in bounds if bound['first']]
+    lasts = [bound['last'] for bound in bounds if bound['last']]
+    if not firsts:
+        return None
+    return min(firsts), max(lasts)
+
+
+def rebuild_occupancy(date_from, date_to, facility_ids=None):
+    """期間内の稼働状況を予約と保管済みの予約から集計し直す（行数を返す）
+
+    呼び出し側で期間を区切って繰り返すこと（1回の集計で読む予約の件数を抑えるため）。
+    """
+    items = FacilityItem.objects.all()
+    slots = FacilityTimeSlot.objects.all()
+    if facility_ids is not None:
+        items = items.filter(facility_id__in=facility_ids)
+        slots = slots.filter(facility_id__in=facility_ids)
+    facility_of = dict(items.values_list('id', 'facility_id'))
+    slot_counts = dict(slots.values('facility_id').annotate(n=Count('id')).order_by().values_list('facility_id', 'n'))
+    item_ids = list(facility_of)
+
+    booked = defaultdict(int)
+    for model in (Reservation, ReservationArchive):
+        for key, count in _booked_slot_counts(model, item_ids, date_from, date_to).items():
+            booked[key] += count
+    # 予約がすべて削除された日は 0 件として書き直す
+    existing = DailyOccupancy.objects.filter(
+        facilityItem_id__in=item_ids, date__range=(date_from, date_to)
+    ).values_list('facilityItem_id', 'date')
+
+    rows = [
+        DailyOccupancy(
+            facilityItem_id=item_id,
+            date=day,
+            booked_slots=booked.get((item_id, day), 0),
+            slot_count=slot_counts.get(facility_of[item_id], 0),
+        )
+        for item_id, day in set(booked) | set(existing)
+    ]
+    save_occupancy(rows)
+    return len(rows)
+
+
+def refresh_future_occupancy(facility_ids):
+    # 時間帯の変更後、今日以降の集計を新しい時間帯で数え直す（過去分は当時の時間帯のまま残す）
+    today = datetime.date.today()
+    last = DailyOccupancy.objects.filter(
+        facilityItem__facility_id__in=facility_ids, date__gte=today
+    ).aggregate(last=Max('date'))['last']
+    if last:
+        rebuild_occupancy(today, last, facility_ids=facility_ids)
+
+
+def heat_shade(rate):
+    # ヒートマップの濃さ（Bootstrap の bg-opacity の値、予約なしは空文字）
+    if not rate:
+        return ''
+    for limit, shade in ((25, '25'), (50, '50'), (75, '75')):
+        if rate <= limit:
+            return shade
+    return '100'
+
+
+def facility_occupancy(office_id, date_from, date_to):
+    """管理所の施設×日付の稼働率（ヒートマップ用）
+
+    集計表を施設×日付で合計する1回のクエリで求め、予約を直接読まない。
+    稼働率は「予約済み時間帯数 ÷（設備数 × 時間帯数）」で、設備数・時間帯数はカタログの現在の値を使う。
+    """
+    days = [date_from + datetime.timedelta(days=n) for n in range((date_to - date_from).days + 1)]
+    booked = {
+        (row['facilityItem__facility_id'], row['date']): row['booked']
+        for row in DailyOccupancy.objects.filter(
+            facilityItem__facility__office_id=office_id,
+            date__range=(date_from, date_to),
+        ).values('facilityItem__facility_id', 'date').annotate(booked=Sum('booked_slots')).order_by()
+    }
+
+    catalog = get_catalog()
+    rows = []
+    for facility in sorted(catalog.facilities_of(office_id), key=lambda facility: facility.name):
+        capacity = len(catalog.items_of(facility.id)) * len(catalog.slots_of(facility.id))
+        cells = []
+        for day in days:
+            count = booked.get((facility.id, day), 0)
+            rate = min(100, round(count * 100 / capacity)) if capacity else None
+            cells.append({'date': day, 'booked': count, 'rate': rate, 'shade': heat_shade(rate)})
+        total = sum(cell['booked'] for cell in cells)
+        rows.append({
+            'facility': facility,
+            'cells': cells,
+            'booked': total,
+            'rate': min(100, round(total * 100 / (capacity * len(days)))) if capacity else None,
+        })
+    return {'days': days, 'rows': rows}
+
+
+def day_etag(facility_id, day):
+    """施設の1日分の予約表の ETag（日次集計の最終更新日時と件数、カタログのバージョンから作る）
+
+    予約の作成・変更・削除と予約者の氏名などの変更はその日の日次集計の更新日時を進め、
+    設備・時間帯の変更はカタログのバージョンを進めるため、どちらも変わらなければ予約表も変わっていない。
+    """
+    summary = DailyOccupancy.objects.filter(
+        facilityItem__facility_id=facility_id, date=day
+    ).aggregate(last=Max('updated_at'), rows=Count('id'))
+    last = summary['last'].timestamp() if summary['last'] else 0
+    return f"{facility_id}-{day.isoformat()}-{current_version()}-{summary['rows']}-{last}"
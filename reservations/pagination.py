@@ -0,0 +1,72 @@
+import datetime
+from django.db.models import Q
+
+# 予約一覧の並び順（新しい日付 → 開始時間 → ID）
+RESERVATION_ORDER = ('-date', 'start_time', 'id')
+
+
+def encode_reservation_cursor(reservation):
+    return f"{reservation.date.isoformat()}_{reservation.start_time.isoformat()}_{reservation.id}"
+
+
+def decode_reservation_cursor(value):
+    """カーソル文字列を (日付, 開始時間, ID) にする（不正な値は None）"""
+    try:
+        day, start_time, pk = (value or '').split('_')
+        return datetime.date.fromisoformat(day), datetime.time.fromisoformat(start_time), int(pk)
+    except ValueError:
+        return None
+
+
+def reservations_after(cursor):
+    # RESERVATION_ORDER でカーソルより後ろにある行の条件
+    day, start_time, pk = cursor
+    return (
+        Q(date__lt=day)
+        | Q(date=day, start_time__gt=start_time)
+        | Q(date=day, start_time=start_time, id__gt=pk)
+    )
+
+
+def keyset_page(queryset, after=None, size=50):
+    """キーセット方式で1ページ分の予約を返す: (行のリスト, 次ページのカーソル)
+
+    OFFSET を使わないため、何ページ目でもインデックスを先頭から読み飛ばさない。
+    """
+    queryset = queryset.order_by(*RESERVATION_ORDER)
+    cursor = decode_reservation_cursor(after) if after else None
+    if cursor:
+        queryset = queryset.filter(reservations_after(cursor))
+
+    # 1件多く取得して次ページの有無を判定する
+    rows = list(queryset[:size + 1])
+    if len(rows) > size:
+        rows = rows[:size]
+        return rows, encode_reservation_cursor(rows[-1])
+    return rows, None
+
+
+def chained_keyset_page(sources, after=None, size=50):
+    """複数のクエリセットを順に連結し、キーセット方式で1ページ分を返す: (行のリスト, 次ページのカーソル)
+
+    sources は [(名前, クエリセット)]。カーソルは '名前~日付_開始時間_ID' の形で、
+    どのクエリセットのどこまで読んだかを表す（名前のない旧形式は先頭のクエリセットとして扱う）。
+    """
+    names = [name for name, _ in sources]
+    start, inner = 0, after or None
+    if after and '~' in after:
+        name, inner = after.split('~', 1)
+        start = names.index(name) if name in names else 0
+        inner = inner or None
+
+    rows = []
+    for index in range(start, len(sources)):
+        name, queryset = sources[index]
+        page, next_cursor = keyset_page(queryset, after=inner if index == start else None, size=size - len(rows))
+        rows.extend(page)
+        if next_cursor:
+            return rows, f'{name}~{next_cursor}'
+        if len(rows) >= size:
+            # ちょうどこのクエリセットを読み切ったので、次ページは次のクエリセットの先頭から
+            return rows, (f'{names[index + 1]}~' if index + 1 < len(sources) else None)
+    return rows, None
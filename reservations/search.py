@@ -0,0 +1,242 @@
+import re
+import unicodedata
+from django.db import connection, connections
+from django.db.models import Q
+from .models import ReservationArchive, ReservationContact
+from .occupancy import touch_occupancy_for_person
+
+# 前方一致を範囲検索（>= prefix かつ < prefix + 最大文字）に置き換えるための上限
+PREFIX_UPPER = '\U0010FFFF'
+
+
+def normalize_name(value):
+    # 全角・半角をそろえ、空白を除いて大文字小文字を区別しない
+    value = unicodedata.normalize('NFKC', value or '')
+    return re.sub(r'\s+', '', value).casefold()
+
+
+def normalize_phone(value):
+    # 全角数字もそろえたうえで数字だけを残す（ハイフン・括弧などは除く）
+    value = unicodedata.normalize('NFKC', value or '')
+    return re.sub(r'\D', '', value)
+
+
+def normalize_email(value):
+    return (value or '').strip().lower()
+
+
+def guest_identity(phone, email):
+    # ゲストはメールアドレスと電話番号（どちらも正規化済み）の組で同一人物とみなす
+    return normalize_email(email)[:254], normalize_phone(phone)[:20]
+
+
+def contact_values(person):
+    """登録ユーザー・ゲスト（どちらも full_name / phone / email を持つ）から検索用の値を作る"""
+    if person is None:
+        return {'name': '', 'phone': '', 'email': ''}
+    return {
+        'name': normalize_name(person.full_name)[:100],
+        'phone': normalize_phone(person.phone)[:20],
+        'email': normalize_email(person.email)[:254],
+    }
+
+
+def sync_contacts(reservations):
+    """予約（user・guest を select_related 済み）の検索用連絡先をまとめて作成・更新する"""
+    rows = [
+        ReservationContact(reservation_id=reservation.id, **contact_values(reservation.user or reservation.guest))
+        for reservation in reservations
+    ]
+    ReservationContact.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['reservation'],
+        update_fields=['name', 'phone', 'email'],
+    )
+    return len(rows)
+
+
+def _archive_contact_values(values):
+    return {f'contact_{field}': value for field, value in values.items()}
+
+
+def sync_contacts_for_person(person, field):
+    """ユーザー・ゲストの変更を、その人の予約すべて（保管分を含む）の検索用連絡先に反映する（field: 'user' / 'guest'）"""
+    values = contact_values(person)
+    ReservationArchive.objects.filter(**{field: person}).update(**_archive_contact_values(values))
+    # 予約表（施設の1日分）に表示する予約者名が変わるため、その日の ETag を変える
+    touch_occupancy_for_person(person, field)
+    return ReservationContact.objects.filter(**{f'reservation__{field}': person}).update(**values)
+
+
+def clear_contacts_for_person(person, field):
+    # ユーザー・ゲストの削除で予約側は NULL になる（SET_NULL）ため、連絡先も空にする
+    values = contact_values(None)
+    ReservationArchive.objects.filter(**{field: person}).update(**_archive_contact_values(values))
+    touch_occupancy_for_person(person, field)
+    return ReservationContact.objects.filter(**{f'reservation__{field}': person}).update(**values)
+
+
+def _prefix_q(column, prefix):
+    return Q(**{f'{column}__gte': prefix, f'{column}__lt': prefix + PREFIX_UPPER})
+
+
+def contact_prefix_q(name=None, phone=None, email=None, column_prefix='contact__'):
+    """氏名・電話番号・メールアドレスの前方一致条件（インデックスの範囲検索になる）
+
+    保管先（ReservationArchive）では column_prefix='contact_' を指定する。
+    """
+    q = Q()
+    for field, raw, normalize in (
+        ('name', name, normalize_name),
+        ('phone', phone, normalize_phone),
+        ('email', email, normalize_email),
+    ):
+        if not raw:
+            continue
+        prefix = normalize(raw)
+        if not prefix:
+            # 正規化すると空になる入力（数字を含まない電話番号など）は何にも一致させない
+            return Q(pk__in=[])
+        q &= _prefix_q(column_prefix + field, prefix)
+    return q
+
+
+def _any_prefix_q(pairs):
+    # (列, 前方一致の値) のいずれかに一致する条件（値が空の組は使わない）
+    q = Q()
+    for column, prefix in pairs:
+        if prefix:
+            q |= _prefix_q(column, prefix)
+    return q if q else Q(pk__in=[])
+
+
+def contact_term_q(term, column_prefix='contact__'):
+    """1つの語を氏名・電話番号・メールアドレスのいずれかの前方一致として探す条件（管理画面の検索欄用）"""
+    return _any_prefix_q([
+        (column_prefix + 'name', normalize_name(term)),
+        (column_prefix + 'phone', normalize_phone(term)),
+        (column_prefix + 'email', normalize_email(term)),
+    ])
+
+
+def guest_term_q(term):
+    # ゲストの氏名・正規化済みのメールアドレス・電話番号の前方一致（それぞれインデックスあり）
+    email_key, phone_key = guest_identity(phone=term, email=term)
+    return _any_prefix_q([('full_name', term.strip()), ('email_key', email_key), ('phone_key', phone_key)])
+
+
+# 登録ユーザー検索用の FTS5 仮想テーブル（SQLite のみ）
+# reservations_customuser を参照する外部コンテンツ型で、trigram により日本語の部分一致にも対応する
+USER_FTS_TABLE = 'reservations_customuser_fts'
+# trigram は3文字未満の語を索引で引けないため、それより短い語は LIKE で絞り込む
+FTS_MIN_TERM_LENGTH = 3
+# trigram トークナイザは SQLite 3.34 以降でのみ使える（それより古い場合は icontains で検索する）
+FTS_MIN_SQLITE_VERSION = (3, 34, 0)
+
+_USER_FTS_TRIGGERS = {
+    f'{USER_FTS_TABLE}_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS {USER_FTS_TABLE}_ai AFTER INSERT ON reservations_customuser BEGIN
+            INSERT INTO {USER_FTS_TABLE}(rowid, full_name, phone, email)
+            VALUES (new.id, new.full_name, new.phone, new.email);
+        END
+    """,
+    f'{USER_FTS_TABLE}_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS {USER_FTS_TABLE}_ad AFTER DELETE ON reservations_customuser BEGIN
+            INSERT INTO {USER_FTS_TABLE}({USER_FTS_TABLE}, rowid, full_name, phone, email)
+            VALUES ('delete', old.id, old.full_name, old.phone, old.email);
+        END
+    """,
+    f'{USER_FTS_TABLE}_au': f"""
+        CREATE TRIGGER IF NOT EXISTS {USER_FTS_TABLE}_au
+        AFTER UPDATE OF full_name, phone, email ON reservations_customuser BEGIN
+            INSERT INTO {USER_FTS_TABLE}({USER_FTS_TABLE}, rowid, full_name, phone, email)
+            VALUES ('delete', old.id, old.full_name, old.phone, old.email);
+            INSERT INTO {USER_FTS_TABLE}(rowid, full_name, phone, email)
+            VALUES (new.id, new.full_name, new.phone, new.email);
+        END
+    """,
+}
+
+
+def user_fts_supported(conn):
+    return conn.vendor == 'sqlite' and conn.Database.sqlite_version_info >= FTS_MIN_SQLITE_VERSION
+
+
+def ensure_user_fts(conn):
+    """FTS テーブルとトリガーを作成する（なければ）
+
+    SQLite ではテーブルの作り直しを伴うマイグレーションでトリガーが消えるため、
+    migrate のたびに確認し、作り直した場合は索引も再構築する。
+    """
+    if not user_fts_supported(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name = %s OR (type = 'trigger' AND tbl_name = 'reservations_customuser')",
+            [USER_FTS_TABLE],
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        if USER_FTS_TABLE in existing and existing.issuperset(_USER_FTS_TRIGGERS):
+            return
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {USER_FTS_TABLE} USING fts5(
+                full_name, phone, email,
+                content='reservations_customuser', content_rowid='id', tokenize='trigram'
+            )
+        """)
+        for sql in _USER_FTS_TRIGGERS.values():
+            cursor.execute(sql)
+        cursor.execute(f"INSERT INTO {USER_FTS_TABLE}({USER_FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_user_fts(conn):
+    if conn.vendor != 'sqlite':
+        return
+    with conn.cursor() as cursor:
+        for name in _USER_FTS_TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(f"DROP TABLE IF EXISTS {USER_FTS_TABLE}")
+
+
+def _fts_phrase(term):
+    # FTS5 のクエリ構文として解釈させないよう、二重引用符で囲んだ語句にする
+    return '"' + term.replace('"', '""') + '"'
+
+
+def search_users(users, limit, **terms):
+    """登録ユーザーを氏名・電話番号・メールアドレスの部分一致で検索する
+
+    SQLite（3.34 以降）では FTS5 で一致度順（bm25）に最大 limit 件を求め、その順に並べたリストを返す。
+    それ以外のデータベースや3文字未満の語だけの検索では、従来どおり icontains で絞り込み、
+    氏名順のクエリセット（件数の上限なし）を返す。
+    """
+    terms = {field: value.strip() for field, value in terms.items() if value and value.strip()}
+    fts_terms = {field: value for field, value in terms.items() if len(value) >= FTS_MIN_TERM_LENGTH}
+
+    if not user_fts_supported(connection) or not fts_terms:
+        for field, value in terms.items():
+            users = users.filter(**{f'{field}__icontains': value})
+        return users.order_by('full_name')
+
+    # 3文字未満の語と、スーパーユーザー・自分自身の除外は、順位付けの前に ID の絞り込みとして SQL に含める
+    # （上位 limit 件を取ってから絞り込むと、除外された行の分だけ結果が欠ける）
+    for field, value in terms.items():
+        if field not in fts_terms:
+            users = users.filter(**{f'{field}__icontains': value})
+    candidates_sql, candidates_params = users.values('id').query.sql_with_params()
+
+    match = ' AND '.join(
+        f'{{{field}}} : {_fts_phrase(value)}' for field, value in fts_terms.items()
+    )
+    with connections[users.db].cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {USER_FTS_TABLE} WHERE {USER_FTS_TABLE} MATCH %s "
+            f"AND rowid IN ({candidates_sql}) "
+            f"ORDER BY bm25({USER_FTS_TABLE}) LIMIT %s",
+            [match, *candidates_params, limit],
+        )
+        ranked_ids = [row[0] for row in cursor.fetchall()]
+
+    rank = {user_id: n for n, user_id in enumerate(ranked_ids)}
+    return sorted(users.filter(id__in=ranked_ids), key=lambda user: rank[user.id])
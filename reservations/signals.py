@@ -0,0 +1,167 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db.models import QuerySet
+from django.db import connections
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, post_migrate
+from django.dispatch import receiver, Signal
+from .models import (
+    Reservation, ManagementOffice, Facility, FacilityItem, FacilityTimeSlot, CustomUser, TemporaryReservationUser,
+)
+from .availability import as_date, refresh_availability, refresh_availability_many, invalidate_facility
+from .catalog import bump_catalog_version
+from .search import (
+    sync_contacts, sync_contacts_for_person, clear_contacts_for_person, ensure_user_fts, guest_identity,
+)
+
+# bulk_create など post_save が送られない一括書き込みの後に送る（keys: (設備ID, 日付) の集合）
+reservations_bulk_changed = Signal()
+
+_muted = ContextVar('reservations_signals_muted', default=False)
+
+
+@contextmanager
+def signals_muted():
+    """一括処理中は行単位のインデックス更新を止める（呼び出し側でまとめて更新すること）"""
+    token = _muted.set(True)
+    try:
+        yield
+    finally:
+        _muted.reset(token)
+
+
+def _slot_key(instance):
+    return (instance.facilityItem_id, as_date(instance.date))
+
+
+# 予約の作成・編集時：新旧両方の（設備, 日付）の空き状況を更新
+@receiver(post_save, sender=Reservation)
+def update_availability_on_save(sender, instance, raw=False, **kwargs):
+    if raw or _muted.get():
+        return
+    keys = {_slot_key(instance)}
+    loaded_key = getattr(instance, '_loaded_slot_key', None)
+    if loaded_key and loaded_key[0]:
+        keys.add((loaded_key[0], as_date(loaded_key[1])))
+
+    for item_id, day in keys:
+        if item_id:
+            refresh_availability(item_id, day, record_occupancy=True)
+
+    instance._loaded_slot_key = _slot_key(instance)
+
+
+def _deleted_directly(origin, model=Reservation):
+    # 設備・施設の削除に伴うカスケード削除ではインデックスも一緒に消えるため更新しない
+    if isinstance(origin, model):
+        return True
+    return isinstance(origin, QuerySet) and origin.model is model
+
+
+# 予約の削除時
+@receiver(post_delete, sender=Reservation)
+def update_availability_on_delete(sender, instance, origin=None, **kwargs):
+    if _muted.get():
+        return
+    if instance.facilityItem_id and _deleted_directly(origin):
+        refresh_availability(instance.facilityItem_id, instance.date, record_occupancy=True)
+
+
+# 一括予約・一括削除の後
+@receiver(reservations_bulk_changed)
+def update_availability_on_bulk_change(sender, keys, **kwargs):
+    refresh_availability_many(keys)
+
+
+# 予約の作成時・予約者の変更時：検索用の連絡先を更新
+@receiver(post_save, sender=Reservation)
+def sync_contact_on_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw or _muted.get():
+        return
+    contact_key = (instance.user_id, instance.guest_id)
+    if created or contact_key != getattr(instance, '_loaded_contact_key', None):
+        sync_contacts([instance])
+    instance._loaded_contact_key = contact_key
+
+
+# 一括予約の後：連絡先のない予約の分をまとめて作成
+@receiver(reservations_bulk_changed)
+def sync_contacts_on_bulk_change(sender, keys, **kwargs):
+    keys = {(item_id, as_date(day)) for item_id, day in keys if item_id}
+    if not keys:
+        return
+    candidates = Reservation.objects.filter(
+        facilityItem_id__in={item_id for item_id, _ in keys},
+        date__in={day for _, day in keys},
+        contact__isnull=True,
+    ).select_related('user', 'guest')
+    sync_contacts(r for r in candidates if (r.facilityItem_id, r.date) in keys)
+
+
+_CONTACT_FIELDS = {'full_name', 'phone', 'email'}
+
+
+# 登録ユーザー・ゲストの氏名・電話番号・メールアドレス変更時
+@receiver(post_save, sender=CustomUser)
+@receiver(post_save, sender=TemporaryReservationUser)
+def sync_contacts_on_person_save(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    if raw or created or _muted.get():
+        return
+    # ログイン時の last_login 更新など、連絡先に関係しない保存は無視する
+    if update_fields is not None and not _CONTACT_FIELDS & set(update_fields):
+        return
+    sync_contacts_for_person(instance, 'user' if sender is CustomUser else 'guest')
+
+
+# 管理画面などでゲストを直接保存したときも同一人物の判定に使う値をそろえる
+@receiver(pre_save, sender=TemporaryReservationUser)
+def set_guest_identity(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    instance.email_key, instance.phone_key = guest_identity(instance.phone, instance.email)
+
+
+# 登録ユーザー・ゲストの削除時（予約は SET_NULL で残る）
+@receiver(pre_delete, sender=CustomUser)
+@receiver(pre_delete, sender=TemporaryReservationUser)
+def clear_contacts_on_person_delete(sender, instance, **kwargs):
+    if _muted.get():
+        return
+    clear_contacts_for_person(instance, 'user' if sender is CustomUser else 'guest')
+
+
+# 時間帯の変更時はビット位置が変わるため施設ごと破棄
+@receiver(post_save, sender=FacilityTimeSlot)
+@receiver(post_delete, sender=FacilityTimeSlot)
+def invalidate_availability_on_slot_change(sender, instance, raw=False, origin=None, **kwargs):
+    if raw or _muted.get():
+        return
+    if origin is not None and not _deleted_directly(origin, FacilityTimeSlot):
+        return
+    invalidate_facility(instance.facility_id)
+
+
+# 管理所・施設・設備・時間帯の変更時は、各プロセスのカタログを次回参照時に読み直させる
+@receiver(post_save, sender=ManagementOffice)
+@receiver(post_delete, sender=ManagementOffice)
+@receiver(post_save, sender=Facility)
+@receiver(post_delete, sender=Facility)
+@receiver(post_save, sender=FacilityItem)
+@receiver(post_delete, sender=FacilityItem)
+@receiver(post_save, sender=FacilityTimeSlot)
+@receiver(post_delete, sender=FacilityTimeSlot)
+def bump_catalog_on_change(sender, raw=False, **kwargs):
+    if raw or _muted.get():
+        return
+    bump_catalog_version()
+
+
+# migrate の後：テーブルの作り直しで消えた登録ユーザー検索用のトリガーを作り直す
+@receiver(post_migrate)
+def ensure_user_fts_after_migrate(sender, using='default', **kwargs):
+    if sender.name != 'reservations':
+        return
+    conn = connections[using]
+    # 0012 より前に戻した場合は作り直さない
+    if ('reservations', '0012_customuser_fts') in MigrationRecorder(conn).applied_migrations():
+        ensure_user_fts(conn)
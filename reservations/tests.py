@@ -1,3 +1,967 @@
-from django.test import TestCase
+import csv
+import datetime
+import re
+import threading
+from io import StringIO
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core import signing
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.http import HttpResponse, QueryDict
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from .models import (
+    CustomUser, ManagementOffice, ManagerProfile, Facility, FacilityItem, FacilityTimeSlot, Reservation, ReservationArchive,
+    TemporaryReservationUser, DailyOccupancy, SlotHold, TimeSlotTemplate, ReservationContact,
+    InvitationCode, FacilityItemAvailability,
+)
+from .archive import archive_batch
+from .guests import upsert_guest, purge_guest_batch
+from .occupancy import rebuild_occupancy
+from .availability import day_timeline, decode_bitmap
+from .booking import book_slot, bulk_book, move_reservation, SlotAlreadyReserved
+from .holds import take_hold, is_held_by_other, sweep_expired_holds
+from .pagination import reservations_after
+from yoyakumate.db_router import ReplicaRouter, read_replica
+from yoyakumate.middleware.replica_pin import ReplicaPinMiddleware
+from yoyakumate.middleware.wizard_state import WIZARD_COOKIE_SALT
+from .intervals import IntervalSet, IntervalOverlapError
+from .timeslots import expand_template, apply_template
+from .catalog import get_catalog
+from .search import search_users
+from .invitations import generate_invitation_codes
+from .signals import signals_muted, reservations_bulk_changed
 
-# Create your tests here.
+
+def create_facility(item_count=2, hours=(9, 10, 11)):
+    office = ManagementOffice.objects.create(name='テスト管理所')
+    facility = Facility.objects.create(office=office, name='卓球')
+    for hour in hours:
+        FacilityTimeSlot.objects.create(
+            facility=facility, start_time=datetime.time(hour), end_time=datetime.time(hour + 1)
+        )
+    items = [FacilityItem.objects.create(facility=facility, item_name=f'{n}号台') for n in range(1, item_count + 1)]
+    return facility, items
+
+
+class IntervalSetTests(SimpleTestCase):
+    def test_touching_intervals_do_not_overlap(self):
+        intervals = IntervalSet([(9, 10)])
+        self.assertTrue(intervals.is_free(10, 11))
+        self.assertTrue(intervals.is_free(8, 9))
+        intervals.add(10, 11)
+        self.assertEqual(list(intervals), [(9, 10), (10, 11)])
+
+    def test_nested_and_overlapping_intervals(self):
+        intervals = IntervalSet([(9, 12)])
+        self.assertTrue(intervals.overlaps(10, 11))   # 内側
+        self.assertTrue(intervals.overlaps(8, 13))    # 外側
+        self.assertTrue(intervals.overlaps(11, 13))   # 後ろにかかる
+        self.assertTrue(intervals.overlaps(8, 10))    # 前にかかる
+        with self.assertRaises(IntervalOverlapError):
+            intervals.add(11, 13)
+        with self.assertRaises(ValueError):
+            intervals.add(14, 14)
+        # 既存データの重なり・内包はまとめて1区間にする
+        self.assertEqual(list(IntervalSet([(9, 11), (10, 12), (13, 15), (13, 14)])), [(9, 12), (13, 15)])
+
+    def test_gaps(self):
+        intervals = IntervalSet([(10, 11), (13, 14), (14, 15)])
+        self.assertEqual(intervals.gaps(9, 16), [(9, 10), (11, 13), (15, 16)])
+        self.assertEqual(intervals.gaps(10, 15), [(11, 13)])
+        self.assertEqual(intervals.gaps(13, 15), [])
+        self.assertEqual(IntervalSet().gaps(9, 12), [(9, 12)])
+
+
+class CatalogInvalidationTests(TestCase):
+    def test_catalog_changes_bump_version(self):
+        facility, items = create_facility(item_count=1, hours=(9,))
+        catalog = get_catalog()
+        self.assertEqual([i.item_name for i in catalog.items_of(facility.id)], ['1号台'])
+        # 変更がなければスナップショットを使い回す
+        self.assertIs(get_catalog(), catalog)
+
+        facility.name = 'バドミントン'
+        facility.save()
+        self.assertEqual(get_catalog().facility(facility.id).name, 'バドミントン')
+
+        new_item = FacilityItem.objects.create(facility=facility, item_name='2号台')
+        self.assertEqual(len(get_catalog().items_of(facility.id)), 2)
+        new_item.delete()
+        self.assertIsNone(get_catalog().item(new_item.id))
+
+        FacilityTimeSlot.objects.create(facility=facility, start_time=datetime.time(10), end_time=datetime.time(11))
+        self.assertEqual(len(get_catalog().slots_of(facility.id)), 2)
+        self.assertGreater(get_catalog().version, catalog.version)
+
+    def test_muted_signals_do_not_bump(self):
+        facility, items = create_facility(item_count=1, hours=(9,))
+        version = get_catalog().version
+        with signals_muted():
+            FacilityItem.objects.create(facility=facility, item_name='2号台')
+        self.assertEqual(get_catalog().version, version)
+
+
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        # テストではレプリカを用意しないため、設定済みとして振り分けだけを確かめる
+        for target in ('yoyakumate.db_router.replica_configured', 'yoyakumate.middleware.replica_pin.replica_configured'):
+            patcher = mock.patch(target, return_value=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def test_reads_after_a_write_stay_on_primary(self):
+        seen = []
+
+        @read_replica
+        def view(request):
+            seen.append(self.router.db_for_read(Reservation))
+            if 'write' in request.GET:
+                self.router.db_for_write(Reservation)
+                seen.append(self.router.db_for_read(Reservation))
+            return HttpResponse()
+
+        middleware = ReplicaPinMiddleware(view)
+        response = middleware(self.factory.get('/'))
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE_NAME, response.cookies)
+
+        # 書き込みの後は同じリクエスト内の読み取りも default、応答で Cookie を付ける
+        response = middleware(self.factory.get('/', {'write': 1}))
+        self.assertIn(settings.REPLICA_PIN_COOKIE_NAME, response.cookies)
+
+        # Cookie の有効期間中は次のリクエストの読み取りも default
+        request = self.factory.get('/')
+        request.COOKIES[settings.REPLICA_PIN_COOKIE_NAME] = '1'
+        middleware(request)
+        self.assertEqual(seen, ['replica', 'replica', 'default', 'default'])
+
+    def test_catalog_reads_primary_inside_replica_views(self):
+        facility, items = create_facility(item_count=1, hours=(9,))
+
+        @read_replica
+        def view(request):
+            # レプリカの接続はないため、振り分けられるとエラーになる
+            return HttpResponse(get_catalog().facility(facility.id).name)
+
+        self.assertEqual(ReplicaPinMiddleware(view)(self.factory.get('/')).content.decode(), '卓球')
+
+
+class AvailabilityGridTests(TestCase):
+    def guest_grid_queries(self, item_count):
+        facility, items = create_facility(item_count=item_count)
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        for item in items:
+            Reservation.objects.create(
+                facilityItem=item, date=tomorrow,
+                start_time=datetime.time(9), end_time=datetime.time(10),
+            )
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(
+                reverse('reservations:guest_availability_grid'),
+                {'facility': facility.id, 'period': 'month', 'format': 'json'},
+            )
+        data = response.json()
+        self.assertEqual(len(data['dates']), 31)
+        self.assertEqual(len(data['items']), item_count)
+        self.assertEqual(data['items'][0]['free'][1], 2)
+        return len(ctx.captured_queries)
+
+    def test_guest_month_grid_has_fixed_query_budget(self):
+        small = self.guest_grid_queries(item_count=2)
+        Reservation.objects.all().delete()
+        large = self.guest_grid_queries(item_count=30)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, 3)
+
+
+class AvailabilityIndexTests(TestCase):
+    """空き状況インデックス（FacilityItemAvailability）が予約の変更に追従するか"""
+
+    def setUp(self):
+        self.facility, self.items = create_facility()
+        self.slots = list(FacilityTimeSlot.objects.filter(facility=self.facility).order_by('start_time', 'id'))
+        self.day = datetime.date.today() + datetime.timedelta(days=1)
+        self.next_day = self.day + datetime.timedelta(days=1)
+
+    def assertIndexMatches(self, item, day):
+        # 予約の行から直接ビットマップを組み立てて比較する
+        expected = 0
+        for i, slot in enumerate(self.slots):
+            for start_time, end_time in Reservation.objects.filter(
+                facilityItem=item, date=day
+            ).values_list('start_time', 'end_time'):
+                if start_time < slot.end_time and slot.start_time < end_time:
+                    expected |= 1 << i
+        row = FacilityItemAvailability.objects.get(facilityItem=item, date=day)
+        self.assertEqual(row.slot_count, len(self.slots))
+        self.assertEqual(decode_bitmap(row.bitmap), expected, f'{item} {day}')
+
+    def assertAllIndexesMatch(self):
+        for item in self.items:
+            for day in (self.day, self.next_day):
+                self.assertIndexMatches(item, day)
+
+    def reserve(self, item, day, slot):
+        return Reservation.objects.create(
+            facilityItem=item, date=day, start_time=slot.start_time, end_time=slot.end_time
+        )
+
+    def test_create_and_delete(self):
+        reservation = book_slot(self.items[0], self.day, self.slots[1])
+        self.assertIndexMatches(self.items[0], self.day)
+        self.assertEqual(decode_bitmap(
+            FacilityItemAvailability.objects.get(facilityItem=self.items[0], date=self.day).bitmap
+        ), 0b010)
+
+        reservation.delete()
+        self.assertIndexMatches(self.items[0], self.day)
+        self.reserve(self.items[0], self.day, self.slots[0])
+        Reservation.objects.filter(facilityItem=self.items[0]).delete()
+        self.assertIndexMatches(self.items[0], self.day)
+
+    def test_edit_time_on_same_day(self):
+        reservation = self.reserve(self.items[0], self.day, self.slots[0])
+        reservation = Reservation.objects.get(id=reservation.id)
+        reservation.start_time = self.slots[0].start_time
+        reservation.end_time = self.slots[2].end_time
+        reservation.save()
+        self.assertIndexMatches(self.items[0], self.day)
+
+        reservation.start_time = self.slots[2].start_time
+        reservation.save()
+        self.assertIndexMatches(self.items[0], self.day)
+
+    def test_move_to_other_slot_item_and_date(self):
+        reservation = self.reserve(self.items[0], self.day, self.slots[0])
+        self.reserve(self.items[1], self.next_day, self.slots[1])
+
+        move_reservation(reservation, self.items[0], self.day, self.slots[2])
+        self.assertIndexMatches(self.items[0], self.day)
+
+        # DB から読み直したインスタンスでも、移動元の（設備, 日付）が更新される
+        reservation = Reservation.objects.get(id=reservation.id)
+        move_reservation(reservation, self.items[1], self.next_day, self.slots[0])
+        self.assertIndexMatches(self.items[0], self.day)
+        self.assertIndexMatches(self.items[1], self.next_day)
+        self.assertEqual(decode_bitmap(
+            FacilityItemAvailability.objects.get(facilityItem=self.items[1], date=self.next_day).bitmap
+        ), 0b011)
+
+        with self.assertRaises(SlotAlreadyReserved):
+            move_reservation(reservation, self.items[1], self.next_day, self.slots[1])
+        self.assertIndexMatches(self.items[1], self.next_day)
+
+    def test_bulk_changes_with_signals_muted(self):
+        for item in self.items:
+            for day in (self.day, self.next_day):
+                self.reserve(item, day, self.slots[0])
+
+        with signals_muted():
+            Reservation.objects.bulk_create([
+                Reservation(facilityItem=item, date=day, start_time=slot.start_time, end_time=slot.end_time)
+                for item in self.items for day in (self.day, self.next_day) for slot in self.slots[1:]
+            ])
+            Reservation.objects.filter(facilityItem=self.items[1], date=self.next_day).delete()
+            Reservation.objects.filter(facilityItem=self.items[0], date=self.day, start_time=self.slots[0].start_time).update(
+                date=self.next_day, start_time=datetime.time(8), end_time=datetime.time(9)
+            )
+        # 一括処理中はインデックスを更新しない
+        self.assertEqual(decode_bitmap(
+            FacilityItemAvailability.objects.get(facilityItem=self.items[0], date=self.day).bitmap
+        ), 0b001)
+
+        reservations_bulk_changed.send(
+            sender=Reservation, keys={(item.id, day) for item in self.items for day in (self.day, self.next_day)}
+        )
+        self.assertAllIndexesMatch()
+
+    def test_bulk_book(self):
+        self.reserve(self.items[0], self.day, self.slots[1])
+        bulk_book([
+            (item, day, slot)
+            for item in self.items for day in (self.day, self.next_day) for slot in self.slots[:2]
+        ])
+        self.assertAllIndexesMatch()
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    def test_only_one_concurrent_booking_wins(self):
+        facility, items = create_facility(item_count=1)
+        slot = FacilityTimeSlot.objects.filter(facility=facility).first()
+        day = datetime.date.today() + datetime.timedelta(days=1)
+        threads = 16
+        barrier = threading.Barrier(threads)
+        results = []
+
+        def attempt():
+            try:
+                barrier.wait()
+                book_slot(items[0], day, slot)
+                results.append('booked')
+            except SlotAlreadyReserved:
+                results.append('conflict')
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=attempt) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(results.count('booked'), 1)
+        self.assertEqual(results.count('conflict'), threads - 1)
+        self.assertEqual(Reservation.objects.filter(facilityItem=items[0], date=day).count(), 1)
+
+
+class SlotHoldTests(TestCase):
+    def setUp(self):
+        self.facility, self.items = create_facility(item_count=1)
+        self.slot = FacilityTimeSlot.objects.filter(facility=self.facility).order_by('start_time').first()
+        self.day = datetime.date.today() + datetime.timedelta(days=1)
+
+    def take(self, holder):
+        return take_hold(self.items[0].id, self.day, self.slot.start_time, holder)
+
+    def test_second_holder_is_refused_and_same_holder_can_retake(self):
+        self.assertTrue(self.take('a'))
+        self.assertFalse(self.take('b'))
+        self.assertTrue(self.take('a'))
+        self.assertTrue(is_held_by_other(self.items[0].id, self.day, self.slot.start_time, 'b'))
+        self.assertFalse(is_held_by_other(self.items[0].id, self.day, self.slot.start_time, 'a'))
+
+        # 他の利用者の仮押さえ中は確定できず、保持者本人は確定できる
+        with self.assertRaises(SlotAlreadyReserved):
+            book_slot(self.items[0], self.day, self.slot, holder='b')
+        self.assertFalse(Reservation.objects.exists())
+        book_slot(self.items[0], self.day, self.slot, holder='a')
+
+    def test_expired_holds_are_ignored_and_swept(self):
+        SlotHold.objects.create(
+            facilityItem=self.items[0], date=self.day, start_time=self.slot.start_time, holder='a',
+            expires_at=timezone.now() - datetime.timedelta(seconds=1),
+        )
+        self.assertFalse(is_held_by_other(self.items[0].id, self.day, self.slot.start_time, 'b'))
+        self.assertEqual(sweep_expired_holds(), 1)
+        self.assertTrue(self.take('b'))
+        self.assertEqual(sweep_expired_holds(), 0)
+
+
+class TimeSlotTemplateTests(TestCase):
+    def template(self, open_hour, close_hour, breaks='', slot_minutes=60):
+        office = ManagementOffice.objects.create(name='テンプレート管理所')
+        return TimeSlotTemplate(
+            office=office, name='平日', open_time=datetime.time(open_hour), close_time=datetime.time(close_hour),
+            slot_minutes=slot_minutes, breaks=breaks,
+        )
+
+    def test_expand_skips_breaks(self):
+        slots = expand_template(self.template(9, 18, breaks='12:00-13:00、15:30-16:00', slot_minutes=120))
+        self.assertEqual(slots, [
+            (datetime.time(9), datetime.time(11)),
+            (datetime.time(13), datetime.time(15)),
+            (datetime.time(16), datetime.time(18)),
+        ])
+
+    def test_expand_close_before_open_is_empty(self):
+        self.assertEqual(expand_template(self.template(18, 9)), [])
+        self.assertEqual(expand_template(self.template(9, 9)), [])
+
+    def test_apply_diff_keeps_matching_slots(self):
+        facility, _ = create_facility(hours=(9, 10, 11))
+        kept = set(FacilityTimeSlot.objects.filter(
+            facility=facility, start_time__gte=datetime.time(10)
+        ).values_list('id', flat=True))
+
+        self.assertEqual(apply_template(self.template(10, 13), [facility]), (1, 1))
+        slots = FacilityTimeSlot.objects.filter(facility=facility).order_by('start_time')
+        self.assertEqual([slot.start_time.hour for slot in slots], [10, 11, 12])
+        self.assertTrue(kept <= {slot.id for slot in slots})
+        # 同じテンプレートの再適用では何も変わらない
+        self.assertEqual(apply_template(self.template(10, 13), [facility]), (0, 0))
+
+    def test_apply_replace_recreates_all_slots(self):
+        facility, _ = create_facility(hours=(9, 10, 11))
+        before = set(FacilityTimeSlot.objects.filter(facility=facility).values_list('id', flat=True))
+
+        self.assertEqual(apply_template(self.template(9, 12), [facility], replace=True), (3, 3))
+        after = set(FacilityTimeSlot.objects.filter(facility=facility).values_list('id', flat=True))
+        self.assertEqual(len(after), 3)
+        self.assertFalse(before & after)
+
+
+class RecurringReservationTests(TestCase):
+    def setUp(self):
+        self.facility, self.items = create_facility(item_count=1, hours=(9, 10))
+        self.slots = list(FacilityTimeSlot.objects.filter(facility=self.facility).order_by('start_time'))
+        self.user = CustomUser.objects.create_user(
+            username='member', password='pw', email='member@example.com', full_name='会員'
+        )
+        self.start = datetime.date.today() + datetime.timedelta(days=1)
+
+    def test_conflicting_week_is_skipped(self):
+        week = datetime.timedelta(days=7)
+        # 2週目は開始時間の異なる重なる予約（9:30〜10:30）がある
+        Reservation.objects.create(
+            facilityItem=self.items[0], date=self.start + week,
+            start_time=datetime.time(9, 30), end_time=datetime.time(10, 30),
+        )
+        results = bulk_book([(self.items[0], self.start + week * n, self.slots[0]) for n in range(3)], user=self.user)
+        self.assertEqual([result['booked'] for result in results], [True, False, True])
+        self.assertEqual(Reservation.objects.filter(user=self.user).count(), 2)
+
+    def test_dates_outside_the_booking_window_are_rejected(self):
+        self.client.force_login(self.user)
+        url = reverse('reservations:recurring_reserve')
+        data = {
+            'facility': self.facility.id, 'item': self.items[0].id, 'time_slot': self.slots[0].id,
+            'frequency': '7', 'occurrences': 4,
+        }
+        response = self.client.post(url, dict(data, start_date=datetime.date.today() + datetime.timedelta(days=300)))
+        self.assertTrue(response.context['form'].errors)
+        response = self.client.post(url, dict(data, start_date=self.start, occurrences=12, frequency='14'))
+        self.assertTrue(response.context['form'].errors)
+        self.assertFalse(Reservation.objects.exists())
+
+        response = self.client.post(url, dict(data, start_date=self.start))
+        self.assertEqual(Reservation.objects.filter(user=self.user).count(), 4)
+
+
+class WizardStateTests(TestCase):
+    def test_wizard_steps_do_not_write_db_session(self):
+        facility, items = create_facility(item_count=1)
+        user = CustomUser.objects.create_user(
+            username='member', password='pw', email='member@example.com', full_name='会員'
+        )
+        self.client.force_login(user)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('reservations:select_office'))
+            self.client.post(reverse('reservations:select_facility'), {'facility_id': facility.id})
+            response = self.client.post(reverse('reservations:select_item'), {'item_id': items[0].id})
+        self.assertRedirects(response, reverse('reservations:select_date'), fetch_redirect_response=False)
+        session_writes = [
+            q['sql'] for q in ctx.captured_queries
+            if 'django_session' in q['sql'] and not q['sql'].startswith('SELECT')
+        ]
+        self.assertEqual(session_writes, [])
+
+
+class QuickReserveTests(TestCase):
+    def setUp(self):
+        self.facility, self.items = create_facility(item_count=1, hours=(9, 10))
+        self.slots = list(FacilityTimeSlot.objects.filter(facility=self.facility).order_by('start_time'))
+        self.user = CustomUser.objects.create_user(
+            username='member', password='pw', email='member@example.com', full_name='会員'
+        )
+        self.client.force_login(self.user)
+        self.day = datetime.date.today() + datetime.timedelta(days=1)
+        Reservation.objects.create(
+            facilityItem=self.items[0], date=self.day, start_time=datetime.time(9), end_time=datetime.time(10),
+        )
+
+    def test_slots_endpoint_marks_reserved_slots(self):
+        url = reverse('reservations:quick_reserve_slots')
+        response = self.client.get(url, {'item': self.items[0].id, 'date': self.day.isoformat()})
+        self.assertEqual(response.json()['slots'], [
+            {'id': self.slots[0].id, 'label': '09:00 - 10:00', 'free': False},
+            {'id': self.slots[1].id, 'label': '10:00 - 11:00', 'free': True},
+        ])
+        self.assertEqual(self.client.get(url, {'item': self.items[0].id, 'date': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'item': 0, 'date': self.day.isoformat()}).status_code, 400)
+
+    def test_page_embeds_initial_availability(self):
+        response = self.client.get(reverse('reservations:quick_reserve'))
+        initial = response.context['initial_slots']
+        self.assertEqual((initial['item'], initial['date']), (self.items[0].id, self.day.isoformat()))
+        self.assertEqual([slot['free'] for slot in initial['slots']], [False, True])
+
+    def test_post_books_free_slot_and_rejects_reserved_one(self):
+        url = reverse('reservations:quick_reserve')
+        data = {'item': self.items[0].id, 'date': self.day.isoformat()}
+        response = self.client.post(url, {**data, 'time_slot': self.slots[0].id})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('既に予約されています', response.context['error'])
+
+        response = self.client.post(url, {**data, 'time_slot': self.slots[1].id})
+        self.assertRedirects(response, reverse('reservations:user_home'), fetch_redirect_response=False)
+        self.assertTrue(Reservation.objects.filter(
+            user=self.user, facilityItem=self.items[0], date=self.day, start_time=datetime.time(10)
+        ).exists())
+
+    def test_fetch_post_books_in_place(self):
+        url = reverse('reservations:quick_reserve')
+        data = {'item': self.items[0].id, 'date': self.day.isoformat()}
+        # 画面の読み込みと予約の POST の2回で済む
+        response = self.client.post(url, {**data, 'time_slot': self.slots[1].id}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('10:00 - 11:00 を予約しました', response.json()['message'])
+        self.assertEqual([slot['free'] for slot in response.json()['slots']], [False, False])
+
+        response = self.client.post(url, {**data, 'time_slot': self.slots[1].id}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('既に予約されています', response.json()['error'])
+
+    def test_failed_post_keeps_submitted_item_and_date(self):
+        other_facility, other_items = create_facility(item_count=1, hours=(13,))
+        later = datetime.date.today() + datetime.timedelta(days=3)
+        response = self.client.post(reverse('reservations:quick_reserve'), {
+            'item': other_items[0].id, 'date': later.isoformat(), 'time_slot': self.slots[0].id,
+        })
+        self.assertEqual(response.status_code, 200)
+        initial = response.context['initial_slots']
+        self.assertEqual((initial['item'], initial['date']), (other_items[0].id, later.isoformat()))
+        self.assertEqual([slot['label'] for slot in initial['slots']], ['13:00 - 14:00'])
+
+
+class GuestWizardTests(TestCase):
+    def wizard_cookie(self):
+        return self.client.cookies[settings.WIZARD_STATE_COOKIE_NAME].value
+
+    def test_guest_details_stay_on_server(self):
+        facility, items = create_facility(item_count=1, hours=(9,))
+        slot = FacilityTimeSlot.objects.get(facility=facility)
+        day = datetime.date.today() + datetime.timedelta(days=1)
+
+        self.client.get(reverse('reservations:guest_select_office'))
+        self.client.post(reverse('reservations:guest_select_facility'), {'facility_id': facility.id})
+        self.client.post(reverse('reservations:guest_select_item'), {'item_id': items[0].id})
+        self.client.post(reverse('reservations:guest_select_date'), {'date': str(day)})
+        self.client.post(reverse('reservations:guest_select_time_slot'), {'time_slot': slot.id})
+        response = self.client.post(reverse('reservations:guest_user_info'), {
+            'full_name': '佐藤 一郎', 'phone': '090-1111-2222', 'email': 'ichiro@example.com',
+        })
+        self.assertRedirects(response, reverse('reservations:guest_reserve_confirm'), fetch_redirect_response=False)
+
+        guest = TemporaryReservationUser.objects.get()
+        state = signing.loads(self.wizard_cookie(), salt=WIZARD_COOKIE_SALT)
+        self.assertEqual(state['guest_user_id'], guest.id)
+        self.assertNotIn('ichiro@example.com', str(state))
+        self.assertContains(self.client.get(reverse('reservations:guest_reserve_confirm')), 'ichiro@example.com')
+
+        response = self.client.post(reverse('reservations:guest_reserve_confirm'))
+        self.assertRedirects(response, reverse('reservations:guest_complete'), fetch_redirect_response=False)
+        self.assertEqual(Reservation.objects.get().guest, guest)
+        # 完了後は選択内容とゲストの ID を残さない
+        state = signing.loads(self.wizard_cookie(), salt=WIZARD_COOKIE_SALT)
+        self.assertFalse([key for key in state if key.startswith('guest_')])
+
+
+class ManagerDashboardTests(TestCase):
+    # 管理者ホームのクエリ数の上限（セッション・ユーザー・管理所・カタログのバージョン・予約の集計）
+    QUERY_BUDGET = 6
+
+    def get_home(self):
+        url = reverse('reservations:manager_home')
+        self.client.get(url)  # カタログの読み込みを済ませる
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_facilities(self):
+        facility, items = create_facility(hours=(9, 10))
+        manager = CustomUser.objects.create_user(
+            username='manager', password='pw', email='m@example.com', full_name='管理者'
+        )
+        ManagerProfile.objects.create(user=manager, office=facility.office)
+        today = datetime.date.today()
+        Reservation.objects.create(
+            facilityItem=items[0], date=today, start_time=datetime.time(9), end_time=datetime.time(10), user=manager
+        )
+        self.client.force_login(manager)
+
+        response, small = self.get_home()
+        row = response.context['dashboard']['facilities'][0]
+        self.assertEqual((row['item_count'], row['today_count'], row['today_rate']), (2, 1, 25))
+
+        for n in range(10):
+            other = Facility.objects.create(office=facility.office, name=f'施設{n}')
+            FacilityItem.objects.create(facility=other, item_name='1号')
+        response, large = self.get_home()
+        self.assertEqual(len(response.context['dashboard']['facilities']), 11)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, self.QUERY_BUDGET)
+
+
+class DailyOccupancyTests(TestCase):
+    def booked(self, item, day):
+        return DailyOccupancy.objects.filter(facilityItem=item, date=day).values_list('booked_slots', flat=True).first()
+
+    def test_rollup_follows_reservation_changes_and_survives_archiving(self):
+        facility, items = create_facility(hours=(9, 10, 11))
+        today = datetime.date.today()
+        tomorrow = today + datetime.timedelta(days=1)
+        reservation = Reservation.objects.create(
+            facilityItem=items[0], date=today, start_time=datetime.time(9), end_time=datetime.time(11)
+        )
+        self.assertEqual(self.booked(items[0], today), 2)
+
+        reservation.date = tomorrow
+        reservation.save()
+        self.assertEqual((self.booked(items[0], today), self.booked(items[0], tomorrow)), (0, 2))
+
+        # 保管へ移しても集計は残り、作り直しても保管済みの予約から同じ値になる
+        archive_batch(tomorrow + datetime.timedelta(days=1), batch_size=10)
+        DailyOccupancy.objects.update(booked_slots=0)
+        rebuild_occupancy(today, tomorrow)
+        self.assertEqual(self.booked(items[0], tomorrow), 2)
+
+
+class FacilityDayViewTests(TestCase):
+    def test_timeline_queries_and_conditional_get(self):
+        facility, items = create_facility(hours=(9, 10, 11))
+        manager = CustomUser.objects.create_user(
+            username='manager', password='pw', email='m@example.com', full_name='管理者'
+        )
+        ManagerProfile.objects.create(user=manager, office=facility.office)
+        today = datetime.date.today()
+        Reservation.objects.create(
+            facilityItem=items[1], date=today, start_time=datetime.time(10), end_time=datetime.time(12), user=manager
+        )
+
+        # 設備・時間帯・その日の予約（利用者・ゲストを JOIN）の3回
+        with self.assertNumQueries(3):
+            timeline = day_timeline(facility.id, today, facility.office_id)
+        self.assertEqual([cell['booker'] for cell in timeline['rows'][1]['cells']], ['', '管理者', '管理者'])
+
+        self.client.force_login(manager)
+        url = reverse('reservations:facility_day_view', args=[facility.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Reservation.objects.create(
+            facilityItem=items[0], date=today, start_time=datetime.time(9), end_time=datetime.time(10), user=manager
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # 他の管理所の管理者には、有効な ETag を送られても 304 を返さず 404 にする
+        other = CustomUser.objects.create_user(
+            username='other', password='pw', email='o@example.com', full_name='別の管理者'
+        )
+        ManagerProfile.objects.create(user=other, office=ManagementOffice.objects.create(name='別の管理所'))
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(other)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+
+    def test_booker_rename_changes_etag(self):
+        facility, items = create_facility(hours=(9,))
+        manager = CustomUser.objects.create_user(
+            username='manager', password='pw', email='m@example.com', full_name='管理者'
+        )
+        ManagerProfile.objects.create(user=manager, office=facility.office)
+        today = datetime.date.today()
+        Reservation.objects.create(
+            facilityItem=items[0], date=today, start_time=datetime.time(9), end_time=datetime.time(10),
+            guest=upsert_guest('山田 花子', '090-1234-5678', 'hanako@example.com'),
+        )
+        self.client.force_login(manager)
+        url = reverse('reservations:facility_day_view', args=[facility.id])
+        etag = self.client.get(url)['ETag']
+
+        # 同じゲストが別の氏名で予約し直すと、表示する予約者名が変わる
+        upsert_guest('佐藤 花子', '090-1234-5678', 'hanako@example.com')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '佐藤 花子')
+
+
+class GuestIdentityTests(TestCase):
+    def test_repeat_guest_reuses_one_row_with_one_write(self):
+        first = upsert_guest('山田 花子', '090-1234-5678', 'Hanako@Example.com')
+        with CaptureQueriesContext(connection) as ctx:
+            second = upsert_guest('山田 花子（再）', '09012345678', 'hanako@example.com ')
+        # ゲストの行への書き込みは1回（残りは既存の予約の連絡先の更新）
+        guest_writes = [
+            q for q in ctx.captured_queries
+            if re.match(r'(INSERT INTO|UPDATE) "reservations_temporaryreservationuser"', q['sql'])
+        ]
+        self.assertEqual(len(guest_writes), 1)
+        self.assertEqual(second.pk, first.pk)
+        self.assertEqual(TemporaryReservationUser.objects.get().full_name, '山田 花子（再）')
+
+    def test_repeat_guest_updates_contacts_of_earlier_bookings(self):
+        facility, items = create_facility(hours=(9, 10))
+        slots = list(FacilityTimeSlot.objects.filter(facility=facility).order_by('start_time'))
+        today = datetime.date.today()
+        old = Reservation.objects.create(
+            facilityItem=items[0], date=today - datetime.timedelta(days=400),
+            start_time=datetime.time(9), end_time=datetime.time(10),
+            guest=upsert_guest('山田 花子', '090-1234-5678', 'hanako@example.com'),
+        )
+        archive_batch(today - datetime.timedelta(days=365), batch_size=10)
+        first = book_slot(items[0], today, slots[0], guest=upsert_guest('山田 花子', '090-1234-5678', 'hanako@example.com'))
+        second = book_slot(items[1], today, slots[1], guest=upsert_guest('佐藤 花子', '09012345678', 'hanako@example.com'))
+
+        self.assertEqual(first.guest_id, second.guest_id)
+        self.assertEqual(
+            list(ReservationContact.objects.filter(reservation__in=[first, second]).values_list('name', flat=True)),
+            ['佐藤花子', '佐藤花子'],
+        )
+        self.assertEqual(ReservationArchive.objects.get(id=old.id).contact_name, '佐藤花子')
+
+
+class UserSearchTests(TestCase):
+    def setUp(self):
+        self.hanako = CustomUser.objects.create_user(
+            username='hanako', password='pw', email='hanako@example.com', full_name='山田 花子', phone='090-1234-5678'
+        )
+        self.taro = CustomUser.objects.create_user(
+            username='taro', password='pw', email='taro@example.com', full_name='山田 太郎', phone='080-1111-2222'
+        )
+        self.admin = CustomUser.objects.create_user(
+            username='admin', password='pw', email='admin@example.com', full_name='山田 管理', phone='0'
+        )
+        self.users = CustomUser.objects.exclude(id=self.admin.id)
+
+    def test_substring_search(self):
+        self.assertEqual(list(search_users(self.users, 10, full_name='田 花')), [self.hanako])
+        self.assertEqual(list(search_users(self.users, 10, phone='1234')), [self.hanako])
+        # 3文字未満の語は icontains で絞り込み、除外条件もそのまま効く
+        self.assertEqual(list(search_users(self.users, 10, full_name='山田')), [self.taro, self.hanako])
+        self.assertEqual(list(search_users(self.users, 10, full_name='山田', email='taro@')), [self.taro])
+
+    def test_index_follows_updates(self):
+        self.hanako.full_name = '鈴木 花子'
+        self.hanako.save()
+        self.assertEqual(list(search_users(self.users, 10, full_name='鈴木 花')), [self.hanako])
+        self.assertEqual(list(search_users(self.users, 10, full_name='山田 花')), [])
+        self.taro.delete()
+        self.assertEqual(list(search_users(self.users, 10, email='example.com')), [self.hanako])
+
+    def test_limit_applies_after_exclusions(self):
+        # 除外したユーザーや3文字未満の語に合わないユーザーで上位の枠を使わない
+        for n in range(5):
+            CustomUser.objects.create_user(
+                username=f'super{n}', password='pw', email=f'super{n}@example.com', full_name='山田 特別',
+                is_superuser=True,
+            )
+        users = self.users.filter(is_superuser=False)
+        self.assertEqual(set(search_users(users, 2, email='example.com')), {self.hanako, self.taro})
+        self.assertEqual(list(search_users(users, 1, email='example.com', full_name='太郎')), [self.taro])
+
+    def test_user_list_is_not_capped(self):
+        office = ManagementOffice.objects.create(name='管理所')
+        ManagerProfile.objects.create(user=self.admin, office=office)
+        self.client.force_login(self.admin)
+        url = reverse('reservations:user_manage')
+        with mock.patch('reservations.views.admin_views.USER_SEARCH_LIMIT', 1), \
+                mock.patch('reservations.views.admin_views.USER_MANAGE_PAGE_SIZE', 1):
+            response = self.client.get(url, {'page': 2})
+            self.assertEqual(response.context['page_obj'].paginator.count, 2)
+            self.assertEqual(list(response.context['users']), [self.hanako])
+            # 一致度順の検索だけは上限で打ち切る
+            response = self.client.get(url, {'email': 'example.com'})
+            self.assertEqual(response.context['page_obj'].paginator.count, 1)
+
+    def test_falls_back_without_trigram(self):
+        with mock.patch('reservations.search.user_fts_supported', return_value=False):
+            self.assertEqual(list(search_users(self.users, 10, full_name='田 花')), [self.hanako])
+            self.assertEqual(list(search_users(self.users, 10, email='example.com')), [self.taro, self.hanako])
+
+
+class ReservationArchiveTests(TestCase):
+    def test_archived_reservations_stay_searchable(self):
+        facility, items = create_facility(hours=(9, 10))
+        manager = CustomUser.objects.create_user(
+            username='manager', password='pw', email='m@example.com', full_name='山田 花子', phone='0'
+        )
+        ManagerProfile.objects.create(user=manager, office=facility.office)
+        today = datetime.date.today()
+        for days in (-400, -1, 3):
+            Reservation.objects.create(
+                facilityItem=items[0], date=today + datetime.timedelta(days=days),
+                start_time=datetime.time(9), end_time=datetime.time(10), user=manager,
+            )
+
+        self.assertEqual(archive_batch(today - datetime.timedelta(days=365), batch_size=10), 1)
+        self.assertEqual(Reservation.objects.count(), 2)
+        self.assertEqual(ReservationArchive.objects.get().contact_name, '山田花子')
+
+        # 1件ずつのページで、現在の予約の後に保管済みの予約が続く
+        self.client.force_login(manager)
+        url = reverse('reservations:reservation_search')
+        found, query = [], {'name': '山田'}
+        with mock.patch('reservations.views.admin_views.RESERVATION_SEARCH_PAGE_SIZE', 1):
+            while query is not None:
+                response = self.client.get(url, query)
+                found += [row.date for row in response.context['reservations']]
+                next_query = response.context['next_query']
+                query = QueryDict(next_query) if next_query else None
+        self.assertEqual(found, [today + datetime.timedelta(days=d) for d in (3, -1, -400)])
+
+
+class PurgeStaleRecordsTests(TestCase):
+    def setUp(self):
+        facility, self.items = create_facility(hours=(9,))
+        self.guests = [
+            upsert_guest(f'ゲスト{n}', f'090-0000-{n:04d}', f'guest{n}@example.com') for n in range(5)
+        ]
+        today = datetime.date.today()
+        # 0: 予約あり、1: 保管済みの予約だけ、2〜4: 予約なし
+        Reservation.objects.create(
+            facilityItem=self.items[0], date=today, start_time=datetime.time(9), end_time=datetime.time(10),
+            guest=self.guests[0],
+        )
+        Reservation.objects.create(
+            facilityItem=self.items[1], date=today - datetime.timedelta(days=400),
+            start_time=datetime.time(9), end_time=datetime.time(10), guest=self.guests[1],
+        )
+        archive_batch(today - datetime.timedelta(days=365), batch_size=10)
+
+    def remaining(self):
+        return set(TemporaryReservationUser.objects.values_list('id', flat=True))
+
+    def test_guest_batches_skip_guests_with_reservations(self):
+        deleted, after_id = purge_guest_batch(0, 2)
+        self.assertEqual((deleted, after_id), (2, self.guests[3].id))
+        self.assertEqual(purge_guest_batch(after_id, 2), (1, self.guests[4].id))
+        self.assertEqual(purge_guest_batch(self.guests[4].id, 2), (0, None))
+        self.assertEqual(self.remaining(), {self.guests[0].id, self.guests[1].id})
+
+    def test_include_archived_purges_archive_only_guests(self):
+        self.assertEqual(purge_guest_batch(0, 10, include_archived=True)[0], 4)
+        self.assertEqual(self.remaining(), {self.guests[0].id})
+        # 保管済みの予約と検索用の連絡先は残る
+        archived = ReservationArchive.objects.get()
+        self.assertIsNone(archived.guest_id)
+        self.assertNotEqual(archived.contact_name, '')
+
+    def test_command_purges_guests_and_expired_sessions(self):
+        now = timezone.now()
+        for n in range(3):
+            Session.objects.create(session_key=f'expired{n}', session_data='', expire_date=now - datetime.timedelta(days=1))
+        Session.objects.create(session_key='alive', session_data='', expire_date=now + datetime.timedelta(days=1))
+
+        out = StringIO()
+        call_command('purge_stale_records', batch_size=2, sleep=0, stdout=out)
+        self.assertEqual(self.remaining(), {self.guests[0].id, self.guests[1].id})
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['alive'])
+        self.assertIn('期限切れセッションを3件削除しました', out.getvalue())
+
+
+class InvitationCodeTests(TestCase):
+    def setUp(self):
+        self.office = ManagementOffice.objects.create(name='招待管理所')
+
+    def test_generates_exact_count_without_duplicates(self):
+        codes = generate_invitation_codes(self.office, 2000)
+        self.assertEqual(len(codes), 2000)
+        self.assertEqual(len(set(codes)), 2000)
+        self.assertEqual(
+            sorted(InvitationCode.objects.filter(community=self.office).values_list('code', flat=True)), codes
+        )
+
+    def test_regenerates_codes_that_collide(self):
+        other = ManagementOffice.objects.create(name='別の管理所')
+        InvitationCode.objects.create(code='AAAAAAAA', community=other)
+        first_batch = {'AAAAAAAA', 'BBBBBBBB', 'CCCCCCCC'}
+        with mock.patch(
+            'reservations.invitations.random_codes', side_effect=[first_batch, {'DDDDDDDD'}]
+        ):
+            codes = generate_invitation_codes(self.office, 3)
+        self.assertEqual(codes, ['BBBBBBBB', 'CCCCCCCC', 'DDDDDDDD'])
+        self.assertEqual(InvitationCode.objects.get(code='AAAAAAAA').community, other)
+        self.assertEqual(InvitationCode.objects.count(), 4)
+
+
+    def test_admin_pages_past_count_limit_are_reachable(self):
+        generate_invitation_codes(self.office, 30)
+        admin_user = CustomUser.objects.create_superuser(
+            username='admin', password='pw', email='admin@example.com', full_name='管理者', phone='0'
+        )
+        self.client.force_login(admin_user)
+        url = reverse('admin:reservations_invitationcode_changelist')
+        with mock.patch('reservations.admin.EstimatedCountPaginator.count_limit', 10), \
+                mock.patch('reservations.admin.InvitationCodeAdmin.list_per_page', 5):
+            # 上限（10件＝2ページ）を超えても次のページへのリンクが出る
+            response = self.client.get(url, {'p': 4})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['cl'].result_list), 5)
+            self.assertContains(response, '?p=5')
+            # 最後のページでは実件数になる
+            response = self.client.get(url, {'p': 6})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['cl'].result_count, 30)
+            self.assertEqual(len(response.context['cl'].result_list), 5)
+
+class ReservationExportTests(TestCase):
+    def test_export_includes_archive_and_escapes_formulas(self):
+        facility, items = create_facility(hours=(9,))
+        manager = CustomUser.objects.create_user(
+            username='manager', password='pw', email='m@example.com', full_name='管理者', phone='0'
+        )
+        ManagerProfile.objects.create(user=manager, office=facility.office)
+        today = datetime.date.today()
+        old_guest = upsert_guest('保管 次郎', '090-0000-0001', 'jiro@example.com')
+        for days, guest in ((-400, old_guest), (-1, upsert_guest('=HYPERLINK("http://x")', '+81 90', '@evil'))):
+            Reservation.objects.create(
+                facilityItem=items[0], date=today + datetime.timedelta(days=days),
+                start_time=datetime.time(9), end_time=datetime.time(10), guest=guest,
+            )
+        archive_batch(today - datetime.timedelta(days=365), batch_size=10)
+        # ゲストが削除された保管分は保管時の連絡先で出力する
+        purge_guest_batch(0, 10, include_archived=True)
+
+        self.client.force_login(manager)
+        response = self.client.get(reverse('reservations:reservation_export'), {
+            'date_from': (today - datetime.timedelta(days=500)).isoformat(), 'date_to': today.isoformat(),
+        })
+        rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8-sig').splitlines()))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][1], (today - datetime.timedelta(days=400)).isoformat())
+        self.assertEqual(rows[1][6:], ['不明', '保管次郎', '09000000001', 'jiro@example.com'])
+        self.assertEqual(rows[2][6:], ['ゲスト', '\'=HYPERLINK("http://x")', "'+81 90", "'@evil"])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN は SQLite のみ')
+class ReservationQueryPlanTests(TestCase):
+    """予約の主要なクエリが全件スキャンにならないことを確認する"""
+
+    def assert_no_full_scan(self, queryset, sorted_by_index=False):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        # インデックスを使わない "SCAN テーブル" が全件スキャン
+        full_scans = [line for line in plan if re.match(r'SCAN \S+$', line)]
+        self.assertEqual(full_scans, [], '\n'.join(plan))
+        if sorted_by_index:
+            self.assertFalse([line for line in plan if 'TEMP B-TREE' in line], '\n'.join(plan))
+
+    def test_hot_queries_use_indexes(self):
+        today = datetime.date.today()
+        now = datetime.time(12)
+        qs = Reservation.objects.all()
+
+        # 予約確定時の重複チェック・空き状況の再計算（設備, 日付, 開始時間）
+        self.assert_no_full_scan(qs.filter(facilityItem_id=1, date=today, start_time=now))
+        self.assert_no_full_scan(qs.filter(facilityItem_id=1, date=today, start_time__lt=now, end_time__gt=now))
+        # 空き状況一覧（設備の一覧 × 日付の範囲）
+        self.assert_no_full_scan(qs.filter(facilityItem_id__in=[1, 2], date__range=(today, today)).order_by())
+        # 利用者ホーム（自分の終了していない予約）
+        self.assert_no_full_scan(
+            qs.filter(user_id=1).filter(Q(date__gt=today) | Q(date=today, end_time__gt=now))
+        )
+        # 既定の並び順と予約検索（日付の範囲・キーセット）
+        self.assert_no_full_scan(qs[:50], sorted_by_index=True)
+        self.assert_no_full_scan(qs.filter(date__gte=today).order_by('-date', 'start_time', 'id')[:51], sorted_by_index=True)
+        self.assert_no_full_scan(
+            qs.filter(reservations_after((today, now, 1))).order_by('-date', 'start_time', 'id')[:51],
+            sorted_by_index=True,
+        )
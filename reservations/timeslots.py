@@ -0,0 +1,95 @@
+import datetime
+from collections import defaultdict
+from django.db import transaction
+from .models import FacilityTimeSlot
+from .intervals import IntervalSet
+from .availability import invalidate_facilities
+from .signals import signals_muted
+from .catalog import bump_catalog_version
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def _time(minutes):
+    return datetime.time(minutes // 60, minutes % 60)
+
+
+def parse_breaks(text):
+    """'12:00-13:00,17:00-18:00' 形式の休憩時間を (開始, 終了) のリストにする"""
+    breaks = []
+    for part in (text or '').replace('、', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, end = part.split('-')
+        start = datetime.time.fromisoformat(start.strip())
+        end = datetime.time.fromisoformat(end.strip())
+        if start >= end:
+            raise ValueError(part)
+        breaks.append((start, end))
+    return breaks
+
+
+def expand_template(template):
+    """テンプレートを (開始, 終了) の時間帯リストに展開する（休憩にかかる枠は作らない）"""
+    slot_minutes = template.slot_minutes
+    breaks = IntervalSet(
+        (_minutes(start), _minutes(end)) for start, end in parse_breaks(template.breaks)
+    )
+    slots = []
+    # 休憩を除いた営業時間の区間ごとに、先頭から枠を詰める
+    for lower, upper in breaks.gaps(_minutes(template.open_time), _minutes(template.close_time)):
+        cursor = lower
+        while cursor + slot_minutes <= upper:
+            slots.append((_time(cursor), _time(cursor + slot_minutes)))
+            cursor += slot_minutes
+    return slots
+
+
+def apply_template(template, facilities, replace=False):
+    """テンプレートを複数の施設に適用し、(追加件数, 削除件数) を返す
+
+    差分適用（既定）では、テンプレートにない時間帯だけを削除し、
+    まだない時間帯だけを bulk_create で追加する。
+    replace=True の場合は既存の時間帯をすべて作り直す。
+    """
+    desired = expand_template(template)
+    desired_set = set(desired)
+    facility_ids = [facility.id for facility in facilities]
+
+    current = defaultdict(dict)
+    for slot_id, facility_id, start, end in FacilityTimeSlot.objects.filter(
+        facility_id__in=facility_ids
+    ).values_list('id', 'facility_id', 'start_time', 'end_time'):
+        current[facility_id][(start, end)] = slot_id
+
+    to_delete = []
+    to_create = []
+    changed = set()
+    for facility_id in facility_ids:
+        existing = current[facility_id]
+        deleting = [
+            slot_id for key, slot_id in existing.items()
+            if replace or key not in desired_set
+        ]
+        creating = [
+            FacilityTimeSlot(facility_id=facility_id, start_time=start, end_time=end)
+            for start, end in desired
+            if replace or (start, end) not in existing
+        ]
+        if deleting or creating:
+            changed.add(facility_id)
+        to_delete.extend(deleting)
+        to_create.extend(creating)
+
+    with transaction.atomic(), signals_muted():
+        FacilityTimeSlot.objects.filter(id__in=to_delete).delete()
+        FacilityTimeSlot.objects.bulk_create(to_create)
+        # 行ごとのシグナルの代わりに、変更のあった施設の空き状況をまとめて破棄
+        invalidate_facilities(changed)
+        if changed:
+            bump_catalog_version()
+
+    return len(to_create), len(to_delete)
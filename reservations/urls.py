@@ -12,15 +12,26 @@ urlpatterns = [
     path('users/edit/<int:user_id>/', views.user_edit, name='user_edit'), 
     
     path('reservations/search/', views.reservation_search, name='reservation_search'),
+    path('reservations/export/', views.reservation_export, name='reservation_export'),
+    path('reports/occupancy/', views.occupancy_report, name='occupancy_report'),
     path('reservation_delete/<int:reservation_id>/', views.reservation_delete, name='reservation_delete'),
     path('reservation/delete/<int:pk>/', views.delete_reservation, name='delete_reservation'),
+    path('reservations/block_booking/', views.block_booking, name='block_booking'),
 
     # # 施設（麻将、棋牌、乒乓など）一覧・詳細
     path('facilities/', views.facility_list, name='facility_list'),
+    path('facilities/<int:facility_id>/day/', views.facility_day_view, name='facility_day_view'),
     path('create/', views.facility_create, name='facility_create'),    # 施設追加
     path('edit/<int:pk>/', views.facility_edit, name='facility_edit'), # 施設編集
     path('delete/<int:pk>/', views.facility_delete, name='facility_delete'), # 施設削除
     
+    # 時間帯テンプレート
+    path('timeslot-templates/', views.timeslot_template_list, name='timeslot_template_list'),
+    path('timeslot-templates/create/', views.timeslot_template_create, name='timeslot_template_create'),
+    path('timeslot-templates/<int:pk>/edit/', views.timeslot_template_edit, name='timeslot_template_edit'),
+    path('timeslot-templates/<int:pk>/delete/', views.timeslot_template_delete, name='timeslot_template_delete'),
+    path('timeslot-templates/<int:pk>/apply/', views.timeslot_template_apply, name='timeslot_template_apply'),
+
     # 設備（FacilityItem）
     path('facilities/<int:facility_id>/items/', views.facility_item_list, name='facility_item_list'),
     path('facilities/<int:facility_id>/items/create/', views.facility_item_create, name='facility_item_create'),
@@ -37,7 +48,11 @@ urlpatterns = [
     path('select_item/', views.select_item, name='select_item'),
     path('select_date/', views.select_date, name='select_date'),
     path('select_time_slot/', views.select_time_slot, name='select_time_slot'),
+    path('availability/', views.availability_grid_view, name='availability_grid'),
     path('reserve_confirm/', views.reserve_confirm, name='reserve_confirm'),
+    path('reservations/recurring/', views.recurring_reserve, name='recurring_reserve'),
+    path('reserve/', views.quick_reserve, name='quick_reserve'),
+    path('reserve/slots/', views.quick_reserve_slots, name='quick_reserve_slots'),
 
     # ゲスト予約関連
     path('guest/reserve/', views.guest_reservation, name='guest_reservation'),
@@ -46,6 +61,7 @@ urlpatterns = [
     path('guest/select_item/', views.guest_select_item, name='guest_select_item'),
     path('guest/select_date/', views.guest_select_date, name='guest_select_date'),
     path('guest/select_time_slot/', views.guest_select_time_slot, name='guest_select_time_slot'),
+    path('guest/availability/', views.guest_availability_grid, name='guest_availability_grid'),
     # ユーザー情報入力画面（guest_user_info）
     path('guest/user_info/', views.guest_user_info, name='guest_user_info'),
 
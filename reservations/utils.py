@@ -1,6 +1,10 @@
+import datetime
 from django.forms import inlineformset_factory
+from django.http import JsonResponse
+from django.shortcuts import render
 from .models import Facility, FacilityTimeSlot
 from .forms import FacilityTimeSlotForm,FacilityTimeSlotFormSet
+from .availability import availability_grid, grid_items, grid_as_json
 
 def is_manager(user):
     return hasattr(user, 'managerprofile')
@@ -17,7 +21,7 @@ def get_timeslot_formset(extra=5, can_delete=True):
 def clear_reservation_session(request):
     keys = ['selected_office', 'selected_facility', 'selected_item', 'selected_date', 'selected_time_slot']
     for key in keys:
-        request.session.pop(key, None)
+        request.wizard.pop(key, None)
 
 
 def clear_guest_reservation_session(request):
@@ -28,8 +32,51 @@ def clear_guest_reservation_session(request):
         'guest_selected_date',
         'guest_selected_time_slot',
         'guest_user_id',
+        # 以前は入力した氏名・連絡先をそのまま保存していた
+        'guest_guest_user_info',
     ]
     for key in keys:
-        request.session.pop(key, None)
+        request.wizard.pop(key, None)
 
-        
\ No newline at end of file
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def availability_grid_response(request, facility_id, item_id, max_days, back_url):
+    """週・月単位の空き状況グリッドを HTML または JSON（?format=json）で返す"""
+    today = datetime.date.today()
+    last_day = today + datetime.timedelta(days=max_days - 1)
+
+    try:
+        start = datetime.date.fromisoformat(request.GET.get('start', ''))
+    except ValueError:
+        start = today
+    start = min(max(start, today), last_day)
+
+    days = 31 if request.GET.get('period') == 'month' else 7
+    days = min(days, (last_day - start).days + 1)
+
+    # ?facility= 指定時は施設内の全設備、?item= 指定時はその設備のみ
+    facility_id = _int_or_none(request.GET.get('facility')) or _int_or_none(facility_id)
+    if request.GET.get('facility') and not request.GET.get('item'):
+        item_id = None
+    else:
+        item_id = _int_or_none(request.GET.get('item')) or _int_or_none(item_id)
+
+    items = grid_items(facility_id=facility_id, item_id=item_id) if (facility_id or item_id) else []
+    grid_facility_id = items[0].facility_id if items else facility_id
+    grid = availability_grid(items, grid_facility_id, start, days)
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse(grid_as_json(grid, start, days))
+
+    return render(request, 'reservations/availability_grid.html', {
+        'grid': grid,
+        'facility': items[0].facility if items else None,
+        'start': start,
+        'days': days,
+        'back_url': back_url,
+    })
@@ -1,29 +1,101 @@
+from datetime import date, timedelta
 from django.shortcuts import render, redirect, get_object_or_404
+from django.core.paginator import Paginator
+from django.http import StreamingHttpResponse
 from django.contrib import messages
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.db.models import Count
 from django.contrib.auth.decorators import login_required,user_passes_test
-from django.db.models import Q
+from django.db.models import Q, Case, When, Value, BooleanField
 from django.utils import timezone
-from ..models import Reservation, FacilityItem, Facility, Reservation
-from ..forms import FacilityForm, FacilityItemForm, ReservationSearchForm, UserSearchForm, CustomUser, UserEditForm
+from ..models import Reservation, FacilityItem, Facility, Reservation, TimeSlotTemplate, ReservationArchive
+from ..forms import FacilityForm, FacilityItemForm, ReservationSearchForm, ReservationExportForm, OccupancyReportForm, UserSearchForm, CustomUser, UserEditForm, BlockBookingForm, TimeSlotTemplateForm, TimeSlotTemplateApplyForm
 from ..utils import is_manager, get_timeslot_formset
+from ..booking import bulk_book, SlotAlreadyReserved
+from ..timeslots import expand_template, apply_template
+from ..pagination import chained_keyset_page
+from ..archive import archive_reaches
+from ..search import contact_prefix_q, search_users
+from ..exports import export_querysets, export_filename, iter_csv
+from ..dashboard import office_dashboard
+from ..occupancy import facility_occupancy, day_etag
+from ..availability import day_timeline
+from ..catalog import get_catalog
+from yoyakumate.db_router import read_replica
+
+# 予約検索の1ページあたりの件数
+RESERVATION_SEARCH_PAGE_SIZE = 50
+# 登録ユーザー管理の1ページあたりの件数と、検索結果の上限
+USER_MANAGE_PAGE_SIZE = 50
+USER_SEARCH_LIMIT = 500
+# 施設の予約表を自動で再読み込みする間隔（秒）
+FACILITY_DAY_VIEW_REFRESH_SECONDS = 30
 
 def manager_required(view_func):
     decorated_view_func = login_required(user_passes_test(is_manager)(view_func))
     return decorated_view_func
 
 @manager_required
+@read_replica
 def manager_home(request):
-    return render(request, 'reservations/manager_home.html')
+    # 自分の管理所の施設ごとの予約数・稼働率（施設数によらず一定のクエリ数）
+    office = request.user.managerprofile.office
+    return render(request, 'reservations/manager_home.html', {
+        'office': office,
+        'dashboard': office_dashboard(office.id),
+    })
+
+
+def _timeline_day(request):
+    # ?date=YYYY-MM-DD（指定がない・不正な場合は今日）
+    try:
+        return date.fromisoformat(request.GET.get('date', ''))
+    except ValueError:
+        return date.today()
+
+
+def _timeline_etag(request, facility_id):
+    # 他の管理所の施設には ETag を付けない（304 で存在を知らせず、ビュー側で 404 にする）
+    office = request.user.managerprofile.office
+    if get_catalog().facility(facility_id, office_id=office.id) is None:
+        return None
+    return day_etag(facility_id, _timeline_day(request))
+
+
+# 施設の1日分の予約表（受付の画面で定期的に再読み込みするため、変更がなければ 304 を返す）
+# ETag は書き込み先の日次集計から作るため、表も同じく書き込み先から読む（レプリカは使わない）
+@manager_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_timeline_etag)
+def facility_day_view(request, facility_id):
+    office = request.user.managerprofile.office
+    day = _timeline_day(request)
+    timeline = day_timeline(facility_id, day, office.id)
+    facility = timeline['facility'] or get_object_or_404(Facility, pk=facility_id, office=office)
+
+    now = timezone.localtime()
+    return render(request, 'reservations/facility_day_view.html', {
+        'facility': facility,
+        'day': day,
+        'previous_day': day - timedelta(days=1),
+        'next_day': day + timedelta(days=1),
+        'timeline': timeline,
+        # 今日の表示では現在の時間帯の列を強調する
+        'now_time': now.time() if day == now.date() else None,
+        'refresh_seconds': FACILITY_DAY_VIEW_REFRESH_SECONDS,
+    })
 
 
 # 設備管理開始
 @manager_required
+@read_replica
 def facility_list(request):
-    
-    # データベースから全ての施設を取得し、名前順に並べる
-    facilities = Facility.objects.annotate(
-        item_count=Count('facilityitem')  # 'items'はFacilityItemのForeignKeyに付けたrelated_name
+    office = request.user.managerprofile.office
+
+    # 自分の管理所の施設を設備数とあわせて1回のクエリで取得し、名前順に並べる
+    facilities = Facility.objects.filter(office=office).annotate(
+        item_count=Count('facilityitem')
     ).order_by('name')
 
     # facility_list.html テンプレートを表示し、施設データを渡す
@@ -94,6 +166,82 @@ def facility_delete(request, pk):
         'facility': facility
     })
     
+# 時間帯テンプレート
+@manager_required
+def timeslot_template_list(request):
+    office = request.user.managerprofile.office
+    templates = TimeSlotTemplate.objects.filter(office=office).order_by('name')
+    return render(request, 'reservations/timeslot_template_list.html', {
+        'templates': templates,
+        'office_name': office.name,
+    })
+
+@manager_required
+def timeslot_template_create(request):
+    office = request.user.managerprofile.office
+    if request.method == 'POST':
+        form = TimeSlotTemplateForm(request.POST)
+        if form.is_valid():
+            template = form.save(commit=False)
+            template.office = office
+            template.save()
+            return redirect('reservations:timeslot_template_list')
+    else:
+        form = TimeSlotTemplateForm()
+    return render(request, 'reservations/timeslot_template_form.html', {
+        'form': form,
+        'title': '時間帯テンプレート追加',
+    })
+
+@manager_required
+def timeslot_template_edit(request, pk):
+    template = get_object_or_404(TimeSlotTemplate, pk=pk, office=request.user.managerprofile.office)
+    if request.method == 'POST':
+        form = TimeSlotTemplateForm(request.POST, instance=template)
+        if form.is_valid():
+            form.save()
+            return redirect('reservations:timeslot_template_list')
+    else:
+        form = TimeSlotTemplateForm(instance=template)
+    return render(request, 'reservations/timeslot_template_form.html', {
+        'form': form,
+        'title': '時間帯テンプレート編集',
+    })
+
+@manager_required
+def timeslot_template_delete(request, pk):
+    template = get_object_or_404(TimeSlotTemplate, pk=pk, office=request.user.managerprofile.office)
+    if request.method == 'POST':
+        template.delete()
+        return redirect('reservations:timeslot_template_list')
+    return render(request, 'reservations/timeslot_template_confirm_delete.html', {
+        'template': template,
+    })
+
+@manager_required
+def timeslot_template_apply(request, pk):
+    office = request.user.managerprofile.office
+    template = get_object_or_404(TimeSlotTemplate, pk=pk, office=office)
+
+    if request.method == 'POST':
+        form = TimeSlotTemplateApplyForm(request.POST, office=office)
+        if form.is_valid():
+            created, deleted = apply_template(
+                template,
+                form.cleaned_data['facilities'],
+                replace=form.cleaned_data['mode'] == 'replace',
+            )
+            messages.success(request, f'時間帯を{created}件追加、{deleted}件削除しました。')
+            return redirect('reservations:facility_list')
+    else:
+        form = TimeSlotTemplateApplyForm(office=office)
+
+    return render(request, 'reservations/timeslot_template_apply.html', {
+        'form': form,
+        'template': template,
+        'preview': expand_template(template),
+    })
+
 #施設アイテム
 @manager_required
 def facility_item_list(request, facility_id):
@@ -150,51 +298,130 @@ def facility_item_delete(request, item_id):
 
 
 @manager_required
+@read_replica
 def reservation_search(request):
     form = ReservationSearchForm(request.GET or None)
     reservations = []
+    next_query = None
+    first_query = None
+    now = timezone.localtime()
 
     if form.is_valid():
-        reservations = Reservation.objects.all()
+        # 利用者・ゲスト・設備は同じクエリで取得し、削除可否も SQL で判定する
+        reservations = Reservation.objects.select_related('user', 'guest', 'facilityItem').annotate(
+            can_delete=Case(
+                When(Q(date__gt=now.date()) | Q(date=now.date(), end_time__gt=now.time()), then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField(),
+            )
+        )
 
         name = form.cleaned_data.get('name')
         phone = form.cleaned_data.get('phone')
         email = form.cleaned_data.get('email')
-
-        q_user = Q()
-        q_guest = Q()
-
-        if name:
-            q_user &= Q(user__full_name__startswith=name)
-            q_guest &= Q(guest__full_name__startswith=name)
-        if phone:
-            q_user &= Q(user__phone__startswith=phone)
-            q_guest &= Q(guest__phone__startswith=phone)
-        if email:
-            q_user &= Q(user__email__startswith=email)
-            q_guest &= Q(guest__email__startswith=email)
-
-        if any([name, phone, email]):
-            reservations = reservations.filter(q_user | q_guest)
-
         date_from = form.cleaned_data.get('date_from')
-        if date_from:
-            reservations = reservations.filter(date__gte=date_from)
-
-    now = timezone.localtime()
-    for res in reservations:
-        if res.date > now.date() or (res.date == now.date() and res.end_time > now.time()):
-            res.can_delete = True
-        else:
-            res.can_delete = False
+        sources = [('live', reservations)]
+
+        # 期間指定が保管済みの期間にかかるときだけ、現在の予約の後に保管分を続ける
+        if archive_reaches(date_from):
+            archived = ReservationArchive.objects.select_related('user', 'guest', 'facilityItem').annotate(
+                can_delete=Value(False, output_field=BooleanField())
+            )
+            sources.append(('archive', archived))
+
+        filtered = []
+        for source, queryset in sources:
+            # 登録ユーザー・ゲストをまとめた検索用連絡先を、インデックスの範囲検索で絞り込む
+            if any([name, phone, email]):
+                queryset = queryset.filter(contact_prefix_q(
+                    name=name, phone=phone, email=email,
+                    column_prefix='contact_' if source == 'archive' else 'contact__',
+                ))
+            if date_from:
+                queryset = queryset.filter(date__gte=date_from)
+            filtered.append((source, queryset))
+
+        # (日付, 開始時間, ID) のキーセットで1ページ分だけ取得
+        reservations, next_cursor = chained_keyset_page(
+            filtered, after=request.GET.get('after'), size=RESERVATION_SEARCH_PAGE_SIZE
+        )
+        query = request.GET.copy()
+        query.pop('after', None)
+        first_query = query.urlencode()
+        if next_cursor:
+            query['after'] = next_cursor
+            next_query = query.urlencode()
 
     context = {
         'form': form,
+        'export_form': ReservationExportForm(auto_id='export_%s'),
         'reservations': reservations,
         'now': now,
+        'next_query': next_query,
+        'first_query': first_query if request.GET.get('after') else None,
     }
     return render(request, 'reservations/reservation_search.html', context)
 
+# 予約の CSV 出力（担当管理所・期間指定、ストリーミング）
+@manager_required
+def reservation_export(request):
+    office = request.user.managerprofile.office
+    form = ReservationExportForm(request.GET)
+    if not form.is_valid():
+        for error in form.errors.get('__all__', []) or ['出力する期間を正しく指定してください。']:
+            messages.error(request, error)
+        return redirect('reservations:reservation_search')
+
+    date_from = form.cleaned_data['date_from']
+    date_to = form.cleaned_data['date_to']
+    response = StreamingHttpResponse(
+        iter_csv(export_querysets(office, date_from, date_to)),
+        content_type='text/csv; charset=utf-8',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(office, date_from, date_to)}"'
+    return response
+
+# 稼働率レポート（施設×日付のヒートマップ、日次集計表だけを読む）
+@manager_required
+@read_replica
+def occupancy_report(request):
+    office = request.user.managerprofile.office
+    form = OccupancyReportForm(request.GET or None)
+    month = form.cleaned_data['month'] if form.is_valid() else None
+    first = (month or date.today()).replace(day=1)
+    last = (first + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+
+    return render(request, 'reservations/occupancy_report.html', {
+        'form': form if form.is_bound else OccupancyReportForm(initial={'month': first}),
+        'office': office,
+        'month': first,
+        'previous_month': (first - timedelta(days=1)).replace(day=1),
+        'next_month': last + timedelta(days=1),
+        'report': facility_occupancy(office.id, first, last),
+    })
+
+# イベント等の一括予約（管理者用）
+@manager_required
+def block_booking(request):
+    office = request.user.managerprofile.office
+    results = None
+
+    if request.method == 'POST':
+        form = BlockBookingForm(request.POST, office=office)
+        if form.is_valid():
+            try:
+                results = bulk_book(form.requests(), user=request.user)
+            except SlotAlreadyReserved:
+                form.add_error(None, '他の予約と同時に処理されたため登録できませんでした。もう一度お試しください。')
+    else:
+        form = BlockBookingForm(office=office)
+
+    return render(request, 'reservations/block_booking.html', {
+        'form': form,
+        'results': results,
+        'office_name': office.name,
+    })
+
 @manager_required
 def delete_reservation(request, pk):
     if request.method == 'POST':
@@ -203,27 +430,33 @@ def delete_reservation(request, pk):
     return redirect('reservations:reservation_search')  # 一覧ページに戻る
 
 @manager_required
+@read_replica
 def user_manage(request):
     form = UserSearchForm(request.GET or None)
     users = CustomUser.objects.filter(is_superuser=False).exclude(id=request.user.id) 
 
     if form.is_valid():
-        full_name = form.cleaned_data.get('full_name')
-        phone = form.cleaned_data.get('phone')
-        email = form.cleaned_data.get('email')
-
-        if full_name:
-            users = users.filter(full_name__icontains=full_name)
-        if phone:
-            users = users.filter(phone__icontains=phone)
-        if email:
-            users = users.filter(email__icontains=email)
+        # SQLite では FTS5（trigram）で一致度順に検索、それ以外では従来の部分一致
+        users = search_users(
+            users,
+            limit=USER_SEARCH_LIMIT,
+            full_name=form.cleaned_data.get('full_name'),
+            phone=form.cleaned_data.get('phone'),
+            email=form.cleaned_data.get('email'),
+        )
+    else:
+        users = users.order_by('full_name')
 
-    users = users.order_by('full_name')
+    # 件数の上限（USER_SEARCH_LIMIT）は一致度順の検索だけにかかり、一覧と部分一致の検索は全件をページ送りできる
+    page_obj = Paginator(users, USER_MANAGE_PAGE_SIZE).get_page(request.GET.get('page'))
+    query = request.GET.copy()
+    query.pop('page', None)
 
     return render(request, 'reservations/user_manage.html', {
         'form': form,
-        'users': users,
+        'users': page_obj.object_list,
+        'page_obj': page_obj,
+        'query': query.urlencode(),
     })
 
 @manager_required
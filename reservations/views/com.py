@@ -35,7 +35,8 @@ def login_view(request):
 
             # 管理者かどうか判定し、遷移先を分ける
             if hasattr(user, 'managerprofile'):
-                return render(request, 'reservations/manager_home.html', {'now_hour': now_hour})
+                url = reverse('reservations:manager_home') + '?' + urlencode(params)
+                return redirect(url)
             else:
                 url = reverse('reservations:user_home') + '?' + urlencode(params)
                 return redirect(url)
@@ -1,10 +1,16 @@
 from datetime import date, timedelta
 from django.shortcuts import render, redirect
 from django.contrib import messages
-from django.core.exceptions import ObjectDoesNotExist
-from ..models import FacilityItem, Facility ,TemporaryReservationUser, Reservation, FacilityTimeSlot
-from ..forms import ManagementOffice, GuestDateForm, GuestTimeSlotForm, GuestUserForm
-from ..utils import clear_guest_reservation_session
+from ..models import TemporaryReservationUser
+from ..forms import GuestDateForm, GuestTimeSlotForm, GuestUserForm
+from django.urls import reverse
+from ..utils import clear_guest_reservation_session, availability_grid_response
+from ..booking import book_slot, SlotAlreadyReserved
+from ..guests import upsert_guest
+from ..holds import hold_token, take_hold, release_holds
+from ..availability import available_time_slots as available_time_slots_for, availability_grid, grid_items
+from ..catalog import get_catalog
+from yoyakumate.db_router import read_replica
 
 def guest_reservation(request):
     # セッション初期化（非登録ユーザー用）
@@ -13,21 +19,22 @@ def guest_reservation(request):
 
 def guest_select_office(request):
     error = None
-    offices = ManagementOffice.objects.all()
+    catalog = get_catalog()
+    offices = catalog.offices
 
     # セッション初期化（非登録ユーザー用）
     clear_guest_reservation_session(request)
 
     # 管理所が1件だけなら自動選択して次へ遷移
-    if offices.count() == 1:
-        request.session['guest_selected_office'] = offices.first().id
+    if catalog.single_office():
+        request.wizard['guest_selected_office'] = catalog.single_office().id
         return redirect('reservations:guest_select_facility')
 
     # POST処理（選択された管理所を保存）
     if request.method == 'POST':
         office_id = request.POST.get('office_id')
-        if offices.filter(id=office_id).exists():
-            request.session['guest_selected_office'] = office_id
+        if catalog.office(office_id):
+            request.wizard['guest_selected_office'] = office_id
             return redirect('reservations:guest_select_facility')
         else:
             error = '有効な管理所を選択してください。'
@@ -37,7 +44,7 @@ def guest_select_office(request):
                 'selected_office': None,
             })
 
-    selected_office = request.session.get('guest_selected_office')
+    selected_office = request.wizard.get('guest_selected_office')
 
     return render(request, 'reservations/guest/get_select_office.html', {
         'offices': offices,
@@ -46,21 +53,21 @@ def guest_select_office(request):
     })
 
 def guest_select_facility(request):
-    offices = ManagementOffice.objects.all()
-    single_office = (offices.count() == 1)
+    catalog = get_catalog()
+    single_office = catalog.single_office() is not None
 
-    office_id = request.session.get('guest_selected_office')
+    office_id = request.wizard.get('guest_selected_office')
     if not office_id:
         return redirect('reservations:guest_select_office')
 
-    selected_facility = request.session.get('guest_selected_facility')
-    facilities = Facility.objects.filter(office_id=office_id)
+    selected_facility = request.wizard.get('guest_selected_facility')
+    facilities = catalog.facilities_of(office_id)
     error = None
 
     if request.method == 'POST':
         facility_id = request.POST.get('facility_id')
-        if facilities.filter(id=facility_id).exists():
-            request.session['guest_selected_facility'] = facility_id
+        if catalog.facility(facility_id, office_id=office_id):
+            request.wizard['guest_selected_facility'] = facility_id
             return redirect('reservations:guest_select_item')
         else:
             error = '有効な施設タイプを選択してください。'
@@ -74,18 +81,19 @@ def guest_select_facility(request):
     return render(request, 'reservations/guest/get_select_facility.html', context)
 
 def guest_select_item(request):
-    facility_id = request.session.get('guest_selected_facility')
+    facility_id = request.wizard.get('guest_selected_facility')
     if not facility_id:
         return redirect('reservations:guest_select_facility')
 
-    items = FacilityItem.objects.filter(facility_id=facility_id)
-    selected_item = request.session.get('guest_selected_item')
+    catalog = get_catalog()
+    items = catalog.items_of(facility_id)
+    selected_item = request.wizard.get('guest_selected_item')
     error = None
 
     if request.method == 'POST':
         item_id = request.POST.get('item_id')
-        if items.filter(id=item_id).exists():
-            request.session['guest_selected_item'] = item_id
+        if catalog.item(item_id, facility_id=facility_id):
+            request.wizard['guest_selected_item'] = item_id
             return redirect('reservations:guest_select_date')
         else:
             error = '有効な設備を選択してください。'
@@ -98,13 +106,17 @@ def guest_select_item(request):
 
 
 def guest_select_date(request):
-    selected_date = request.session.get('guest_selected_date')
+    selected_date = request.wizard.get('guest_selected_date')
     error = None
 
+    # 予約可能期間（30日先まで）の空き状況を表示（集計クエリ1回）
+    items = grid_items(item_id=request.wizard.get('guest_selected_item'))
+    grid = availability_grid(items, items[0].facility_id if items else None, date.today(), 31)
+
     if request.method == 'POST':
         form = GuestDateForm(request.POST)
         if form.is_valid():
-            request.session['guest_selected_date'] = str(form.cleaned_data['date'])
+            request.wizard['guest_selected_date'] = str(form.cleaned_data['date'])
             return redirect('reservations:guest_select_time_slot')
         else:
             error = '日付を正しく選択してください。'
@@ -119,32 +131,41 @@ def guest_select_date(request):
         'error': error,
         'min_date': form.fields['date'].widget.attrs['min'],
         'max_date': form.fields['date'].widget.attrs['max'],
+        'grid': grid,
     })
 
 
+@read_replica
+def guest_availability_grid(request):
+    # 空き状況一覧（ゲスト用、HTML / JSON）
+    return availability_grid_response(
+        request,
+        facility_id=request.wizard.get('guest_selected_facility'),
+        item_id=request.wizard.get('guest_selected_item'),
+        max_days=31,
+        back_url=reverse('reservations:guest_select_date'),
+    )
+
+
 def guest_select_time_slot(request):
-    facility_id = request.session.get('guest_selected_facility')
-    selected_date = request.session.get('guest_selected_date')
+    facility_id = request.wizard.get('guest_selected_facility')
+    item_id = request.wizard.get('guest_selected_item')
+    selected_date = request.wizard.get('guest_selected_date')
 
-    if not (facility_id and selected_date):
+    if not (facility_id and item_id and selected_date):
         return redirect('reservations:guest_select_facility')
 
-    try:
-        facility = Facility.objects.get(id=facility_id)
-    except ObjectDoesNotExist:
+    catalog = get_catalog()
+    item = catalog.item(item_id, facility_id=facility_id)
+    if item is None:
         messages.error(request, "施設が見つかりませんでした。")
         return redirect('reservations:guest_select_facility')
 
-    # 予約済み時間帯の取得（ゲストは編集中の予約がないので除外不要）
-    reserved_qs = Reservation.objects.filter(
-        facilityItem__facility=facility,
-        date=selected_date
+    # 空き状況インデックスから設備ごとの空き時間帯を取得（ゲストは編集中の予約がないので除外不要）
+    holder = hold_token(request.wizard)
+    all_time_slots, available_time_slots = available_time_slots_for(
+        item, selected_date, holder=holder, slots=catalog.slots_of(item.facility_id)
     )
-    reserved_start_times = set(reserved_qs.values_list('start_time', flat=True))
-
-    # 全時間帯の取得とフィルタリング
-    all_time_slots = FacilityTimeSlot.objects.filter(facility=facility).order_by('start_time')
-    available_time_slots = [ts for ts in all_time_slots if ts.start_time not in reserved_start_times]
 
     reserved_count = len(all_time_slots) - len(available_time_slots)
     if reserved_count == 0:
@@ -155,7 +176,7 @@ def guest_select_time_slot(request):
         for ts in available_time_slots
     ]
 
-    selected_slot = request.session.get('guest_selected_time_slot')
+    selected_slot = request.wizard.get('guest_selected_time_slot')
 
     if request.method == 'POST':
         form = GuestTimeSlotForm(
@@ -166,8 +187,12 @@ def guest_select_time_slot(request):
             time_choices=time_choices
         )
         if form.is_valid():
-            request.session['guest_selected_time_slot'] = form.cleaned_data['time_slot'].id
-            return redirect('reservations:guest_user_info')
+            time_slot = form.cleaned_data['time_slot']
+            # 選択した時間帯を一定時間仮押さえする（お客様情報の入力中も保持）
+            if take_hold(item.id, selected_date, time_slot.start_time, holder):
+                request.wizard['guest_selected_time_slot'] = time_slot.id
+                return redirect('reservations:guest_user_info')
+            form.add_error('time_slot', 'この時間帯は他の方が予約手続き中です。別の時間帯を選択してください。')
     else:
         form = GuestTimeSlotForm(
             facility_id=facility_id,
@@ -188,17 +213,19 @@ def guest_user_info(request):
     if request.method == 'POST':
         form = GuestUserForm(request.POST)
         if form.is_valid():
-            guest = TemporaryReservationUser.objects.create(
-                full_name=form.cleaned_data['full_name'],
-                phone=form.cleaned_data['phone'],
-                email=form.cleaned_data['email']
-            )
-            request.session['guest_guest_user_info'] = form.cleaned_data
+            # 氏名・連絡先はサーバー側のゲスト行に保存し、Cookie にはゲストの ID だけを置く
+            # （予約されずに残った行は purge_stale_records で削除される）
+            guest_user = upsert_guest(**form.cleaned_data)
+            request.wizard['guest_user_id'] = guest_user.id
             return redirect('reservations:guest_reserve_confirm')
         else:
             error = 'すべての項目を正しく入力してください。'
     else:
-        form = GuestUserForm()
+        # 確認画面から戻った場合は入力済みの内容を表示する
+        initial = TemporaryReservationUser.objects.filter(
+            id=request.wizard.get('guest_user_id')
+        ).values('full_name', 'phone', 'email').first()
+        form = GuestUserForm(initial=initial)
 
     return render(request, 'reservations/guest/get_user_info.html', {
         'form': form,
@@ -206,32 +233,39 @@ def guest_user_info(request):
     })
 
 def guest_reserve_confirm(request):
-    office_id = request.session.get('guest_selected_office')
-    facility_id = request.session.get('guest_selected_facility')
-    item_id = request.session.get('guest_selected_item')
-    selected_date = request.session.get('guest_selected_date')
-    time_slot_id = request.session.get('guest_selected_time_slot')
-    guest_info = request.session.get('guest_guest_user_info', {})
-
-    if not all([office_id, facility_id, item_id, selected_date, time_slot_id, guest_info]):
+    office_id = request.wizard.get('guest_selected_office')
+    facility_id = request.wizard.get('guest_selected_facility')
+    item_id = request.wizard.get('guest_selected_item')
+    selected_date = request.wizard.get('guest_selected_date')
+    time_slot_id = request.wizard.get('guest_selected_time_slot')
+    guest_user_id = request.wizard.get('guest_user_id')
+
+    if not all([office_id, facility_id, item_id, selected_date, time_slot_id, guest_user_id]):
         return redirect('reservations:guest_select_office')
 
-    office = ManagementOffice.objects.get(id=office_id)
-    facility = Facility.objects.get(id=facility_id)
-    item = FacilityItem.objects.get(id=item_id)
-    time_slot = FacilityTimeSlot.objects.get(id=time_slot_id)
+    catalog = get_catalog()
+    office = catalog.office(office_id)
+    facility = catalog.facility(facility_id)
+    item = catalog.item(item_id)
+    time_slot = catalog.slot(time_slot_id)
+    if not all([office, facility, item, time_slot]):
+        # 選択中に管理所・設備・時間帯が削除された
+        clear_guest_reservation_session(request)
+        return redirect('reservations:guest_select_office')
 
-    if request.method == 'POST':
-        already_reserved = Reservation.objects.filter(
-            facilityItem=item,
-            date=selected_date,
-            start_time=time_slot.start_time,
-            end_time=time_slot.end_time
-        ).exists()
+    guest_info = TemporaryReservationUser.objects.filter(id=guest_user_id).first()
+    if guest_info is None:
+        # 入力後に削除された（予約のないゲストの削除など）
+        request.wizard.pop('guest_user_id', None)
+        return redirect('reservations:guest_user_info')
 
-        if already_reserved:
+    if request.method == 'POST':
+        holder = hold_token(request.wizard)
+        try:
+            book_slot(item, selected_date, time_slot, guest=guest_info, holder=holder)
+        except SlotAlreadyReserved:
             error = '選択された日時は既に予約されています。別の時間帯または設備を選択してください。'
-            return render(request, 'reservations/guest/reserve_confirm.html', {
+            return render(request, 'reservations/guest/get_reserve_confirm.html', {
                 'office': office,
                 'facility': facility,
                 'item': item,
@@ -241,24 +275,7 @@ def guest_reserve_confirm(request):
                 'error': error,
             })
 
-        # 新規予約作成（非登録ユーザー）
-        guest_info = request.session.get('guest_guest_user_info', {})
-
-        guest_user = TemporaryReservationUser.objects.create(
-            full_name=guest_info.get('full_name', 'ゲスト'),
-            phone=guest_info.get('phone', ''),
-            email=guest_info.get('email', '')
-        )
-
-        Reservation.objects.create(
-            facilityItem=item,
-            date=selected_date,
-            start_time=time_slot.start_time,
-            end_time=time_slot.end_time,
-            user=None,
-            guest=guest_user  # ✅ ForeignKey にオブジェクトを渡す
-        )
-
+        release_holds(holder)
         clear_guest_reservation_session(request)
         return redirect('reservations:guest_complete')
 
@@ -3,69 +3,81 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ObjectDoesNotExist
-from ..models import Reservation, FacilityItem, Facility, Reservation
-from ..forms import ManagementOffice, FacilityTimeSlot, SelectDateForm, SelectTimeSlotForm
-from ..utils import clear_reservation_session
+from ..models import Reservation
+from ..forms import MEMBER_BOOKING_DAYS, SelectDateForm, SelectTimeSlotForm, RecurringReservationForm, QuickReserveForm
+from django.http import JsonResponse
+from django.urls import reverse
+from ..utils import clear_reservation_session, availability_grid_response
+from ..booking import book_slot, move_reservation, bulk_book, SlotAlreadyReserved
+from ..holds import hold_token, take_hold, release_holds
+from ..availability import available_time_slots as available_time_slots_for, availability_grid, grid_items
+from ..catalog import get_catalog
+from yoyakumate.db_router import read_replica
 
 # 1. 管理所選択
 @login_required
 def select_office(request, reservation_id=None):
     error = None
-    offices = ManagementOffice.objects.all()
+    catalog = get_catalog()
+    offices = catalog.offices
     
     if reservation_id:
         reservation = get_object_or_404(Reservation, id=reservation_id, user=request.user)
+        item = catalog.item(reservation.facilityItem_id)
+        if item is None:
+            messages.error(request, 'この予約の設備が見つかりません。')
+            return redirect('reservations:user_home')
+        facility = catalog.facility(item.facility_id)
 
         # 編集中の予約情報をセッションに保存
-        request.session['editing_reservation_id'] = reservation.id
-        request.session['selected_office'] = reservation.facilityItem.facility.office.id
-        request.session['selected_facility'] = reservation.facilityItem.facility.id
-        request.session['selected_item'] = reservation.facilityItem.id
-        request.session['selected_date'] = str(reservation.date)
+        request.wizard['editing_reservation_id'] = reservation.id
+        request.wizard['selected_office'] = facility.office_id
+        request.wizard['selected_facility'] = facility.id
+        request.wizard['selected_item'] = item.id
+        request.wizard['selected_date'] = str(reservation.date)
 
         # 予約の時間帯を取得しセッションに保存
-        time_slot = FacilityTimeSlot.objects.filter(
-            facility=reservation.facilityItem.facility,
-            start_time=reservation.start_time,
-            end_time=reservation.end_time
-        ).first()
+        time_slot = next((
+            ts for ts in catalog.slots_of(facility.id)
+            if ts.start_time == reservation.start_time and ts.end_time == reservation.end_time
+        ), None)
         
         if time_slot:
-            request.session['selected_time_slot'] = str(time_slot.id)
+            request.wizard['selected_time_slot'] = str(time_slot.id)
         else:
-            request.session.pop('selected_time_slot', None)
+            request.wizard.pop('selected_time_slot', None)
 
     # 編集モードでなければセッションをクリア
     if reservation_id is None:
         clear_reservation_session(request)
 
     # 管理所が1件だけなら自動選択して次へ遷移
-    if offices.count() == 1:
-        request.session['selected_office'] = offices.first().id
+    if catalog.single_office():
+        request.wizard['selected_office'] = catalog.single_office().id
         return redirect('reservations:select_facility')
 
     # 編集モード時の処理
     if reservation_id:
         if request.method == 'POST':
             office_id = request.POST.get('office_id')
-            if offices.filter(id=office_id).exists():
-                request.session['selected_office'] = office_id
+            if catalog.office(office_id):
+                request.wizard['selected_office'] = office_id
                 return redirect('reservations:select_facility')
             else:
                 error = '有効な管理所を選択してください。'
                 return render(request, 'reservations/select_office.html', {
                     'offices': offices,
                     'error': error,
-                    'selected_office': int(request.session.get('selected_office')),
+                    'selected_office': int(request.wizard.get('selected_office')),
                 })
 
     else:
         # 新規予約モードの処理
         if request.method == 'POST':
             office_id = request.POST.get('office_id')
-            if offices.filter(id=office_id).exists():
-                request.session['selected_office'] = office_id
-                request.session.pop('editing_reservation_id', None)
+            if catalog.office(office_id):
+                request.wizard['selected_office'] = office_id
+                request.wizard.pop('editing_reservation_id', None)
                 return redirect('reservations:select_facility')
             else:
                 error = '有効な管理所を選択してください。'
@@ -75,7 +87,7 @@ def select_office(request, reservation_id=None):
                     'selected_office': None,
                 })
 
-    selected_office = request.session.get('selected_office')
+    selected_office = request.wizard.get('selected_office')
     
     return render(request, 'reservations/select_office.html', {
         'offices': offices,
@@ -86,22 +98,22 @@ def select_office(request, reservation_id=None):
 # 2. 施設タイプ選択
 @login_required
 def select_facility(request):
-    offices = ManagementOffice.objects.all()
-    single_office = (offices.count() == 1)
+    catalog = get_catalog()
+    single_office = catalog.single_office() is not None
     
-    office_id = request.session.get('selected_office')
+    office_id = request.wizard.get('selected_office')
     
     if not office_id:
         return redirect('reservations:select_office')
 
-    selected_facility = request.session.get('selected_facility')
+    selected_facility = request.wizard.get('selected_facility')
     
-    facilities = Facility.objects.filter(office_id=office_id)
+    facilities = catalog.facilities_of(office_id)
 
     if request.method == 'POST':
         facility_id = request.POST.get('facility_id')
-        if facilities.filter(id=facility_id).exists():
-            request.session['selected_facility'] = facility_id
+        if catalog.facility(facility_id, office_id=office_id):
+            request.wizard['selected_facility'] = facility_id
             return redirect('reservations:select_item')
         else:
             error = '有効な施設タイプを選択してください。'
@@ -117,17 +129,18 @@ def select_facility(request):
 # 3. 具体的な設備選択
 @login_required
 def select_item(request):
-    facility_id = request.session.get('selected_facility')
-    selected_item = request.session.get('selected_item')
+    facility_id = request.wizard.get('selected_facility')
+    selected_item = request.wizard.get('selected_item')
     if not facility_id:
         return redirect('reservations:select_facility')
 
-    items = FacilityItem.objects.filter(facility_id=facility_id)
+    catalog = get_catalog()
+    items = catalog.items_of(facility_id)
 
     if request.method == 'POST':
         item_id = request.POST.get('item_id')
-        if items.filter(id=item_id).exists():
-            request.session['selected_item'] = item_id
+        if catalog.item(item_id, facility_id=facility_id):
+            request.wizard['selected_item'] = item_id
             return redirect('reservations:select_date')
         else:
             error = '有効な設備を選択してください。'
@@ -142,12 +155,16 @@ def select_item(request):
 # 4. 日付選択
 @login_required
 def select_date(request):
-    if not request.session.get('selected_item'):
+    if not request.wizard.get('selected_item'):
         return redirect('reservations:select_item')
 
     today = datetime.date.today()
     max_date = today + datetime.timedelta(days=6)
 
+    # 1週間分の空き状況を日付選択画面に表示（集計クエリ1回）
+    items = grid_items(item_id=request.wizard.get('selected_item'))
+    grid = availability_grid(items, items[0].facility_id if items else None, today, 7)
+
     if request.method == 'POST':
         form = SelectDateForm(request.POST)
         if form.is_valid():
@@ -159,6 +176,7 @@ def select_date(request):
                     'error': error,
                     'min_date': today.isoformat(),
                     'max_date': max_date.isoformat(),
+                    'grid': grid,
                 })
             if selected_date > max_date:
                 error = '選択できるのは今日から1週間以内の日付です。'
@@ -167,11 +185,12 @@ def select_date(request):
                     'error': error,
                     'min_date': today.isoformat(),
                     'max_date': max_date.isoformat(),
+                    'grid': grid,
                 })
-            request.session['selected_date'] = str(selected_date)
+            request.wizard['selected_date'] = str(selected_date)
             return redirect('reservations:select_time_slot')
     else:
-        initial_date = request.session.get('selected_date')
+        initial_date = request.wizard.get('selected_date')
         if initial_date:
             form = SelectDateForm(initial={'date': initial_date})
         else:
@@ -183,35 +202,44 @@ def select_date(request):
         'form': form,
         'min_date': today.isoformat(),
         'max_date': max_date.isoformat(),
+        'grid': grid,
     })
 
+# 空き状況一覧（設備または施設タイプ単位、HTML / JSON）
+@login_required
+@read_replica
+def availability_grid_view(request):
+    return availability_grid_response(
+        request,
+        facility_id=request.wizard.get('selected_facility'),
+        item_id=request.wizard.get('selected_item'),
+        max_days=7,
+        back_url=reverse('reservations:select_date'),
+    )
+
 # 5. 時間帯選択
 @login_required
 def select_time_slot(request):
-    item_id = request.session.get('selected_item')
-    selected_date = request.session.get('selected_date')
+    item_id = request.wizard.get('selected_item')
+    selected_date = request.wizard.get('selected_date')
 
     if not (item_id and selected_date):
         return redirect('reservations:select_date')
 
-    item = FacilityItem.objects.get(id=item_id)
+    catalog = get_catalog()
+    item = catalog.item(item_id)
+    if item is None:
+        return redirect('reservations:select_item')
 
     # 編集中の予約IDをセッションから取得（なければ None）
-    editing_reservation_id = request.session.get('editing_reservation_id')
+    editing_reservation_id = request.wizard.get('editing_reservation_id')
 
-    # 予約済み時間帯のstart_timeを取得（編集中の予約は除外）
-    reserved_qs = Reservation.objects.filter(
-        facilityItem__facility=item.facility,
-        date=selected_date,
+    # 空き状況インデックスから設備ごとの空き時間帯を取得（編集中の予約は空きとして扱う）
+    holder = hold_token(request.wizard)
+    all_time_slots, available_time_slots = available_time_slots_for(
+        item, selected_date, exclude_reservation_id=editing_reservation_id, holder=holder,
+        slots=catalog.slots_of(item.facility_id),
     )
-    if editing_reservation_id:
-        reserved_qs = reserved_qs.exclude(id=editing_reservation_id)
-
-    reserved_start_times = set(reserved_qs.values_list('start_time', flat=True))
-
-    all_time_slots = FacilityTimeSlot.objects.filter(facility=item.facility).order_by('start_time')
-
-    available_time_slots = [ts for ts in all_time_slots if ts.start_time not in reserved_start_times]
 
     reserved_count = len(all_time_slots) - len(available_time_slots)
     if reserved_count == 0:
@@ -225,10 +253,15 @@ def select_time_slot(request):
     if request.method == 'POST':
         form = SelectTimeSlotForm(request.POST, time_choices=time_choices)
         if form.is_valid():
-            request.session['selected_time_slot'] = form.cleaned_data['time_slot']
-            return redirect('reservations:reserve_confirm')
+            time_slot_id = form.cleaned_data['time_slot']
+            time_slot = next(ts for ts in available_time_slots if str(ts.id) == time_slot_id)
+            # 選択した時間帯を一定時間仮押さえする
+            if take_hold(item.id, selected_date, time_slot.start_time, holder):
+                request.wizard['selected_time_slot'] = time_slot_id
+                return redirect('reservations:reserve_confirm')
+            form.add_error('time_slot', 'この時間帯は他の方が予約手続き中です。別の時間帯を選択してください。')
     else:
-        initial_time_slot = request.session.get('selected_time_slot')
+        initial_time_slot = request.wizard.get('selected_time_slot')
         if initial_time_slot:
             form = SelectTimeSlotForm(time_choices=time_choices, initial={'time_slot': initial_time_slot})
         else:
@@ -239,37 +272,48 @@ def select_time_slot(request):
 # 6. 予約確認・保存
 @login_required
 def reserve_confirm(request):
-    office_id = request.session.get('selected_office')
-    facility_id = request.session.get('selected_facility')
-    item_id = request.session.get('selected_item')
-    selected_date = request.session.get('selected_date')
-    time_slot_id = request.session.get('selected_time_slot')
+    office_id = request.wizard.get('selected_office')
+    facility_id = request.wizard.get('selected_facility')
+    item_id = request.wizard.get('selected_item')
+    selected_date = request.wizard.get('selected_date')
+    time_slot_id = request.wizard.get('selected_time_slot')
 
     if not all([office_id, facility_id, item_id, selected_date, time_slot_id]):
         return redirect('reservations:select_office')
 
-    office = ManagementOffice.objects.get(id=office_id)
-    facility = Facility.objects.get(id=facility_id)
-    item = FacilityItem.objects.get(id=item_id)
-    time_slot = FacilityTimeSlot.objects.get(id=time_slot_id)
+    catalog = get_catalog()
+    office = catalog.office(office_id)
+    facility = catalog.facility(facility_id)
+    item = catalog.item(item_id)
+    time_slot = catalog.slot(time_slot_id)
+    if not all([office, facility, item, time_slot]):
+        # 選択中に管理所・設備・時間帯が削除された
+        clear_reservation_session(request)
+        return redirect('reservations:select_office')
 
     # 編集中の予約ID（編集モード判定）
-    editing_reservation_id = request.session.get('editing_reservation_id')
+    editing_reservation_id = request.wizard.get('editing_reservation_id')
 
     if request.method == 'POST':
+        # 存在チェックは行わず、一意制約付きの1回の書き込みで競合を判定する
+        holder = hold_token(request.wizard)
+        try:
+            if editing_reservation_id:
+                try:
+                    reservation = Reservation.objects.get(id=editing_reservation_id, user=request.user)
+                except ObjectDoesNotExist:
+                    messages.error(request, '編集中の予約が見つかりません。')
+                    clear_reservation_session(request)
+                    return redirect('reservations:select_office')
 
-        # 予約済みチェック（編集中の自分の予約は除外）
-        already_reserved_qs = Reservation.objects.filter(
-            facilityItem=item,
-            date=selected_date,
-            start_time=time_slot.start_time,
-            end_time=time_slot.end_time
-        )
-        if editing_reservation_id:
-            already_reserved_qs = already_reserved_qs.exclude(id=editing_reservation_id)
-        already_reserved = already_reserved_qs.exists()
-
-        if already_reserved:
+                move_reservation(reservation, item, selected_date, time_slot, user=request.user, holder=holder)
+
+                # 編集用セッションをクリア
+                del request.wizard['editing_reservation_id']
+            else:
+                # 新規予約作成処理
+                book_slot(item, selected_date, time_slot, user=request.user, holder=holder)
+        except SlotAlreadyReserved:
             error = '選択された日時は既に予約されています。別の時間帯または設備を選択してください。'
 
             return render(request, 'reservations/reserve_confirm.html', {
@@ -280,36 +324,10 @@ def reserve_confirm(request):
                 'time_slot': time_slot,
                 'error': error,
             })
-        else:
-            if editing_reservation_id:
-                try:
-                    reservation = Reservation.objects.get(id=editing_reservation_id)
-                except ObjectDoesNotExist:
-                    messages.error(request, '編集中の予約が見つかりません。')
-                    clear_reservation_session(request)
-                    return redirect('reservations:select_office')
 
-                reservation.facilityItem = item
-                reservation.date = selected_date
-                reservation.start_time = time_slot.start_time
-                reservation.end_time = time_slot.end_time
-                reservation.user = request.user
-                reservation.save()
-                
-                # 編集用セッションをクリア
-                del request.session['editing_reservation_id']
-            else:
-                # 新規予約作成処理
-                Reservation.objects.create(
-                    facilityItem=item,
-                    date=selected_date,
-                    start_time=time_slot.start_time,
-                    end_time=time_slot.end_time,
-                    user=request.user
-                )
-
-            # セッションをクリア
-            clear_reservation_session(request)
+        # 仮押さえを解放し、セッションをクリア
+        release_holds(holder)
+        clear_reservation_session(request)
 
         return redirect('reservations:user_home')
 
@@ -335,3 +353,156 @@ def reservation_delete(request, reservation_id):
     return render(request, 'reservations/reservation_confirm_delete.html', {
         'reservation': reservation,
     })
+
+# 定期予約（毎週・隔週でまとめて予約）
+@login_required
+def recurring_reserve(request):
+    results = None
+    catalog = get_catalog()
+    facility = catalog.facility(request.GET.get('facility') or request.POST.get('facility'))
+    if facility is None:
+        # 先に施設を選ぶ（設備・時間帯の選択肢をその施設に絞るため）
+        return render(request, 'reservations/recurring_reserve.html', {
+            'offices': [
+                {'office': office, 'facilities': catalog.facilities_of(office.id)}
+                for office in catalog.offices
+            ],
+        })
+
+    if request.method == 'POST':
+        form = RecurringReservationForm(request.POST, facility_id=facility.id)
+        if form.is_valid():
+            item = form.cleaned_data['item']
+            time_slot = form.cleaned_data['time_slot']
+            try:
+                results = bulk_book([(item, day, time_slot) for day in form.dates()], user=request.user)
+            except SlotAlreadyReserved:
+                form.add_error(None, '他の予約と同時に処理されたため登録できませんでした。もう一度お試しください。')
+    else:
+        form = RecurringReservationForm(facility_id=facility.id)
+
+    return render(request, 'reservations/recurring_reserve.html', {
+        'facility': facility,
+        'form': form,
+        'results': results,
+    })
+
+# 1画面予約（カタログと最初の空き状況は画面と一緒に読み込み、予約は fetch の POST 1回で画面を書き換える）
+@login_required
+def quick_reserve(request):
+    today = datetime.date.today()
+    max_date = today + datetime.timedelta(days=MEMBER_BOOKING_DAYS - 1)
+    catalog = get_catalog()
+    holder = hold_token(request.wizard)
+    error = None
+
+    if request.method == 'POST':
+        form = QuickReserveForm(request.POST)
+        status = 400
+        if form.is_valid():
+            item = form.cleaned_data['item']
+            selected_date = form.cleaned_data['date']
+            time_slot = form.cleaned_data['time_slot']
+            try:
+                book_slot(item, selected_date, time_slot, user=request.user, holder=holder)
+            except SlotAlreadyReserved:
+                error = '選択された日時は既に予約されています。別の時間帯または設備を選択してください。'
+                status = 409
+            else:
+                release_holds(holder)
+                message = (
+                    f"{item.item_name} {selected_date:%Y-%m-%d} "
+                    f"{time_slot.start_time:%H:%M} - {time_slot.end_time:%H:%M} を予約しました。"
+                )
+                if _wants_json(request):
+                    # 画面はそのまま、予約した枠を予約済みにした空き状況を返す
+                    return JsonResponse({
+                        'message': message,
+                        'slots': _quick_slot_rows(catalog, item, selected_date, holder),
+                    })
+                messages.success(request, message)
+                return redirect('reservations:user_home')
+        else:
+            error = '設備・日付・時間帯を正しく選択してください。'
+
+        if _wants_json(request):
+            return JsonResponse({'error': error}, status=status)
+
+    offices = [{'id': o.id, 'name': o.name} for o in catalog.offices]
+    facilities = [
+        {'id': f.id, 'office_id': f.office_id, 'name': f.name}
+        for o in catalog.offices for f in catalog.facilities_of(o.id)
+    ]
+    items = [
+        {'id': i.id, 'facility_id': i.facility_id, 'item_name': i.item_name}
+        for f in facilities for i in catalog.items_of(f['id'])
+    ]
+
+    # 予約できなかった POST では送られた設備・日付を選んだまま表示し直す
+    initial_item = catalog.item(request.POST.get('item')) if request.method == 'POST' else None
+    initial_date = _date_or_none(request.POST.get('date')) if request.method == 'POST' else None
+    if initial_date is None or not today <= initial_date <= max_date:
+        initial_date = today + datetime.timedelta(days=1)
+    if initial_item is None:
+        # 先頭の管理所・施設の先頭の設備
+        first_facility = next((f for f in facilities if offices and f['office_id'] == offices[0]['id']), None)
+        first_items = catalog.items_of(first_facility['id']) if first_facility else []
+        initial_item = first_items[0] if first_items else None
+
+    # 最初に選ばれる設備・日付の空き状況は画面に埋め込み、その組み合わせのまま予約する場合は取得を省く
+    initial_slots = None
+    if initial_item is not None:
+        initial_slots = {
+            'item': initial_item.id,
+            'date': initial_date.isoformat(),
+            'slots': _quick_slot_rows(catalog, initial_item, initial_date, holder),
+        }
+
+    return render(request, 'reservations/quick_reserve.html', {
+        'catalog': {'offices': offices, 'facilities': facilities, 'items': items},
+        'initial_slots': initial_slots,
+        'min_date': today.isoformat(),
+        'max_date': max_date.isoformat(),
+        'initial_date': initial_date.isoformat(),
+        'error': error,
+    })
+
+def _wants_json(request):
+    # 画面の fetch は Accept: application/json で送る（通常のフォーム送信は HTML を返す）
+    return request.accepts('application/json') and not request.accepts('text/html')
+
+def _date_or_none(value):
+    try:
+        return datetime.date.fromisoformat(value or '')
+    except ValueError:
+        return None
+
+def _quick_slot_rows(catalog, item, selected_date, holder):
+    all_time_slots, available = available_time_slots_for(
+        item, selected_date, holder=holder, slots=catalog.slots_of(item.facility_id)
+    )
+    available_ids = {ts.id for ts in available}
+    return [
+        {
+            'id': ts.id,
+            'label': f"{ts.start_time.strftime('%H:%M')} - {ts.end_time.strftime('%H:%M')}",
+            'free': ts.id in available_ids,
+        }
+        for ts in all_time_slots
+    ]
+
+# 1画面予約用：設備・日付の空き時間帯（JSON）
+@login_required
+def quick_reserve_slots(request):
+    catalog = get_catalog()
+    item = catalog.item(request.GET.get('item'))
+    try:
+        selected_date = datetime.date.fromisoformat(request.GET.get('date', ''))
+    except ValueError:
+        item = None
+    if item is None:
+        return JsonResponse({'error': '設備または日付が正しくありません。'}, status=400)
+
+    return JsonResponse({
+        'slots': _quick_slot_rows(catalog, item, selected_date, hold_token(request.wizard)),
+    })
@@ -4,9 +4,11 @@ from django.contrib.auth.decorators import login_required,user_passes_test
 from django.utils import timezone
 from django.db.models import Q
 from ..models import Reservation
+from yoyakumate.db_router import read_replica
 
 # ホームページ（予約一覧または管理所一覧）
 @login_required
+@read_replica
 def user_home(request):
     user = request.user
     now = timezone.now()
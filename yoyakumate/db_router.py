@@ -0,0 +1,57 @@
+from contextvars import ContextVar
+from functools import wraps
+from django.conf import settings
+
+REPLICA = 'replica'
+PRIMARY = 'default'
+
+# 読み取り専用ビューの実行中だけ True（リクエスト単位）
+_use_replica = ContextVar('db_use_replica', default=False)
+# このリクエスト中に書き込みがあれば True（以降の読み取りは書き込み先から行う）
+_wrote = ContextVar('db_wrote', default=False)
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+def is_pinned(request):
+    # 直前のリクエストで書き込んだ利用者は、レプリカに反映されるまで書き込み先から読む
+    return settings.REPLICA_PIN_COOKIE_NAME in request.COOKIES
+
+
+class ReplicaRouter:
+    """読み取り専用ビューの読み取りだけをレプリカに、それ以外はすべて default に振り分ける"""
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and not _wrote.get() and replica_configured():
+            return REPLICA
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカは default のコピーなので、どちらから読んだオブジェクト同士でも関連付けてよい
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # レプリカのスキーマはスナップショットのコピーで揃える
+        return db == PRIMARY
+
+
+def read_replica(view_func):
+    """GET・HEAD のときだけ、ビュー内の読み取りをレプリカに向ける（書き込み直後の利用者を除く）"""
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or is_pinned(request):
+            return view_func(request, *args, **kwargs)
+        token = _use_replica.set(True)
+        try:
+            return view_func(request, *args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+
+    return wrapper
@@ -0,0 +1,30 @@
+from django.conf import settings
+from yoyakumate.db_router import _wrote, replica_configured
+
+
+class ReplicaPinMiddleware:
+    """書き込みのあったリクエストの後、一定時間は読み取りも default から行うよう Cookie で固定する
+
+    レプリカは定期的にコピーするスナップショットのため、予約直後の一覧などで
+    自分の書き込みが見えない状態を避ける。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if _wrote.get() and replica_configured():
+                response.set_cookie(
+                    settings.REPLICA_PIN_COOKIE_NAME,
+                    '1',
+                    max_age=settings.REPLICA_PIN_SECONDS,
+                    secure=settings.SESSION_COOKIE_SECURE,
+                    httponly=True,
+                    samesite='Lax',
+                )
+            return response
+        finally:
+            _wrote.reset(token)
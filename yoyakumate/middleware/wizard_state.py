@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.core import signing
+
+WIZARD_COOKIE_SALT = 'yoyakumate.wizard_state'
+# 状態を保存したときのログインユーザー（別のユーザーに引き継がないため）
+USER_KEY = '_uid'
+
+
+class WizardState(dict):
+    """予約ウィザードの選択状態（署名付き Cookie に保存し、DB のセッションには書き込まない）"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.modified = False
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.modified = True
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.modified = True
+
+    def pop(self, key, *args):
+        if key in self:
+            self.modified = True
+        return super().pop(key, *args)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+
+def _user_id(request):
+    user = getattr(request, 'user', None)
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+def load_wizard_state(request):
+    raw = request.COOKIES.get(settings.WIZARD_STATE_COOKIE_NAME)
+    if not raw:
+        return WizardState()
+    try:
+        data = signing.loads(raw, salt=WIZARD_COOKIE_SALT, max_age=settings.WIZARD_STATE_COOKIE_AGE)
+    except signing.BadSignature:
+        return WizardState()
+    if not isinstance(data, dict) or data.pop(USER_KEY, None) != _user_id(request):
+        # ログイン・ログアウトをまたいだ状態は破棄する
+        state = WizardState()
+        state.modified = True
+        return state
+    return WizardState(data)
+
+
+class WizardStateMiddleware:
+    """request.wizard を用意する（AuthenticationMiddleware の後に置くこと）
+
+    WIZARD_STATE_BACKEND が 'cookie' なら署名付き Cookie、'session' なら従来どおり DB のセッションを使う。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.WIZARD_STATE_BACKEND != 'cookie':
+            request.wizard = request.session
+            return self.get_response(request)
+
+        request.wizard = load_wizard_state(request)
+        response = self.get_response(request)
+
+        state = request.wizard
+        if state.modified:
+            if state:
+                data = dict(state, **{USER_KEY: _user_id(request)})
+                response.set_cookie(
+                    settings.WIZARD_STATE_COOKIE_NAME,
+                    signing.dumps(data, salt=WIZARD_COOKIE_SALT, compress=True),
+                    max_age=settings.WIZARD_STATE_COOKIE_AGE,
+                    secure=settings.SESSION_COOKIE_SECURE,
+                    httponly=True,
+                    samesite='Lax',
+                )
+            else:
+                response.delete_cookie(settings.WIZARD_STATE_COOKIE_NAME, samesite='Lax')
+        return response
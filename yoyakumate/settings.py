@@ -42,11 +42,13 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 # ミドルウェアの定義（リクエスト・レスポンス処理の中間処理）
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',        # セキュリティ関連の処理
+    'yoyakumate.middleware.replica_pin.ReplicaPinMiddleware', # 書き込み後の読み取りを default に固定
     'django.contrib.sessions.middleware.SessionMiddleware', # セッション管理
     'django.middleware.common.CommonMiddleware',            # 共通処理（リクエストの正規化など）
     'yoyakumate.middleware.log_exception.ExceptionLoggingMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',            # CSRF攻撃防止
     'django.contrib.auth.middleware.AuthenticationMiddleware', # 認証情報管理
+    'yoyakumate.middleware.wizard_state.WizardStateMiddleware', # 予約ウィザードの選択状態
     'django.contrib.messages.middleware.MessageMiddleware', # メッセージ管理
     'django.middleware.clickjacking.XFrameOptionsMiddleware', # クリックジャッキング対策
 ]
@@ -74,13 +76,64 @@ TEMPLATES = [
 WSGI_APPLICATION = 'yoyakumate.wsgi.application'
 
 # データベース設定（開発段階ではSQLiteを利用）
+# SQLite の接続ごとに適用する PRAGMA（環境変数で変更可）
+# WAL にすると書き込み中も読み取りがブロックされず、busy_timeout の間はロック解除を待つ
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000')),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(128 * 1024 * 1024))),
+    'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', '-20000')),  # 負の値は KiB 単位（約20MB）
+    'temp_store': os.getenv('SQLITE_TEMP_STORE', 'MEMORY'),
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',  # SQLiteデータベースエンジン
-        'NAME': '/home/site/db.sqlite3',
+        'NAME': os.getenv('SQLITE_PATH', '/home/site/db.sqlite3'),
+        # 接続をリクエスト間で再利用し、再利用前に生存確認する
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '600')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+            'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000,
+            # トランザクション開始時に書き込みロックを取る（読み取り後の書き込みでロック昇格のデッドロックを起こさない）
+            'transaction_mode': os.getenv('SQLITE_TRANSACTION_MODE', 'IMMEDIATE'),
+        },
+        # テストDBはファイルにする（インメモリ共有キャッシュではロック待ちができず、並行予約テストが成立しないため）
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# 読み取り専用のレプリカ（default を定期的にコピーしたスナップショット、refresh_replica コマンドで更新）
+# SQLITE_REPLICA_PATH を指定したときだけ有効にし、@read_replica を付けたビューの読み取りを振り分ける
+SQLITE_REPLICA_PATH = os.getenv('SQLITE_REPLICA_PATH')
+if SQLITE_REPLICA_PATH:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': SQLITE_REPLICA_PATH,
+        'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE'],
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': ';'.join(
+                [f"PRAGMA {name}={SQLITE_PRAGMAS[name]}" for name in ('busy_timeout', 'mmap_size', 'cache_size', 'temp_store')]
+                + ['PRAGMA query_only=1']
+            ),
+            'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000,
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    }
+
+DATABASE_ROUTERS = ['yoyakumate.db_router.ReplicaRouter']
+
+# 書き込み後、読み取りも default に固定する秒数（レプリカの更新間隔より長くする）
+REPLICA_PIN_COOKIE_NAME = 'read_primary'
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '120'))
+
 # パスワードバリデーションの設定（セキュリティ強化）
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',},  # 類似した属性はNG
@@ -116,6 +169,18 @@ AUTH_USER_MODEL = 'reservations.CustomUser'
 # ログイン画面のURL（認証が必要なページアクセス時のリダイレクト先）
 LOGIN_URL = '/login/'
 
+# 時間帯選択時の仮押さえの有効期間（分）
+SLOT_HOLD_MINUTES = int(os.getenv('SLOT_HOLD_MINUTES', '10'))
+
+# この日数より前の予約を archive_reservations コマンドで保管先（ReservationArchive）へ移す
+RESERVATION_ARCHIVE_DAYS = int(os.getenv('RESERVATION_ARCHIVE_DAYS', '365'))
+
+# 予約ウィザードの選択状態の保存先（'cookie': 署名付き Cookie、'session': DB のセッション）
+# cookie の場合、DB のセッションはログイン・ログアウト時にしか書き込まれない
+WIZARD_STATE_BACKEND = os.getenv('WIZARD_STATE_BACKEND', 'cookie')
+WIZARD_STATE_COOKIE_NAME = 'wizard_state'
+WIZARD_STATE_COOKIE_AGE = 60 * 60 * 24
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,  # 既存のロガーを無効にしない